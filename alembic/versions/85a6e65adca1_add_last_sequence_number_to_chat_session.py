@@ -0,0 +1,73 @@
+"""Add last sequence number to chat session, and space out message sequence numbers
+
+Revision ID: 85a6e65adca1
+Revises: 7cc8cbfe072d
+Create Date: 2026-10-18 14:20:11.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = '85a6e65adca1'
+down_revision = '7cc8cbfe072d'
+branch_labels = None
+depends_on = None
+
+# NB: keep in sync with database.sequence.SEQUENCE_GAP at the time of this migration
+SEQUENCE_GAP = 1024
+
+
+def upgrade() -> None:
+    op.add_column('chat_session', sa.Column('last_sequence_number', sa.Integer(), server_default='0', nullable=False))
+
+    # renumber existing messages SEQUENCE_GAP apart, keeping their current order
+    # (ties in sequence number were ordered by creation time)
+    op.execute(f"""
+        UPDATE chat_message SET sequence_number = renumbered.seq_num * {SEQUENCE_GAP}
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_session_id ORDER BY sequence_number, created) AS seq_num
+            FROM chat_message
+        ) AS renumbered
+        WHERE chat_message.id = renumbered.id
+    """)
+    op.execute(f"""
+        UPDATE shared_message SET sequence_number = renumbered.seq_num * {SEQUENCE_GAP}
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY shared_session_id ORDER BY sequence_number, created) AS seq_num
+            FROM shared_message
+        ) AS renumbered
+        WHERE shared_message.id = renumbered.id
+    """)
+    op.execute("""
+        UPDATE chat_session SET last_sequence_number = last_message.sequence_number
+        FROM (
+            SELECT chat_session_id, MAX(sequence_number) AS sequence_number
+            FROM chat_message
+            GROUP BY chat_session_id
+        ) AS last_message
+        WHERE chat_session.id = last_message.chat_session_id
+    """)
+
+
+def downgrade() -> None:
+    # compact sequence numbers back to consecutive integers
+    op.execute("""
+        UPDATE chat_message SET sequence_number = renumbered.seq_num
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_session_id ORDER BY sequence_number, created) AS seq_num
+            FROM chat_message
+        ) AS renumbered
+        WHERE chat_message.id = renumbered.id
+    """)
+    op.execute("""
+        UPDATE shared_message SET sequence_number = renumbered.seq_num
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY shared_session_id ORDER BY sequence_number, created) AS seq_num
+            FROM shared_message
+        ) AS renumbered
+        WHERE shared_message.id = renumbered.id
+    """)
+    op.drop_column('chat_session', 'last_sequence_number')
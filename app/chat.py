@@ -179,6 +179,9 @@ def import_chat_from_share(request: Request, data: auth.AcceptJSON, user_id: Opt
         )
         chat_messages.append(chat_message)
     db_session.execute(insert(ChatMessage), chat_messages)
+    # continue allocating sequence numbers after the copied messages
+    chat_session.last_sequence_number = max([message['sequence_number'] for message in chat_messages] or [0])
+    db_session.add(chat_session)
     db_session.commit()
 
     return str(chat_session_id)
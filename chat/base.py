@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import bisect
+import itertools
 import json
 import uuid
 
@@ -32,14 +35,37 @@ class ChatMessage:
     actor: str
     content: str
     message_id: Optional[uuid.UUID]
+    # token counts of the message as rendered in different ways, see ChatHistory._get_range
+    token_counts: Dict[Hashable, int] = field(default_factory=dict, repr=False, compare=False)
 
 
 @dataclass
 class ChatHistory:
+    """History of a chat session.
+
+    Messages should only be added or removed through the methods here, as
+    these keep an index of message positions, so that looking up a message
+    by id doesn't need to scan the history.
+
+    """
     messages: List[ChatMessage]
     session_id: uuid.UUID
     wallet_address: Optional[str]
 
+    # ordering key of each message, parallel to messages and increasing. Keys
+    # stay fixed as messages get inserted or removed, unlike list positions,
+    # so positions are found by bisecting the keys.
+    _keys: List[float] = field(default_factory=list, init=False, repr=False, compare=False)
+    _key_by_id: Dict[uuid.UUID, float] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # keys of user and commenter messages, for find_next_human_message
+    _human_keys: List[float] = field(default_factory=list, init=False, repr=False, compare=False)
+    _has_duplicate_ids: bool = field(default=False, init=False, repr=False, compare=False)
+    # running sums of message token counts per rendering, see _get_range
+    _token_sums: Dict[Hashable, List[int]] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._reindex()
+
     def add_interaction(self, user_input: str, response: str) -> None:
         """Add interaction to history."""
         self.add_user_message(user_input)
@@ -68,30 +94,35 @@ class ChatHistory:
 
     def _add_message(self, text: str, actor: str, message_id: Optional[uuid.UUID] = None, before_message_id: Optional[uuid.UUID] = None) -> None:
         """Add message to history with given message id if specified, before message id if specified."""
-        insert_idx = None
-        if before_message_id is not None:
-            for idx in range(len(self.messages)):
-                if self.messages[idx].message_id == before_message_id:
-                    insert_idx = idx
-                    break
+        insert_idx = self._find_index(before_message_id) if before_message_id is not None else None
         chat_message = ChatMessage(actor=actor, content=text, message_id=message_id)
-        if insert_idx is not None:
-            self.messages.insert(insert_idx, chat_message)
-        else:
+        if insert_idx is None:
+            key = self._keys[-1] + 1.0 if self._keys else 1.0
             self.messages.append(chat_message)
+            self._keys.append(key)
+        else:
+            prev_key = self._keys[insert_idx - 1] if insert_idx > 0 else self._keys[insert_idx] - 1.0
+            key = (prev_key + self._keys[insert_idx]) / 2
+            if not prev_key < key < self._keys[insert_idx]:
+                # out of float precision between the two keys, renumber everything
+                self._reindex()
+                self._add_message(text, actor, message_id=message_id, before_message_id=before_message_id)
+                return
+            self.messages.insert(insert_idx, chat_message)
+            self._invalidate_token_sums(insert_idx)
+            self._keys.insert(insert_idx, key)
+        self._index_message(chat_message, key)
 
     def find_next_human_message(self, message_id: uuid.UUID) -> Optional[uuid.UUID]:
         """Find the ID of the next human message after the specified one, if any."""
-        next_user_message_id = None
-        start_message_found = False
-        for idx, message in enumerate(self.messages):
-            if message.message_id == message_id:
-                start_message_found = True
-                continue
-            if start_message_found and message.actor in ('user', 'commenter'):
-                next_user_message_id = message.message_id
-                break
-        return next_user_message_id
+        key = self._key_by_id.get(message_id)
+        if key is None:
+            return None
+        for human_key in itertools.islice(self._human_keys, bisect.bisect_right(self._human_keys, key), None):
+            next_message_id = self.messages[bisect.bisect_left(self._keys, human_key)].message_id
+            if next_message_id != message_id:  # skip over repeats of the same id
+                return next_message_id
+        return None
 
     def truncate_from_message(self, message_id: uuid.UUID, before_message_id: Optional[uuid.UUID] = None) -> List[uuid.UUID]:
         """Truncate history from given message id onwards (inclusive), up to a certain message id if specified.
@@ -99,22 +130,64 @@ class ChatHistory:
         Returns list of removed IDs.
 
         """
-        start_idx = None
+        start_idx = self._find_index(message_id)
+        if start_idx is None:
+            return []
         end_idx = None
-        for idx in range(len(self.messages)):
-            if self.messages[idx].message_id == message_id:
-                start_idx = idx
-                if before_message_id:
-                    for idx2 in range(idx + 1, len(self.messages)):
-                        if self.messages[idx2].message_id == before_message_id:
-                            end_idx = idx2
-                            break
-                break
-        if start_idx is not None:
-            removed_ids = [msg.message_id for msg in self.messages[start_idx:end_idx]]
-            self.messages[start_idx:end_idx] = []
-            return removed_ids
-        return []
+        if before_message_id:
+            end_idx = self._find_index(before_message_id)
+            if end_idx is not None and end_idx <= start_idx:
+                # only look for the end after the start, which might be a repeat of the id
+                end_idx = next((idx for idx in range(start_idx + 1, len(self.messages)) if self.messages[idx].message_id == before_message_id), None) if self._has_duplicate_ids else None
+        end_idx = len(self.messages) if end_idx is None else end_idx
+
+        removed = self.messages[start_idx:end_idx]
+        start_key = self._keys[start_idx]
+        end_key = self._keys[end_idx] if end_idx < len(self._keys) else None
+        del self.messages[start_idx:end_idx]
+        self._invalidate_token_sums(start_idx)
+        del self._keys[start_idx:end_idx]
+        human_start = bisect.bisect_left(self._human_keys, start_key)
+        human_end = bisect.bisect_left(self._human_keys, end_key) if end_key is not None else len(self._human_keys)
+        del self._human_keys[human_start:human_end]
+        if self._has_duplicate_ids:
+            # the first message of a removed id might have been removed, but not the others
+            self._reindex()
+        else:
+            for msg in removed:
+                self._key_by_id.pop(msg.message_id, None)
+        return [msg.message_id for msg in removed]
+
+    def _find_index(self, message_id: uuid.UUID) -> Optional[int]:
+        """Position of the message with the given id, if any."""
+        key = self._key_by_id.get(message_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._keys, key)
+
+    def _index_message(self, message: ChatMessage, key: float) -> None:
+        if message.message_id is not None:
+            # if ids repeat, lookups go to the first message with the id, as with a scan
+            existing_key = self._key_by_id.get(message.message_id)
+            if existing_key is not None:
+                self._has_duplicate_ids = True
+            if existing_key is None or key < existing_key:
+                self._key_by_id[message.message_id] = key
+        if message.actor in ('user', 'commenter'):
+            bisect.insort(self._human_keys, key)
+
+    def _invalidate_token_sums(self, idx: int) -> None:
+        """Drop the running token sums from the message at idx onwards, after it changed."""
+        for sums in self._token_sums.values():
+            del sums[idx + 1:]
+
+    def _reindex(self) -> None:
+        self._keys = [float(i + 1) for i in range(len(self.messages))]
+        self._key_by_id = {}
+        self._has_duplicate_ids = False
+        self._human_keys = []
+        for message, key in zip(self.messages, self._keys):
+            self._index_message(message, key)
 
     def __bool__(self):
         return bool(self.messages)
@@ -123,49 +196,46 @@ class ChatHistory:
         return iter(self.messages)
 
     def to_string(self, user_prefix: str = "User", bot_prefix: str = "Assistant", system_prefix: Optional[str] = "System", token_limit: Optional[int] = None, before_message_id : Optional[uuid.UUID] = None) -> str:
-        ret = []
-        for message in self:
-            if before_message_id is not None and message.message_id == before_message_id:
-                break
+        def to_line(message):
             if message.actor == 'user':
                 prefix = user_prefix
             elif message.actor == 'system':
                 if system_prefix is None:
-                    continue
+                    return None
                 prefix = system_prefix
             elif message.actor == 'bot':
                 prefix = bot_prefix
             elif message.actor == 'commenter':
                 # ignore these
-                continue
+                return None
             elif message.actor == 'function':
                 # ignore in text representation, might cause hallucination
-                continue
+                return None
             else:
                 assert 0, f'unrecognized actor: {message.actor}'
-            ret.append(f"{prefix}: {message.content}")
-        if token_limit is not None:
-            total_count = 0
-            for idx in reversed(range(len(ret))):
-                count = utils.get_token_len(ret[idx])
-                if total_count + count > token_limit:
-                    ret = ret[idx + 1:]
-                    break
-                total_count += count
+            return f"{prefix}: {message.content}"
+
+        def token_len(message):
+            line = to_line(message)
+            return utils.get_token_len(line) if line is not None else 0
+
+        start_idx, end_idx = self._get_range(('string', user_prefix, bot_prefix, system_prefix), token_len, token_limit, before_message_id)
+        ret = []
+        for message in itertools.islice(self.messages, start_idx, end_idx):
+            line = to_line(message)
+            if line is not None:
+                ret.append(line)
         return "\n".join(ret)
 
     def to_openai_messages(self, system_message: str, system_prefix: Optional[str] = "System", token_limit: Optional[int] = None, before_message_id : Optional[uuid.UUID] = None) -> List[BaseMessage]:
-        ret = [SystemMessage(content=(system_message))]
-        for message in self:
+        def to_openai_message(message):
             additional_kwargs = {}
             content = message.content
-            if before_message_id is not None and message.message_id == before_message_id:
-                break
             if message.actor == 'user':
                 message_cls = HumanMessage
             elif message.actor == 'system':
                 if system_prefix is None:
-                    continue
+                    return None
                 message_cls = AIMessage
             elif message.actor == 'function':
                 message_cls = AIMessage
@@ -175,20 +245,54 @@ class ChatHistory:
                 message_cls = AIMessage
             elif message.actor == 'commenter':
                 # ignore these
-                continue
+                return None
             else:
                 assert 0, f'unrecognized actor: {message.actor}'
-            ret.append(message_cls(content=content, additional_kwargs=additional_kwargs))
+            return message_cls(content=content, additional_kwargs=additional_kwargs)
+
+        def token_len(message):
+            openai_message = to_openai_message(message)
+            if openai_message is None:
+                return 0
+            return utils.get_token_len(openai_message.content) + utils.get_token_len(json.dumps(openai_message.additional_kwargs))
+
         if token_limit is not None:
-            total_count = utils.get_token_len(ret[0].content)
-            for idx in reversed(range(1, len(ret))):
-                count = utils.get_token_len(ret[idx].content) + utils.get_token_len(json.dumps(ret[idx].additional_kwargs))
-                if total_count + count > token_limit:
-                    ret = [ret[0]] + ret[idx + 1:]
-                    break
-                total_count += count
+            token_limit -= utils.get_token_len(system_message)
+        start_idx, end_idx = self._get_range(('openai', system_prefix is None), token_len, token_limit, before_message_id)
+        ret = [SystemMessage(content=(system_message))]
+        for message in itertools.islice(self.messages, start_idx, end_idx):
+            openai_message = to_openai_message(message)
+            if openai_message is not None:
+                ret.append(openai_message)
         return ret
 
+    def _get_range(self, mode: Hashable, token_len: Callable[[ChatMessage], int], token_limit: Optional[int], before_message_id: Optional[uuid.UUID]) -> Tuple[int, int]:
+        """Range of messages to render, up to before_message_id and keeping the latest messages within token_limit.
+
+        mode identifies the rendering, and token_len gives the token count of a
+        message as rendered in that mode (zero if it is left out). Counts are
+        cached on the messages, and their running sums on the history, so that
+        the cutoff is found with a binary search instead of re-tokenizing.
+
+        """
+        end_idx = self._find_index(before_message_id) if before_message_id is not None else None
+        if end_idx is None:
+            end_idx = len(self.messages)
+        if token_limit is None:
+            return 0, end_idx
+
+        # sums[i] is the token count of messages[:i]
+        sums = self._token_sums.setdefault(mode, [0])
+        for message in itertools.islice(self.messages, len(sums) - 1, end_idx):
+            count = message.token_counts.get(mode)
+            if count is None:
+                count = message.token_counts[mode] = token_len(message)
+            sums.append(sums[-1] + count)
+
+        # keep the longest run of latest messages whose total fits in the limit
+        start_idx = bisect.bisect_left(sums, sums[end_idx] - token_limit, 0, end_idx + 1)
+        return min(start_idx, end_idx), end_idx
+
     @classmethod
     def new(cls, session_id: uuid.UUID, wallet_address: Optional[str] = None):
         return cls(messages=[], session_id=session_id, wallet_address=wallet_address)
@@ -207,6 +311,21 @@ class BaseChat(ABC):
 
         """
 
+    async def areceive_input(self, history: ChatHistory, user_input: str, send_message: Callable[..., Awaitable], message_id: Optional[uuid.UUID], before_message_id: Optional[uuid.UUID]) -> None:
+        """Async variant of receive_input, where send_message is a coroutine function.
+
+        Chat modules without a native async implementation fall back to running
+        receive_input in a worker thread, with send_message calls bridged back
+        onto the event loop.
+
+        """
+        loop = asyncio.get_running_loop()
+
+        def send(*args: Any, **kwargs: Any) -> Any:
+            return asyncio.run_coroutine_threadsafe(send_message(*args, **kwargs), loop).result()
+
+        await asyncio.to_thread(self.receive_input, history, user_input, send, message_id=message_id, before_message_id=before_message_id)
+
 
 class ChatOutputParser(BaseOutputParser):
 
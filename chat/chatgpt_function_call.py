@@ -1,11 +1,12 @@
 # This chat variant determines if the user's query is related to a widget or a search
 import re
 import time
+import asyncio
 import json
 import uuid
 import traceback
 from dataclasses import dataclass, asdict
-from typing import Any, Dict, Generator, List, Optional, Union, Literal, TypedDict, Callable
+from typing import Any, Awaitable, Dict, Generator, List, Optional, Tuple, Union, Literal, TypedDict, Callable
 
 from gpt_index.utils import ErrorToRetry, retry_on_exceptions_with_backoff
 from langchain.llms import OpenAI
@@ -17,7 +18,7 @@ from langchain.schema import BaseMessage
 import context
 import utils
 import utils.timing as timing
-from utils.common import FUNCTIONS, modelname_to_contextsize, get_user_info
+from utils.common import get_functions, modelname_to_contextsize, get_user_info
 from utils.constants import WIDGET_INFO_TOKEN_LIMIT
 import registry
 import streaming
@@ -45,7 +46,6 @@ class ChatGPTFunctionCallChat(BaseChat):
         self.model_name = model_name
         self.top_k = top_k
         self.evaluate_widgets = evaluate_widgets  # this controls whether we want to execute widgets, set to false to get the raw command back
-        self.system_message = SYSTEM_MESSAGE_DEFAULT
         self.token_limit = max(1800, modelname_to_contextsize(model_name) - WIDGET_INFO_TOKEN_LIMIT)
 
     def receive_input(
@@ -56,13 +56,97 @@ class ChatGPTFunctionCallChat(BaseChat):
             message_id: Optional[uuid.UUID] = None,
             before_message_id: Optional[uuid.UUID] = None,
     ) -> None:
+        # built per turn, as the chat is shared by all the users of its system config
         with context.with_request_context(history.wallet_address, message_id):
-            self.system_message = self.system_message.replace("{user_info}", get_user_info(not self.evaluate_widgets))
+            system_message = SYSTEM_MESSAGE_DEFAULT.replace("{user_info}", get_user_info(not self.evaluate_widgets))
 
         userinput = userinput.strip()
+        history_messages, injection_handler, _, function_call_handler, finish_turn = self._start_turn(history, userinput, system_message, send, message_id, before_message_id)
+        functions = self._get_functions(userinput)
+
+        llm = streaming.get_streaming_llm(injection_handler, model_name=self.model_name)
+
+        with context.with_request_context(history.wallet_address, message_id):
+            ai_message = llm.predict_messages(history_messages, functions=functions)
+            function_call_handler(ai_message)
+
+        finish_turn()
+
+    async def areceive_input(
+            self,
+            history: ChatHistory,
+            userinput: str,
+            send: Callable[..., Awaitable],
+            message_id: Optional[uuid.UUID] = None,
+            before_message_id: Optional[uuid.UUID] = None,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+
+        def sync_send(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(send(*args, **kwargs), loop).result()
+
+        def run_with_context(fn, *args):
+            # request context is thread-local, so set it up in the worker thread
+            with context.with_request_context(history.wallet_address, message_id):
+                return fn(*args)
+
+        user_info = await asyncio.to_thread(run_with_context, get_user_info, not self.evaluate_widgets)
+        # built per turn, as the chat is shared by all the users of its system config
+        system_message = SYSTEM_MESSAGE_DEFAULT.replace("{user_info}", user_info)
+
+        userinput = userinput.strip()
+        history_messages, _, async_injection_handler, function_call_handler, finish_turn = self._start_turn(history, userinput, system_message, sync_send, message_id, before_message_id, async_send=send)
+        functions = await asyncio.to_thread(self._get_functions, userinput)
+
+        llm = streaming.get_streaming_llm(async_injection_handler, model_name=self.model_name, use_async=True)
+
+        ai_message = await llm.apredict_messages(history_messages, functions=functions)
+        await asyncio.to_thread(run_with_context, function_call_handler, ai_message)
+
+        await asyncio.to_thread(finish_turn)
+
+    def _get_functions(self, userinput: str) -> List[Dict]:
+        """Retrieve the function definitions relevant to the user input."""
+        functions = get_functions()
+        if self.widget_index is None:
+            return functions
+        widgets = retry_on_exceptions_with_backoff(
+            lambda: self.widget_index.similarity_search(userinput, k=self.top_k),
+            [ErrorToRetry(TypeError)],
+        )
+        function_names = [fn['name'] for fn in functions]
+        selected_functions = []
+        for w in widgets:
+            fn_name = '_'.join(RE_COMMAND.search(w.page_content.replace('{', '').replace('}', '')).group('command').split('-'))
+            try:
+                idx = function_names.index(fn_name)
+            except ValueError:
+                continue
+            selected_functions.append(functions[idx])
+        return selected_functions
+
+    def _start_turn(
+            self,
+            history: ChatHistory,
+            userinput: str,
+            system_message: str,
+            send: Callable,
+            message_id: Optional[uuid.UUID],
+            before_message_id: Optional[uuid.UUID],
+            async_send: Optional[Callable[..., Awaitable]] = None,
+    ) -> Tuple[List[BaseMessage], Callable, Optional[Callable[[str], Awaitable]], Callable, Callable]:
+        """Register the user input and set up the handlers for this turn.
+
+        This is shared between the sync and async paths. Returns the prompt
+        messages, the token handlers for the llm stream (the async one only if
+        async_send is given), the handler for the final llm message (to
+        process function calls), and the function to call once the response
+        is done.
+
+        """
         history.add_user_message(userinput, message_id=message_id, before_message_id=before_message_id)
 
-        history_messages = history.to_openai_messages(system_message=self.system_message, system_prefix=None, token_limit=self.token_limit, before_message_id=before_message_id)  # omit system messages
+        history_messages = history.to_openai_messages(system_message=system_message, system_prefix=None, token_limit=self.token_limit, before_message_id=before_message_id)  # omit system messages
 
         timing.init()
 
@@ -81,98 +165,71 @@ class ChatGPTFunctionCallChat(BaseChat):
             ), last_chat_message_id=bot_chat_message_id, before_message_id=before_message_id)
             history.add_bot_message(response, message_id=bot_chat_message_id, before_message_id=before_message_id)
 
-        def bot_new_token_handler(token):
-            nonlocal bot_chat_message_id, bot_response, has_sent_bot_response
+        def bot_token_response(token):
+            nonlocal bot_response
 
             bot_response += token
             if not bot_response.strip():
                 # don't start returning something until we have the first non-whitespace char
-                return
+                return None
 
             timing.log('first_visible_bot_token')
-            bot_chat_message_id = send(Response(
+            return Response(
                 response=token,
                 still_thinking=False,
                 actor='bot',
                 operation='append' if bot_chat_message_id is not None else 'create',
-            ), last_chat_message_id=bot_chat_message_id, before_message_id=before_message_id)
+            )
+
+        def bot_new_token_handler(token):
+            nonlocal bot_chat_message_id, has_sent_bot_response
+            response = bot_token_response(token)
+            if response is None:
+                return
+            bot_chat_message_id = send(response, last_chat_message_id=bot_chat_message_id, before_message_id=before_message_id)
             has_sent_bot_response = True
 
-        new_token_handler = bot_new_token_handler
-        response_buffer = ""
+        async def async_bot_new_token_handler(token):
+            nonlocal bot_chat_message_id, has_sent_bot_response
+            response = bot_token_response(token)
+            if response is None:
+                return
+            bot_chat_message_id = await async_send(response, last_chat_message_id=bot_chat_message_id, before_message_id=before_message_id)
+            has_sent_bot_response = True
 
-        def injection_handler(token):
-            nonlocal new_token_handler, response_buffer
+        new_token_handler = bot_new_token_handler
+        widget_parser = WidgetParser()
 
+        def parse_token(token):
             timing.log('first_token')
             timing.log('first_widget_token')  # for comparison with basic agent
 
-            response_buffer += token
-
             # although this is for gpt functions, we also handle the case where the bot message
             # might come back as a widget command in string form.
-            while WIDGET_START in response_buffer and self.evaluate_widgets:
-                if WIDGET_END in response_buffer:
-                    # parse fetch command
-                    response_buffer = iterative_evaluate(response_buffer)
-                    if isinstance(response_buffer, Callable):  # handle delegated streaming
-                        def handler(token):
-                            nonlocal new_token_handler
-                            timing.log('first_visible_widget_response_token')
-                            return new_token_handler(token)
-                        response_buffer(handler)
-                        response_buffer = ""
-                        return
-                    elif isinstance(response_buffer, Generator):  # handle stream of widgets
-                        for item in response_buffer:
-                            timing.log('first_visible_widget_response_token')
-                            new_token_handler(str(item) + "\n")
-                        response_buffer = ""
-                        return
-                    elif len(response_buffer.split(WIDGET_START)) == len(response_buffer.split(WIDGET_END)):
-                        # matching pairs of open/close, just flush
-                        # NB: for better frontend parsing of nested widgets, we need an invariant that
-                        # there are no two independent widgets on the same line, otherwise we can't
-                        # detect the closing tag properly when there is nesting.
-                        response_buffer = response_buffer.replace(WIDGET_END, WIDGET_END + '\n')
-                        break
-                    else:
-                        # keep waiting
-                        return
-                else:
-                    # keep waiting
-                    return
-            if 0 < len(response_buffer) < len(WIDGET_START) and WIDGET_START.startswith(response_buffer):
-                # keep waiting if we could potentially be receiving WIDGET_START
-                return
-            token = response_buffer
-            response_buffer = ""
-            if token.strip():
-                timing.log('first_visible_widget_response_token')
-            new_token_handler(token)
+            return widget_parser.feed(token) if self.evaluate_widgets else [TextEvent(token)]
 
-        if self.widget_index is None:
-            functions = FUNCTIONS
-        else:
-            widgets = retry_on_exceptions_with_backoff(
-                lambda: self.widget_index.similarity_search(userinput, k=self.top_k),
-                [ErrorToRetry(TypeError)],
-            )
-            function_names = [fn['name'] for fn in FUNCTIONS]
-            functions = []
-            for w in widgets:
-                fn_name = '_'.join(RE_COMMAND.search(w.page_content.replace('{', '').replace('}', '')).group('command').split('-'))
-                try:
-                    idx = function_names.index(fn_name)
-                except ValueError:
-                    continue
-                functions.append(FUNCTIONS[idx])
+        def injection_handler(token):
+            for event in parse_token(token):
+                handle_widget_event(event, new_token_handler)
 
-        llm = streaming.get_streaming_llm(injection_handler, model_name=self.model_name)
+        def run_with_context(fn, *args):
+            # request context is thread-local, so set it up in the worker thread
+            with context.with_request_context(history.wallet_address, message_id):
+                return fn(*args)
 
-        with context.with_request_context(history.wallet_address, message_id):
-            ai_message = llm.predict_messages(history_messages, functions=functions)
+        async def async_injection_handler(token):
+            # text is sent from the event loop; only commands, whose evaluation may
+            # block on network calls, hold a worker thread while they run
+            for event in parse_token(token):
+                if isinstance(event, TextEvent):
+                    if event.text.strip():
+                        timing.log('first_visible_widget_response_token')
+                    await async_bot_new_token_handler(event.text)
+                else:
+                    await asyncio.to_thread(run_with_context, handle_widget_event, event, new_token_handler)
 
+        def function_call_handler(ai_message):
+            nonlocal bot_chat_message_id
             if 'function_call' in ai_message.additional_kwargs:
                 # when there is a function call, the callback is not called, so we process it
                 # here and call it ourselves with the widget str
@@ -190,11 +247,17 @@ class ChatGPTFunctionCallChat(BaseChat):
                 widget_str = f"{WIDGET_START}{command}({params}){WIDGET_END}"
                 injection_handler(widget_str)
 
-        timing.log('response_done')
+        def finish_turn():
+            timing.log('response_done')
+
+            for event in widget_parser.flush():
+                handle_widget_event(event, new_token_handler)
+
+            if bot_chat_message_id is not None:
+                bot_flush(bot_response)
 
-        if bot_chat_message_id is not None:
-            bot_flush(bot_response)
+            response = f'Timings - {timing.report()}'
+            system_chat_message_id = send(Response(response=response, actor='system'), before_message_id=before_message_id)
+            history.add_system_message(response, message_id=system_chat_message_id, before_message_id=before_message_id)
 
-        response = f'Timings - {timing.report()}'
-        system_chat_message_id = send(Response(response=response, actor='system'), before_message_id=before_message_id)
-        history.add_system_message(response, message_id=system_chat_message_id, before_message_id=before_message_id)
+        return history_messages, injection_handler, async_injection_handler if async_send else None, function_call_handler, finish_turn
@@ -110,61 +110,30 @@ class FineTunedChat(BaseChat):
 
         new_token_handler = bot_new_token_handler
         response_buffer = ""
+        widget_parser = WidgetParser()
 
-        def injection_handler(token):
-            nonlocal new_token_handler, response_buffer
-
-            timing.log('first_token')
-            timing.log('first_widget_token')  # for comparison with basic agent
+        def buffered_token_handler(token):
+            nonlocal response_buffer
 
             response_buffer += token
-            while WIDGET_START in response_buffer and self.evaluate_widgets:
-                if WIDGET_END in response_buffer:
-                    # parse fetch command
-                    response_buffer = iterative_evaluate(response_buffer)
-                    if isinstance(response_buffer, Callable):  # handle delegated streaming
-                        def handler(token):
-                            nonlocal new_token_handler
-                            timing.log('first_visible_widget_response_token')
-                            return new_token_handler(token)
-                        response_buffer(handler)
-                        response_buffer = ""
-                        return
-                    elif isinstance(response_buffer, Generator):  # handle stream of widgets
-                        for item in response_buffer:
-                            timing.log('first_visible_widget_response_token')
-                            new_token_handler(str(item) + "\n")
-                        response_buffer = ""
-                        return
-                    elif len(response_buffer.split(WIDGET_START)) == len(response_buffer.split(WIDGET_END)):
-                        # matching pairs of open/close, just flush
-                        # NB: for better frontend parsing of nested widgets, we need an invariant that
-                        # there are no two independent widgets on the same line, otherwise we can't
-                        # detect the closing tag properly when there is nesting.
-                        response_buffer = response_buffer.replace(WIDGET_END, WIDGET_END + '\n')
-                        break
-                    else:
-                        # keep waiting
-                        return
-                else:
-                    # keep waiting
-                    return
-
             if len(response_buffer) < len(NO_WIDGET_TOKEN) and NO_WIDGET_TOKEN.startswith(response_buffer):
                 # keep waiting
                 return
             elif response_buffer.startswith(NO_WIDGET_TOKEN):
                 # don't emit this in the stream, we will handle the final response below
                 return
-            elif 0 < len(response_buffer) < len(WIDGET_START) and WIDGET_START.startswith(response_buffer):
-                # keep waiting if we could potentially be receiving WIDGET_START
-                return
             token = response_buffer
             response_buffer = ""
-            if token.strip():
-                timing.log('first_visible_widget_response_token')
             new_token_handler(token)
 
+        def injection_handler(token):
+            timing.log('first_token')
+            timing.log('first_widget_token')  # for comparison with basic agent
+
+            events = widget_parser.feed(token) if self.evaluate_widgets else [TextEvent(token)]
+            for event in events:
+                handle_widget_event(event, buffered_token_handler)
+
         if self.widget_index is None:
             task_info = ""
         else:
@@ -187,6 +156,8 @@ class FineTunedChat(BaseChat):
 
         with context.with_request_context(history.wallet_address, message_id):
             result = chain.run(example).strip()
+        for event in widget_parser.flush():
+            handle_widget_event(event, buffered_token_handler)
 
         if result == NO_WIDGET_TOKEN:
             if self.fallback_chat is not None:
@@ -118,6 +118,7 @@ class RephraseWidgetSearchChat(BaseChat):
         response_buffer = ""
         response_state = 0  # finite-state machine state
         response_prefix = "## Response:"
+        widget_parser = WidgetParser()
 
         def injection_handler(token):
             nonlocal new_token_handler, response_buffer, response_state, response_prefix
@@ -125,8 +126,8 @@ class RephraseWidgetSearchChat(BaseChat):
             timing.log('first_token')
             timing.log('first_widget_token')  # for comparison with basic agent
 
-            response_buffer += token
             if response_state == 0:  # we are still waiting for response_prefix to appear
+                response_buffer += token
                 if response_prefix not in response_buffer:
                     # keep waiting
                     return
@@ -134,51 +135,17 @@ class RephraseWidgetSearchChat(BaseChat):
                     # we have found the response_prefix, trim everything before that
                     timing.log('first_widget_response_token')
                     response_state = 1
-                    response_buffer = response_buffer[response_buffer.index(response_prefix) + len(response_prefix):]
+                    token = response_buffer[response_buffer.index(response_prefix) + len(response_prefix):]
+                    response_buffer = ""
 
             if response_state == 1:  # we are going to output the response incrementally, evaluating any fetch commands
-                while WIDGET_START in response_buffer and self.evaluate_widgets:
-                    if WIDGET_END in response_buffer:
-                        # parse fetch command
-                        response_buffer = iterative_evaluate(response_buffer)
-                        if isinstance(response_buffer, Callable):  # handle delegated streaming
-                            def handler(token):
-                                nonlocal new_token_handler
-                                timing.log('first_visible_widget_response_token')
-                                return new_token_handler(token)
-                            response_buffer(handler)
-                            response_buffer = ""
-                            return
-                        elif isinstance(response_buffer, Generator):  # handle stream of widgets
-                            for item in response_buffer:
-                                timing.log('first_visible_widget_response_token')
-                                new_token_handler(str(item) + "\n")
-                            response_buffer = ""
-                            return
-                        elif len(response_buffer.split(WIDGET_START)) == len(response_buffer.split(WIDGET_END)):
-                            # matching pairs of open/close, just flush
-                            # NB: for better frontend parsing of nested widgets, we need an invariant that
-                            # there are no two independent widgets on the same line, otherwise we can't
-                            # detect the closing tag properly when there is nesting.
-                            response_buffer = response_buffer.replace(WIDGET_END, WIDGET_END + '\n')
-                            break
-                        else:
-                            # keep waiting
-                            return
-                    else:
-                        # keep waiting
-                        return
-                if 0 < len(response_buffer) < len(WIDGET_START) and WIDGET_START.startswith(response_buffer):
-                    # keep waiting if we could potentially be receiving WIDGET_START
-                    return
-                token = response_buffer
-                response_buffer = ""
-                if token.strip():
-                    timing.log('first_visible_widget_response_token')
-                new_token_handler(token)
-                if '\n' in token:
-                    # we have found a line-break in the response, switch to the terminal state to mask subsequent output
-                    response_state = 2
+                events = widget_parser.feed(token) if self.evaluate_widgets else [TextEvent(token)]
+                for event in events:
+                    token = handle_widget_event(event, new_token_handler)
+                    if '\n' in token:
+                        # we have found a line-break in the response, switch to the terminal state to mask subsequent output
+                        response_state = 2
+                        break
 
         widgets = retry_on_exceptions_with_backoff(
             lambda: self.widget_index.similarity_search(userinput, k=self.top_k),
@@ -197,6 +164,9 @@ class RephraseWidgetSearchChat(BaseChat):
 
         with context.with_request_context(history.wallet_address, message_id):
             result = chain.run(example).strip()
+        if response_state == 1:
+            for event in widget_parser.flush():
+                handle_widget_event(event, new_token_handler)
         timing.log('response_done')
 
         if bot_chat_message_id is not None:
@@ -0,0 +1,126 @@
+"""
+Coalescing of streamed chat responses into fewer websocket frames.
+
+The chat modules send one 'append' response per llm token, which would
+otherwise become one json frame each. The coalescer buffers consecutive
+appends to the same message and sends them as a single 'append' frame once
+the time window or the size limit is reached, whichever comes first. Any
+other operation (create/replace/...) flushes the buffered text first, so the
+order and semantics of operations seen by the client are unchanged.
+"""
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import utils.metrics as metrics
+
+
+class ResponseCoalescer:
+    """Buffers append responses, handing frames to emit once flushed.
+
+    emit is called with (resp, chat_message_id, before_message_id) for every
+    frame to be sent, and may be called from the flusher thread, so it should
+    be thread-safe (as main.send_response is).
+
+    """
+
+    def __init__(self, emit: Callable, window_ms: float, max_bytes: int) -> None:
+        self.emit = emit
+        self.window = window_ms / 1000.0
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # pending append: (resp, chat_message_id, before_message_id), and its buffered text
+        self._pending: Optional[Tuple] = None
+        self._pending_text: List[str] = []
+        self._pending_bytes = 0
+        self._generation = 0
+        self._num_appends = 0
+
+    def send(self, resp, chat_message_id, before_message_id=None) -> None:
+        with self._lock:
+            if resp.operation == 'append':
+                pending = self._pending
+                if pending is not None and (pending[1] != chat_message_id or pending[2] != before_message_id or pending[0].actor != resp.actor):
+                    self._flush_locked()
+                    pending = None
+                if pending is None:
+                    self._pending = (resp, chat_message_id, before_message_id)
+                    _flusher.schedule(time.time() + self.window, self._on_deadline, self._generation)
+                self._pending_text.append(resp.response)
+                self._pending_bytes += len(resp.response)
+                self._num_appends += 1
+                if self._pending_bytes >= self.max_bytes:
+                    self._flush_locked()
+                return
+            self._flush_locked()
+            self.emit(resp, chat_message_id, before_message_id)
+
+    def flush(self) -> None:
+        """Send out any buffered text, called at the end of a turn."""
+        with self._lock:
+            self._flush_locked()
+
+    def _on_deadline(self, generation: int) -> None:
+        with self._lock:
+            if generation == self._generation:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._pending is None:
+            return
+        resp, chat_message_id, before_message_id = self._pending
+        resp = type(resp)(
+            response=''.join(self._pending_text),
+            actor=resp.actor,
+            still_thinking=resp.still_thinking,
+            operation='append',
+        )
+        metrics.incr('stream_coalescing.frames')
+        metrics.incr('stream_coalescing.appends', self._num_appends)
+        self._pending = None
+        self._pending_text = []
+        self._pending_bytes = 0
+        self._num_appends = 0
+        self._generation += 1  # invalidate the scheduled deadline
+        self.emit(resp, chat_message_id, before_message_id)
+
+
+class _Flusher:
+    """Single daemon thread flushing coalescers whose time window has passed.
+
+    This makes sure trailing tokens are sent even if the stream stalls (e.g.
+    while a widget command is being evaluated), on both the threaded and the
+    async pipeline.
+
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, Callable, int]] = []
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, deadline: float, fn: Callable[[int], None], generation: int) -> None:
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stream-coalescing-flusher', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (deadline, next(self._counter), fn, generation))
+            if self._heap[0][0] == deadline:
+                self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(timeout=self._heap[0][0] - time.time() if self._heap else None)
+                _, _, fn, generation = heapq.heappop(self._heap)
+            try:
+                fn(generation)
+            except Exception as e:
+                print(f'error flushing coalesced stream: {e}')
+
+
+_flusher = _Flusher()
@@ -7,6 +7,9 @@ widget_index = dict(
     index_name=get_widget_index_name(),
     text_key="content",
 )
+local_widget_index = dict(
+    type="index.local_widgets.LocalWidgetIndex",
+)
 app_info_index = dict(
     type="index.weaviate.WeaviateIndex",
     index_name="AppInfoV1",
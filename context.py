@@ -1,6 +1,6 @@
 import contextlib
 import threading
-from typing import Any, Optional
+from typing import Any, Callable, Dict, Optional
 
 from utils import web3_provider
 
@@ -39,6 +39,29 @@ def with_request_context(wallet_address: str, user_chat_message_id: str, wallet_
         _request_context.fork_id = None
 
 
+def get_request_context() -> Dict[str, Any]:
+    """Return the request context of this thread, to set up in another with run_with_request_context."""
+    global _request_context
+    return dict(
+        wallet_address=_request_context.wallet_address,
+        user_chat_message_id=_request_context.user_chat_message_id,
+        wallet_chain_id=_request_context.wallet_chain_id,
+        fork_id=_request_context.fork_id,
+    )
+
+
+def run_with_request_context(request_context: Dict[str, Any], fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Run fn in this thread with the request context from get_request_context."""
+    global _request_context
+    for key, value in request_context.items():
+        setattr(_request_context, key, value)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        for key in request_context:
+            setattr(_request_context, key, None)
+
+
 def get_wallet_address() -> Optional[str]:
     global _request_context
     return _request_context.wallet_address
@@ -0,0 +1,197 @@
+"""
+Write-behind persistence of chat messages.
+
+Message ids are generated up front, so a response can be streamed to the
+client right away, while the inserts and updates are queued and written to
+the db in batches by a background flush, each batch in a single transaction.
+
+Callers must call flush() at the end of a turn, which blocks until every
+queued write has been committed. This keeps the guarantee that once a turn
+is done, all of its messages are durable. If the process dies mid-turn, the
+db holds a prefix of the turn's writes, made of whole batches.
+"""
+import concurrent.futures
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+from sqlalchemy import insert, update  # type: ignore
+from sqlalchemy.orm import sessionmaker  # type: ignore
+
+import utils.metrics as metrics
+from .models import engine, ChatMessage
+from .sequence import SEQUENCE_GAP, allocate_sequence_numbers, sequence_number_before
+
+
+# how long a background flush waits for writes to accumulate into a batch
+FLUSH_INTERVAL = 0.05
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-message-writer')
+
+# the background flush runs outside of request threads, so it uses its own sessions
+_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@dataclass
+class PendingWrite:
+    message_id: uuid.UUID
+    operation: str  # 'insert' or 'update'
+    payload: str
+    actor: Optional[str] = None
+    before_message_id: Optional[uuid.UUID] = None
+
+
+class ChatMessageWriter:
+    """Queues the message writes of a chat session, and flushes them in batches.
+
+    apply_batch is called with (chat_session_id, system_config_id, writes),
+    and must apply the writes in order within a single transaction.
+
+    """
+
+    def __init__(
+            self,
+            chat_session_id: uuid.UUID,
+            system_config_id: int,
+            apply_batch: Optional[Callable] = None,
+            flush_interval: Optional[float] = FLUSH_INTERVAL,
+    ) -> None:
+        self.chat_session_id = chat_session_id
+        self.system_config_id = system_config_id
+        self.apply_batch = apply_batch or apply_batch_to_db
+        self.flush_interval = flush_interval  # set to None to only flush explicitly
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[PendingWrite] = []
+        self._flush_scheduled = False
+        # ids of messages already in the db that got changed (or had messages inserted
+        # before them), as opposed to new messages being appended
+        self.rewritten_message_ids: Set[uuid.UUID] = set()
+
+    def create(self, actor: str, payload: str, before_message_id: Optional[uuid.UUID] = None) -> uuid.UUID:
+        """Queue a new message, returning its id."""
+        message_id = uuid.uuid4()
+        self._enqueue(PendingWrite(
+            message_id=message_id,
+            operation='insert',
+            payload=payload,
+            actor=actor,
+            before_message_id=before_message_id,
+        ))
+        return message_id
+
+    def replace(self, message_id: uuid.UUID, payload: str) -> None:
+        """Queue an update of the payload of an existing or queued message."""
+        self._enqueue(PendingWrite(
+            message_id=message_id,
+            operation='update',
+            payload=payload,
+        ))
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> None:
+        """Write out all queued writes, blocking until they are committed."""
+        with self._flush_lock:
+            with self._lock:
+                writes = self._pending
+                self._pending = []
+            if not writes:
+                return
+            batch = merge_writes(writes)
+            start = time.time()
+            try:
+                self.apply_batch(self.chat_session_id, self.system_config_id, batch)
+            except Exception:
+                # keep the writes so that the next flush retries them
+                with self._lock:
+                    self._pending = writes + self._pending
+                metrics.incr('chat_message_writer.flush_errors')
+                raise
+            for write in batch:
+                if write.operation == 'update':
+                    self.rewritten_message_ids.add(write.message_id)
+                elif write.before_message_id:
+                    self.rewritten_message_ids.add(write.before_message_id)
+            metrics.observe('chat_message_writer.flush_time', time.time() - start)
+            metrics.observe('chat_message_writer.batch_size', len(batch))
+
+    def _enqueue(self, write: PendingWrite) -> None:
+        with self._lock:
+            self._pending.append(write)
+            if self.flush_interval is None or self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        _executor.submit(self._background_flush)
+
+    def _background_flush(self) -> None:
+        time.sleep(self.flush_interval)
+        with self._lock:
+            self._flush_scheduled = False
+        try:
+            self.flush()
+        except Exception as e:
+            # the writes are kept, and retried by the flush at the end of the turn
+            print(f'error flushing chat messages of session {self.chat_session_id}: {e}')
+
+
+def merge_writes(writes: List[PendingWrite]) -> List[PendingWrite]:
+    """Fold updates into the queued insert or update of the same message."""
+    merged: List[PendingWrite] = []
+    by_message_id = {}
+    for write in writes:
+        existing = by_message_id.get(write.message_id)
+        if write.operation == 'update' and existing is not None:
+            existing.payload = write.payload
+            continue
+        write = PendingWrite(**write.__dict__)  # don't modify writes that may be retried
+        by_message_id[write.message_id] = write
+        merged.append(write)
+    return merged
+
+
+def apply_batch_to_db(chat_session_id: uuid.UUID, system_config_id: int, writes: List[PendingWrite]) -> None:
+    """Apply a batch of writes to the db in one transaction."""
+    session = _session_factory()
+    try:
+        appended: List[PendingWrite] = []
+
+        def insert_rows(writes, seq_nums):
+            if writes:
+                session.execute(insert(ChatMessage), [dict(
+                    id=write.message_id,
+                    actor=write.actor,
+                    type='text',
+                    payload=write.payload,
+                    sequence_number=seq_num,
+                    chat_session_id=chat_session_id,
+                    system_config_id=system_config_id,
+                ) for write, seq_num in zip(writes, seq_nums)])
+
+        def insert_appended():
+            # allocate the sequence numbers of consecutive appends all at once
+            if appended:
+                first = allocate_sequence_numbers(session, chat_session_id, count=len(appended))
+                insert_rows(appended, [first + i * SEQUENCE_GAP for i in range(len(appended))])
+                appended.clear()
+
+        for write in writes:
+            if write.operation == 'update':
+                insert_appended()
+                session.execute(update(ChatMessage).where(ChatMessage.id == write.message_id).values(payload=write.payload))
+            elif write.before_message_id:
+                insert_appended()
+                insert_rows([write], [sequence_number_before(session, chat_session_id, write.before_message_id)])
+            else:
+                appended.append(write)
+        insert_appended()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
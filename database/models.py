@@ -12,6 +12,8 @@ from sqlalchemy.orm import (  # type: ignore
     scoped_session, sessionmaker, relationship,
     backref)
 from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.engine import make_url  # type: ignore
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession  # type: ignore
 from sqlalchemy.ext.declarative import declarative_base  # type: ignore
 from sqlalchemy_utils import ChoiceType, Timestamp  # type: ignore
 
@@ -23,6 +25,15 @@ db_session = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=False,
                                          bind=engine))
 
+# async engine for the chat turn hot path, this points to the same database
+# but goes through the asyncpg driver so we don't hold a thread while waiting
+async_engine = create_async_engine(make_url(utils.CHATDB_URL).set(drivername='postgresql+asyncpg'))  # type: ignore
+async_session_factory = sessionmaker(async_engine,
+                                     class_=AsyncSession,
+                                     autocommit=False,
+                                     autoflush=False,
+                                     expire_on_commit=False)
+
 Base = declarative_base()
 # We will need this for querying
 Base.query = db_session.query_property()
@@ -87,6 +98,9 @@ class ChatSession(Base, Timestamp):  # type: ignore
 
     source_shared_session_id = Column(UUID(as_uuid=True), nullable=True)
 
+    # last sequence number allocated to a message of this session, see database.sequence
+    last_sequence_number = Column(Integer, server_default='0', nullable=False)
+
 
 Index('chat_session_by_user_deleted_created', ChatSession.user_id, ChatSession.deleted, ChatSession.created)
 
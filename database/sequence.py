@@ -0,0 +1,52 @@
+"""
+Allocation of chat message sequence numbers.
+
+Sequence numbers within a chat session are spaced SEQUENCE_GAP apart, and the
+last allocated number is kept on the chat session row. Appending a message
+bumps that counter with a single UPDATE ... RETURNING, instead of querying
+max(sequence_number). Inserting a message before another takes the midpoint
+between it and the preceding message, so later rows don't need renumbering.
+Only when there is no room left between two messages (after repeated inserts
+at the same spot) are the later rows shifted, by one bulk UPDATE.
+"""
+import uuid
+
+from sqlalchemy import func, select, update  # type: ignore
+
+from .models import ChatMessage, ChatSession
+
+
+SEQUENCE_GAP = 1024
+
+
+def allocate_sequence_numbers(session, chat_session_id: uuid.UUID, count: int = 1) -> int:
+    """Allocate count sequence numbers at the end of the chat session, returning the first one.
+
+    The allocated numbers are first, first + SEQUENCE_GAP, ... The row lock on
+    the chat session serializes concurrent allocations until commit.
+
+    """
+    last = session.execute(
+        update(ChatSession).where(ChatSession.id == chat_session_id).values(
+            last_sequence_number=ChatSession.last_sequence_number + count * SEQUENCE_GAP,
+        ).returning(ChatSession.last_sequence_number)
+    ).scalar_one()
+    return last - (count - 1) * SEQUENCE_GAP
+
+
+def sequence_number_before(session, chat_session_id: uuid.UUID, before_message_id: uuid.UUID) -> int:
+    """Allocate a sequence number right before the given message."""
+    before_seq_num = session.execute(select(ChatMessage.sequence_number).where(ChatMessage.id == before_message_id)).scalar_one()
+    prev_seq_num = session.execute(
+        select(func.max(ChatMessage.sequence_number)).where(ChatMessage.chat_session_id == chat_session_id, ChatMessage.sequence_number < before_seq_num)
+    ).scalar() or 0
+    if before_seq_num - prev_seq_num < 2:
+        # no room left, make some by shifting everything from the message onwards
+        session.execute(
+            update(ChatMessage).where(ChatMessage.chat_session_id == chat_session_id, ChatMessage.sequence_number >= before_seq_num).values(sequence_number=ChatMessage.sequence_number + SEQUENCE_GAP)
+        )
+        session.execute(
+            update(ChatSession).where(ChatSession.id == chat_session_id).values(last_sequence_number=ChatSession.last_sequence_number + SEQUENCE_GAP)
+        )
+        before_seq_num += SEQUENCE_GAP
+    return (prev_seq_num + before_seq_num) // 2
@@ -1,7 +1,10 @@
+import contextlib
 import functools
-from typing import Any, Callable
+from typing import Any, AsyncIterator, Callable
 
-from .models import db_session
+from sqlalchemy.ext.asyncio import AsyncSession  # type: ignore
+
+from .models import db_session, async_session_factory
 
 
 def close_db_session() -> Callable:
@@ -14,3 +17,13 @@ def close_db_session() -> Callable:
                 db_session.close()
         return wrapped_fn
     return decorator
+
+
+@contextlib.asynccontextmanager
+async def async_db_session() -> AsyncIterator[AsyncSession]:
+    """Async counterpart of db_session, closed on exit."""
+    session = async_session_factory()
+    try:
+        yield session
+    finally:
+        await session.close()
@@ -1 +1,3 @@
 from . import weaviate
+from . import local_widgets
+from . import embeddings
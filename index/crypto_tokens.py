@@ -1,7 +1,8 @@
 """
 NOTE:
-- To build the index for crypo tokens, first download the large list from "https://api.coingecko.com/api/v3/coins/list" and save it in "knowledge_base/crypto_tokens.json"
+- The index for crypo tokens is built from the coin list in utils/coingecko, to use a larger list, download it from "https://api.coingecko.com/api/v3/coins/list" and save it in "knowledge_base/crypto_tokens.json"
 - Then run - python3 -c "from index import crypto_tokens; crypto_tokens.backfill()"
+  or, with the larger list - python3 -c "from index import crypto_tokens; crypto_tokens.backfill('./knowledge_base/crypto_tokens.json')"
 """
 
 from typing import Any, Iterable, List, Optional
@@ -11,6 +12,7 @@ import json
 import time
 
 from langchain.docstore.document import Document
+from utils.coingecko.coin_index import get_coin_index
 from .weaviate import get_client
 
 
@@ -86,14 +88,19 @@ def create_schema(delete_first: bool = False) -> None:
     client.schema.create(schema)
 
 
-def backfill():
+def backfill(path: Optional[str] = None):
     # TODO: right now we don't have stable document IDs unlike sites.
     # Always drop and recreate first.
     from langchain.vectorstores import Weaviate
 
-    with open('./knowledge_base/crypto_tokens.json') as f:
-        crypto_tokens = json.load(f)
-        documents = [c.pop("id") for c in crypto_tokens]
+    if path:
+        with open(path) as f:
+            coins = json.load(f)
+    else:
+        # best ranked coins first, shared with the coin lookups
+        coins = get_coin_index().coins
+    documents = [c["id"] for c in coins]
+    crypto_tokens = [{SYMBOL_KEY: c["symbol"], NAME_KEY: c["name"]} for c in coins]
 
     create_schema(delete_first=True)
 
@@ -0,0 +1,141 @@
+"""
+Query embeddings shared by the retrieval indexes.
+
+The same user input is looked up in several indexes within a turn (widgets,
+api docs, crypto tokens, links, ...), so query embeddings are computed once
+and cached, keyed by model and normalized text, instead of being embedded by
+the vectorizer module on each query.
+
+The cache is in memory, with an optional on-disk tier that survives restarts.
+Embedding requests and calls are also tallied per chat turn, see track_turn.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+
+from langchain.embeddings import OpenAIEmbeddings
+
+import utils.metrics as metrics
+from utils import QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL, QUERY_EMBEDDING_CACHE_DIR
+from utils.cache import LRUCache
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"  # the model of the weaviate text2vec-openai vectorizer
+
+
+_memory_cache = LRUCache('query_embedding', maxsize=QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_CACHE_TTL)
+_clients: Dict[str, OpenAIEmbeddings] = {}
+_clients_lock = threading.Lock()
+
+
+@dataclass
+class _TurnStats:
+    requests: int = 0
+    calls: int = 0
+
+
+_turn_stats: contextvars.ContextVar[Optional[_TurnStats]] = contextvars.ContextVar('query_embedding_turn_stats', default=None)
+_turn_stats_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def _get_client(model: str) -> OpenAIEmbeddings:
+    with _clients_lock:
+        if model not in _clients:
+            _clients[model] = OpenAIEmbeddings(model=model)
+        return _clients[model]
+
+
+def _get_disk_path(model: str, text: str) -> str:
+    key = hashlib.sha256(f'{model}\0{text}'.encode()).hexdigest()
+    return os.path.join(QUERY_EMBEDDING_CACHE_DIR, f'{key}.json')
+
+
+def _read_disk(model: str, text: str) -> Optional[List[float]]:
+    path = _get_disk_path(model, text)
+    try:
+        if time.time() - os.path.getmtime(path) > QUERY_EMBEDDING_CACHE_TTL:
+            return None
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # guard against hash collisions
+    if entry.get('model') != model or entry.get('text') != text:
+        return None
+    return entry['embedding']
+
+
+def _write_disk(model: str, text: str, embedding: List[float]) -> None:
+    path = _get_disk_path(model, text)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(QUERY_EMBEDDING_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(model=model, text=text, embedding=embedding), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f'Failed to write query embedding cache entry: {e}')
+
+
+def _record(called: bool) -> None:
+    metrics.incr('query_embedding.requests')
+    if called:
+        metrics.incr('query_embedding.calls')
+    stats = _turn_stats.get()
+    if stats is not None:
+        with _turn_stats_lock:
+            stats.requests += 1
+            stats.calls += int(called)
+
+
+def embed_query(text: str, model: str = EMBEDDING_MODEL) -> List[float]:
+    """Return the embedding of the query text, from the cache if possible."""
+    text = normalize_text(text)
+    key = (model, text)
+    embedding = _memory_cache.get(key)
+    if embedding is None and QUERY_EMBEDDING_CACHE_DIR:
+        embedding = _read_disk(model, text)
+        metrics.incr('cache.hits' if embedding is not None else 'cache.misses', cache='query_embedding_disk')
+        if embedding is not None:
+            _memory_cache.set(key, embedding)
+    if embedding is not None:
+        _record(called=False)
+        return embedding
+
+    embedding = _get_client(model).embed_query(text)
+    _record(called=True)
+    _memory_cache.set(key, embedding)
+    if QUERY_EMBEDDING_CACHE_DIR:
+        _write_disk(model, text, embedding)
+    return embedding
+
+
+@contextlib.contextmanager
+def track_turn():
+    """Tally the embedding requests made within a chat turn.
+
+    Worker threads started with asyncio.to_thread, or submitted to the widget
+    command and paginator pools, inherit the tally, as they copy the context.
+    At the end of the turn, the number of requests and the number of
+    embedding calls saved by the cache are recorded in metrics.
+
+    """
+    stats = _TurnStats()
+    token = _turn_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _turn_stats.reset(token)
+        if stats.requests:
+            metrics.observe('query_embedding.turn_requests', stats.requests)
+            metrics.observe('query_embedding.turn_calls_saved', stats.requests - stats.calls)
@@ -0,0 +1,94 @@
+"""
+In-process widget index.
+
+There are only a few dozen widgets, so instead of querying Weaviate on every
+user message, the widget embeddings are kept in memory as a matrix and scored
+against the query embedding with a single matrix-vector product.
+
+The embeddings are stored in a versioned artifact, keyed by a hash of the
+widget definitions and embedding model, which is built ahead of time with
+build_artifact. The index fails to load if the artifact is missing or stale.
+"""
+from typing import List, Optional
+import hashlib
+import os
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings import OpenAIEmbeddings
+
+import registry
+from utils.common import get_widgets
+from .embeddings import EMBEDDING_MODEL, embed_query
+
+
+ARTIFACT_PATH = f"{os.getcwd()}/knowledge_base/widget_embeddings.npz"
+
+
+def get_documents() -> List[str]:
+    # same splitting as the weaviate widget index backfill
+    return get_widgets().split("---")
+
+
+def get_version(documents: List[str], model: str = EMBEDDING_MODEL) -> str:
+    h = hashlib.sha256(model.encode())
+    for document in documents:
+        h.update(b'\0')
+        h.update(document.encode())
+    return h.hexdigest()
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def load_artifact(path: str, version: str) -> Optional[np.ndarray]:
+    """Load the embeddings from the artifact, if it is there and matches the version."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if str(data['version']) != version:
+            return None
+        return data['embeddings']
+
+
+# run with: python3 -c "from index import local_widgets; local_widgets.build_artifact()"
+def build_artifact(path: str = ARTIFACT_PATH, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Embed the widgets and write them out to the artifact."""
+    documents = get_documents()
+    embeddings = _normalize(np.array(OpenAIEmbeddings(model=model).embed_documents(documents), dtype=np.float32))
+    np.savez(path, version=np.array(get_version(documents, model)), embeddings=embeddings)
+    return embeddings
+
+
+@registry.register_class
+class LocalWidgetIndex:
+    """Drop-in replacement for the weaviate widget index, for similarity_search."""
+
+    def __init__(self, artifact_path: Optional[str] = ARTIFACT_PATH, model: str = EMBEDDING_MODEL) -> None:
+        self.documents = get_documents()
+        self.model = model
+        version = get_version(self.documents, model)
+        if artifact_path:
+            embeddings = load_artifact(artifact_path, version)
+            if embeddings is None:
+                raise ValueError(f'Widget embeddings artifact {artifact_path} is missing or stale, rebuild it with build_artifact()')
+        else:
+            # no artifact, embed the widgets in memory
+            embeddings = _normalize(np.array(OpenAIEmbeddings(model=model).embed_documents(self.documents), dtype=np.float32))
+        assert embeddings.shape[0] == len(self.documents), f'expected {len(self.documents)} widget embeddings, got {embeddings.shape[0]}'
+        self.embeddings = embeddings
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return _normalize(np.array(embed_query(query, model=self.model), dtype=np.float32))
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding: np.ndarray, k: int = 4) -> List[Document]:
+        scores = self.embeddings @ embedding
+        k = min(k, len(scores))
+        top_k = np.argpartition(-scores, k - 1)[:k]
+        top_k = top_k[np.argsort(-scores[top_k])]
+        return [Document(page_content=self.documents[i]) for i in top_k]
@@ -1,11 +1,13 @@
-from typing import Optional, List
+from typing import Any, Optional, List
 import uuid
 
 import weaviate  # type: ignore
+from langchain.docstore.document import Document
 from langchain.vectorstores import Weaviate
 
 import utils
 import registry
+from . import embeddings
 
 
 # set an arbitrary uuid for namespace, for consistent uuids for objects
@@ -28,3 +30,28 @@ class WeaviateIndex(Weaviate):
     def __init__(self, index_name: str, text_key: str, extra_keys: Optional[List[str]] = None) -> None:
         client = get_client()
         super().__init__(client, index_name, text_key, attributes=extra_keys or [])
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        """Look up the query with near_vector, using the shared query embedding cache.
+
+        All our indexes are vectorized with the same model, so the query only
+        needs to be embedded once no matter how many indexes it is looked up in.
+
+        """
+        return self.similarity_search_by_vector(embeddings.embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        near_vector = {"vector": embedding}
+        if kwargs.get("search_distance"):
+            near_vector["certainty"] = kwargs["search_distance"]
+        query_obj = self._client.query.get(self._index_name, self._query_attrs)
+        if kwargs.get("where_filter"):
+            query_obj = query_obj.with_where(kwargs["where_filter"])
+        result = query_obj.with_near_vector(near_vector).with_limit(k).do()
+        if "errors" in result:
+            raise ValueError(f"Error during query: {result['errors']}")
+        docs = []
+        for res in result["data"]["Get"][self._index_name.capitalize()]:
+            text = res.pop(self._text_key)
+            docs.append(Document(page_content=text, metadata=res))
+        return docs
@@ -5,7 +5,7 @@ import traceback
 from langchain.docstore.document import Document
 from .weaviate import get_client
 from utils import get_widget_index_name
-from utils.common import WIDGETS
+from utils.common import get_widgets
 
 
 INDEX_NAME = get_widget_index_name()
@@ -62,7 +62,7 @@ def backfill(delete_first=True):
     create_schema(delete_first=delete_first)
 
     from langchain.vectorstores import Weaviate
-    documents = WIDGETS.split("---")
+    documents = get_widgets().split("---")
     metadatas = [{} for _ in documents]
 
     client = get_client()
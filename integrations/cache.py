@@ -0,0 +1,325 @@
+"""
+Cache for responses of the external APIs used by the integrations.
+
+Each endpoint gets its own IntegrationCache with a TTL, after which entries
+are stale: a stale entry is still returned, while it is refreshed in the
+background (stale-while-revalidate), until it expires after the stale TTL.
+Concurrent requests for the same key share a single fetch. Values of None,
+for things that were not found, can be kept for a shorter negative TTL.
+Invalidating a key drops it from both tiers, and the result of any fetch of
+the key started before is not cached.
+
+Entries are kept in memory, with an optional second tier shared across
+workers and restarts, set by INTEGRATION_CACHE_URL: a redis:// url, or a
+directory for a local disk tier. Values need to be JSON serializable.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+
+import utils.http_client as http_client
+import utils.metrics as metrics
+from utils.cache import LRUCache
+from utils.constants import INTEGRATION_CACHE_URL
+
+
+class _DiskTier:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        try:
+            with open(self._get_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key or entry['expires_at'] < time.time():
+            return None
+        return entry['fetched_at'], entry['value']
+
+    def set(self, key: str, fetched_at: float, value: Any, expires_at: float) -> None:
+        path = self._get_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(key=key, fetched_at=fetched_at, expires_at=expires_at, value=value), f)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+
+class _RedisTier:
+    def __init__(self, url: str) -> None:
+        import redis  # optional dependency, only needed for the redis tier
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        data = self.client.get(f'integration_cache:{key}')
+        if data is None:
+            return None
+        entry = json.loads(data)
+        return entry['fetched_at'], entry['value']
+
+    def set(self, key: str, fetched_at: float, value: Any, expires_at: float) -> None:
+        data = json.dumps(dict(fetched_at=fetched_at, value=value))
+        self.client.set(f'integration_cache:{key}', data, ex=max(1, int(expires_at - time.time())))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(f'integration_cache:{key}')
+
+
+def _get_tier(url: Optional[str]) -> Any:
+    if not url:
+        return None
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return _RedisTier(url)
+    return _DiskTier(url)
+
+
+_shared_tier = None
+_shared_tier_lock = threading.Lock()
+
+# background refreshes of stale entries
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='integration-cache-refresh')
+
+
+def _get_shared_tier() -> Any:
+    global _shared_tier
+    with _shared_tier_lock:
+        if _shared_tier is None and INTEGRATION_CACHE_URL:
+            _shared_tier = _get_tier(INTEGRATION_CACHE_URL)
+        return _shared_tier
+
+
+class IntegrationCache:
+    """Cache of the responses of one endpoint.
+
+    Entries are fresh for ttl seconds, then stale for stale_ttl seconds.
+    Entries with a value of None are fresh for negative_ttl seconds instead,
+    if set, and are not served stale. The second tier defaults to the one set by INTEGRATION_CACHE_URL,
+    pass a url to use another one.
+
+    """
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0, maxsize: int = 1000, tier_url: Optional[str] = None, negative_ttl: Optional[float] = None) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self._memory = LRUCache(f'integration_{name}', maxsize=maxsize, ttl=ttl + stale_ttl)
+        self._tier = _get_tier(tier_url) if tier_url else _get_shared_tier()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        # number of fetches running per key, and for the keys invalidated while
+        # they ran, a generation that tells those fetches apart from later ones
+        self._num_fetching: Dict[str, int] = {}
+        self._generations: Dict[str, int] = {}
+
+    def get(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """Return the cached value for the key, calling fetch to get it if needed."""
+        is_cached, value = self._get_cached(key, fetch)
+        if is_cached:
+            return value
+        metrics.incr('integration_cache.misses', cache=self.name)
+        return self._fetch(key, fetch)
+
+    def peek(self, key: str) -> Tuple[bool, Any]:
+        """Return whether the key has a fresh entry, and its value, without fetching it."""
+        entry = self._get_entry(key)
+        if entry is not None:
+            fetched_at, value = entry
+            if time.time() - fetched_at < self._get_ttl(value):
+                metrics.incr('integration_cache.fresh', cache=self.name)
+                return True, value
+        return False, None
+
+    def get_many(self, keys: List[str], fetch_many: Callable[[List[str]], List[Any]]) -> List[Any]:
+        """Return the cached values for the keys, calling fetch_many once for all the keys missing.
+
+        fetch_many takes a list of keys and returns their values in the same
+        order. Unlike get, fetches of the missing keys are not shared with
+        concurrent requests.
+
+        """
+        values = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            is_cached, value = self._get_cached(key, lambda key=key: fetch_many([key])[0])
+            if is_cached:
+                values[key] = value
+            else:
+                missing.append(key)
+        if missing:
+            metrics.incr('integration_cache.misses', len(missing), cache=self.name)
+            generations = [self._begin_fetch(key) for key in missing]
+            try:
+                start = time.time()
+                fetched = fetch_many(missing)
+                metrics.observe('integration_cache.fetch_time', time.time() - start, cache=self.name)
+                for key, value, generation in zip(missing, fetched, generations):
+                    self._set(key, value, generation)
+                    values[key] = value
+            finally:
+                for key in missing:
+                    self._end_fetch(key)
+        return [values[key] for key in keys]
+
+    def invalidate(self, key: str) -> None:
+        """Drop the entry for the key, e.g. after the value changed upstream.
+
+        Fetches of the key already running are not shared with later
+        requests, and their results are not cached.
+
+        """
+        with self._lock:
+            self._memory.invalidate(key)
+            self._inflight.pop(key, None)
+            if key in self._num_fetching:
+                self._generations[key] = self._generations.get(key, 0) + 1
+        if self._tier is not None:
+            try:
+                self._tier.delete(f'{self.name}:{key}')
+            except Exception:
+                traceback.print_exc()
+
+    def _get_cached(self, key: str, fetch: Callable[[], Any]) -> Tuple[bool, Any]:
+        """Return whether the key has a fresh or stale entry, and its value, refreshing stale entries in the background."""
+        entry = self._get_entry(key)
+        if entry is not None:
+            fetched_at, value = entry
+            age = time.time() - fetched_at
+            ttl = self._get_ttl(value)
+            if age < ttl:
+                metrics.incr('integration_cache.fresh', cache=self.name)
+                return True, value
+            if age < ttl + self._get_stale_ttl(value):
+                metrics.incr('integration_cache.stale', cache=self.name)
+                self._refresh_in_background(key, fetch)
+                return True, value
+        return False, None
+
+    def _get_ttl(self, value: Any) -> float:
+        return self.negative_ttl if value is None and self.negative_ttl is not None else self.ttl
+
+    def _get_stale_ttl(self, value: Any) -> float:
+        # a missing value is as likely to have just appeared as to still be missing
+        return 0 if value is None and self.negative_ttl is not None else self.stale_ttl
+
+    def _get_entry(self, key: str) -> Optional[Tuple[float, Any]]:
+        entry = self._memory.get(key)
+        if entry is None and self._tier is not None:
+            try:
+                entry = self._tier.get(f'{self.name}:{key}')
+            except Exception:
+                traceback.print_exc()
+                entry = None
+            if entry is None:
+                return None
+            expires_in = entry[0] + self.ttl + self.stale_ttl - time.time()
+            if expires_in <= 0:
+                return None
+            self._memory.set(key, entry, ttl=expires_in)
+        return entry
+
+    def _start_fetch(self, key: str) -> Tuple[Future, bool]:
+        """Return the future for the fetch of the key, and whether the caller has to run the fetch."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _begin_fetch(self, key: str) -> int:
+        """Register a fetch of the key, returning the generation to cache its result under."""
+        with self._lock:
+            self._num_fetching[key] = self._num_fetching.get(key, 0) + 1
+            return self._generations.get(key, 0)
+
+    def _end_fetch(self, key: str) -> None:
+        with self._lock:
+            self._num_fetching[key] -= 1
+            if not self._num_fetching[key]:
+                # no fetch left from before an invalidation
+                del self._num_fetching[key]
+                self._generations.pop(key, None)
+
+    def _run_fetch(self, key: str, fetch: Callable[[], Any], future: Future) -> Any:
+        generation = self._begin_fetch(key)
+        try:
+            start = time.time()
+            value = fetch()
+            metrics.observe('integration_cache.fetch_time', time.time() - start, cache=self.name)
+            self._set(key, value, generation)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            self._end_fetch(key)
+
+    def _fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        future, is_leader = self._start_fetch(key)
+        if not is_leader:
+            # share the result of the fetch already in flight for this key
+            metrics.incr('integration_cache.deduplicated', cache=self.name)
+            return future.result()
+        return self._run_fetch(key, fetch, future)
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], Any]) -> None:
+        future, is_leader = self._start_fetch(key)
+        if not is_leader:
+            return
+
+        def refresh():
+            try:
+                self._run_fetch(key, fetch, future)
+            except Exception:
+                # keep serving the stale entry until it expires
+                metrics.incr('integration_cache.refresh_errors', cache=self.name)
+                traceback.print_exc()
+
+        _refresh_executor.submit(refresh)
+
+    def _set(self, key: str, value: Any, generation: int) -> None:
+        fetched_at = time.time()
+        with self._lock:
+            if self._generations.get(key, 0) != generation:
+                # invalidated since the fetch started
+                return
+            self._memory.set(key, (fetched_at, value))
+        if self._tier is not None:
+            try:
+                self._tier.set(f'{self.name}:{key}', fetched_at, value, fetched_at + self.ttl + self.stale_ttl)
+                with self._lock:
+                    is_invalidated = self._generations.get(key, 0) != generation
+                if is_invalidated:
+                    # invalidated while writing to the tier, which may have come last
+                    self._tier.delete(f'{self.name}:{key}')
+            except Exception:
+                traceback.print_exc()
+
+
+def get_json(cache: IntegrationCache, url: str, **kwargs: Any) -> Any:
+    """Cached GET of a JSON endpoint through the shared HTTP client, keyed by url."""
+    def fetch():
+        response = http_client.get(url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+    return cache.get(url, fetch)
@@ -15,9 +15,10 @@ import auth
 
 from utils import ETH_MAINNET_CHAIN_ID, nft, FetchError, ExecError
 import utils.timing as timing
+import utils.http_client as http_client
 from chat.container import ContainerMixin, dataclass_to_container_params
 
-from . import opensea
+from . import opensea, paginator
 
 
 HEADERS = {
@@ -216,10 +217,14 @@ def fetch_nft_search(search_str: str) -> Generator[Union[NFTCollection, NFTAsset
         offset=offset,
     ))
     count = 0
-    for network in NETWORKS:
+
+    def search_network(network):
         url = f"{API_URL}/v2/{network}/search?{q}"
-        timing.log('search_begin')
-        response = requests.get(url, headers=HEADERS)
+        return http_client.get(url, headers=HEADERS)
+
+    timing.log('search_begin')
+    # search all networks concurrently, and go through the results in order
+    for network, response in zip(NETWORKS, paginator.map_concurrently(search_network, NETWORKS)):
         try:
             response.raise_for_status()
         except Exception:
@@ -227,6 +232,7 @@ def fetch_nft_search(search_str: str) -> Generator[Union[NFTCollection, NFTAsset
             break
         timing.log('search_done')
         obj = response.json()
+        results = []
         for item in obj['items']:
             if 'collection' not in item:
                 continue
@@ -243,7 +249,10 @@ def fetch_nft_search(search_str: str) -> Generator[Union[NFTCollection, NFTAsset
                 num_assets=collection['totalSupply'],
                 preview_image_url=collection['featuredImageURL'],
             )
-            if not _is_valid_collection(result):
+            results.append(result)
+        # validating a result takes a request, so validate them concurrently
+        for result, is_valid in zip(results, paginator.map_concurrently(_is_valid_collection, results)):
+            if not is_valid:
                 continue
             yield result
             timing.log('first_result_done')
@@ -279,11 +288,12 @@ def fetch_nft_search_collection_by_trait(network: str, address: str, trait_name:
     if network == "ethereum-mainnet":
         normalized_trait_name = trait_name.title()
         normalized_trait_value = trait_value.title()
-        token_prices = opensea.fetch_contract_listing_prices_with_retries(address)
+        # fetch the listings while the first page is fetched
+        token_prices_future = paginator.submit(opensea.fetch_contract_listing_prices_with_retries, address)
     else:
         normalized_trait_name = trait_name
         normalized_trait_value = trait_value
-        token_prices = None
+        token_prices_future = None
 
     payload = {"query": {normalized_trait_name: [normalized_trait_value]}}
     headers = {
@@ -291,15 +301,18 @@ def fetch_nft_search_collection_by_trait(network: str, address: str, trait_name:
         **HEADERS
     }
     limit = PAGE_LIMIT
-    offset = 0
     count = 0
-    while count < MAX_RESULTS:
+
+    def fetch_page(page):
         q = urlencode(dict(
             limit=limit,
-            offset=offset,
+            offset=page * limit,
         ))
         url = f"{API_URL}/v1/{network}/{address}/assets/searchByTraits?{q}"
-        response = requests.post(url, headers=headers, json=payload)
+        return http_client.post(url, headers=headers, json=payload, idempotent=True)
+
+    token_prices = None
+    for response in paginator.fetch_pages(fetch_page):
         try:
             response.raise_for_status()
         except Exception:
@@ -309,6 +322,8 @@ def fetch_nft_search_collection_by_trait(network: str, address: str, trait_name:
         obj = response.json()
         if not obj['items']:
             break
+        if token_prices_future is not None:
+            token_prices = token_prices_future.result()
         for item in obj['items']:
             token_id = item['tokenId']
             if token_prices is not None:
@@ -333,15 +348,14 @@ def fetch_nft_search_collection_by_trait(network: str, address: str, trait_name:
             count += 1
             if count >= MAX_RESULTS:
                 break
-        if obj['onLastPage']:
+        if obj['onLastPage'] or count >= MAX_RESULTS:
             break
-        offset += limit
     timing.log('%d_results_done' % count)
 
 
 def fetch_nft_collection(network: str, address: str) -> NFTCollection:
     url = f"{API_URL}/v2/{network}/{address}/nft/metadata"
-    response = requests.get(url, headers=HEADERS)
+    response = http_client.get(url, headers=HEADERS)
     response.raise_for_status()
     obj = response.json()
     num_assets = obj['totalSupply']
@@ -349,7 +363,7 @@ def fetch_nft_collection(network: str, address: str) -> NFTCollection:
         # use the asset endpoint with dummy token
         token_id = 1
         url = f"{API_URL}/v2/{network}/{address}/nft/{token_id}/metadata"
-        response = requests.get(url, headers=HEADERS)
+        response = http_client.get(url, headers=HEADERS)
         if response.status_code == 200:
             token_obj = response.json()
             num_assets = token_obj['collection']['totalSupply']
@@ -363,23 +377,28 @@ def fetch_nft_collection(network: str, address: str) -> NFTCollection:
 
 
 def fetch_nft_collection_assets(network: str, address: str) -> NFTCollectionAssets:
+    # fetch the listings while the collection is fetched
+    if network == "ethereum-mainnet":
+        token_prices_future = paginator.submit(opensea.fetch_contract_listing_prices_with_retries, address)
+    else:
+        token_prices_future = None
     collection = fetch_nft_collection(network, address)
     token_ids = [str(i + 1) for i in range(collection.num_assets)]
-    if collection.network == "ethereum-mainnet":
-        token_prices = opensea.fetch_contract_listing_prices_with_retries(address)
-    else:
-        token_prices = None
+    token_prices = token_prices_future.result() if token_prices_future is not None else None
 
     limit = min(PAGE_LIMIT, len(token_ids))
-    offset = 0
     assets = []
-    while len(assets) < MAX_RESULTS and offset < len(token_ids):
+
+    def fetch_page(page):
         payload = {"assets": [
             {"Address": address, "TokenID": token_id}
-            for token_id in token_ids[offset: offset + limit]
+            for token_id in token_ids[page * limit: (page + 1) * limit]
         ]}
         url = f"{API_URL}/v1/{network}/assets"
-        response = requests.post(url, headers=HEADERS, json=payload)
+        return http_client.post(url, headers=HEADERS, json=payload, idempotent=True)
+
+    num_pages = -(-len(token_ids) // limit) if limit else 0
+    for response in paginator.fetch_pages(fetch_page, max_pages=num_pages):
         try:
             response.raise_for_status()
         except Exception:
@@ -408,7 +427,8 @@ def fetch_nft_collection_assets(network: str, address: str) -> NFTCollectionAsse
             if not _is_valid_asset(asset):
                 continue
             assets.append(asset)
-        offset += limit
+        if len(assets) >= MAX_RESULTS:
+            break
     assets = assets[:MAX_RESULTS]
     return NFTCollectionAssets(
         collection=collection,
@@ -418,9 +438,14 @@ def fetch_nft_collection_assets(network: str, address: str) -> NFTCollectionAsse
 
 def fetch_nft_collection_assets_for_sale(network: str, address: str) -> Generator[NFTAsset, None, None]:
     timing.log('search_begin')
+    # fetch the listings while the collection is fetched
+    if network == "ethereum-mainnet":
+        token_prices_future = paginator.submit(opensea.fetch_contract_listing_prices_with_retries, address)
+    else:
+        token_prices_future = None
     collection = fetch_nft_collection(network, address)
-    if collection.network == "ethereum-mainnet":
-        token_prices = opensea.fetch_contract_listing_prices_with_retries(address)
+    if token_prices_future is not None:
+        token_prices = token_prices_future.result()
         token_price_list = [{'token_id': k, **v} for k, v in token_prices.items()]
         token_price_list.sort(key=lambda x: x['price_value'])
         token_ids = [token_price_list['token_id'] for token_price_list in token_price_list]
@@ -431,15 +456,18 @@ def fetch_nft_collection_assets_for_sale(network: str, address: str) -> Generato
         token_ids = [str(i + 1) for i in range(collection.num_assets)]
 
     limit = min(PAGE_LIMIT, len(token_ids))
-    offset = 0
     count = 0
-    while count < MAX_RESULTS and offset < len(token_ids):
+
+    def fetch_page(page):
         payload = {"assets": [
             {"Address": address, "TokenID": token_id}
-            for token_id in token_ids[offset: offset + limit]
+            for token_id in token_ids[page * limit: (page + 1) * limit]
         ]}
         url = f"{API_URL}/v1/{network}/assets"
-        response = requests.post(url, headers=HEADERS, json=payload)
+        return http_client.post(url, headers=HEADERS, json=payload, idempotent=True)
+
+    num_pages = -(-len(token_ids) // limit) if limit else 0
+    for response in paginator.fetch_pages(fetch_page, max_pages=num_pages):
         try:
             response.raise_for_status()
         except Exception:
@@ -472,22 +500,27 @@ def fetch_nft_collection_assets_for_sale(network: str, address: str) -> Generato
             count += 1
             if count >= MAX_RESULTS:
                 break
-        offset += limit
+        if count >= MAX_RESULTS:
+            break
     timing.log('%d_results_done' % count)
 
 
 def fetch_nft_collection_traits(network: str, address: str) -> NFTCollectionTraits:
-    collection = fetch_nft_collection(network, address)
+    # fetch the collection while the traits are fetched
+    collection_future = paginator.submit(fetch_nft_collection, network, address)
     limit = PAGE_LIMIT_FOR_TRAITS
-    offset = 0
     traits = []
-    while len(traits) < MAX_RESULTS_FOR_TRAITS:
+
+    def fetch_page(page):
         q = urlencode(dict(
             limit=limit,
-            offset=offset,
+            offset=page * limit,
         ))
         url = f"{API_URL}/v1/{network}/{address}/traits?{q}"
-        response = requests.get(url, headers=HEADERS)
+        return http_client.get(url, headers=HEADERS)
+
+    # there is rarely more than one page, so don't fetch ahead
+    for response in paginator.fetch_pages(fetch_page, prefetch=0):
         try:
             response.raise_for_status()
         except Exception:
@@ -510,27 +543,30 @@ def fetch_nft_collection_traits(network: str, address: str) -> NFTCollectionTrai
                 ],
             )
             traits.append(trait)
-        if obj['onLastPage']:
+        if obj['onLastPage'] or len(traits) >= MAX_RESULTS_FOR_TRAITS:
             break
-        offset += limit
     return NFTCollectionTraits(
-        collection=collection,
+        collection=collection_future.result(),
         traits=traits,
     )
 
 
 def fetch_nft_collection_trait_values(network: str, address: str, trait: str) -> NFTCollectionTraitValues:
-    collection = fetch_nft_collection(network, address)
+    # fetch the collection while the values are fetched
+    collection_future = paginator.submit(fetch_nft_collection, network, address)
     limit = PAGE_LIMIT_FOR_TRAITS
-    offset = 0
     values = []
-    while len(values) < MAX_RESULTS_FOR_TRAITS:
+
+    def fetch_page(page):
         q = urlencode(dict(
             limit=limit,
-            offset=offset,
+            offset=page * limit,
         ))
         url = f"{API_URL}/v1/{network}/{address}/traits/{trait}?{q}"
-        response = requests.get(url, headers=HEADERS)
+        return http_client.get(url, headers=HEADERS)
+
+    # there is rarely more than one page, so don't fetch ahead
+    for response in paginator.fetch_pages(fetch_page, prefetch=0):
         try:
             response.raise_for_status()
         except Exception:
@@ -548,11 +584,10 @@ def fetch_nft_collection_trait_values(network: str, address: str, trait: str) ->
                 total=total,
             )
             values.append(value)
-        if obj['onLastPage']:
+        if obj['onLastPage'] or len(values) >= MAX_RESULTS_FOR_TRAITS:
             break
-        offset += limit
     return NFTCollectionTraitValues(
-        collection=collection,
+        collection=collection_future.result(),
         trait=NFTCollectionTrait(
             trait=trait,
             values=values,
@@ -562,7 +597,7 @@ def fetch_nft_collection_trait_values(network: str, address: str, trait: str) ->
 
 def fetch_nft_asset(network: str, address: str, token_id: str) -> NFTAsset:
     url = f"{API_URL}/v2/{network}/{address}/nft/{token_id}/metadata"
-    response = requests.get(url, headers=HEADERS)
+    response = http_client.get(url, headers=HEADERS)
     response.raise_for_status()
     obj = response.json()
     return NFTAsset(
@@ -581,7 +616,7 @@ def fetch_nft_asset(network: str, address: str, token_id: str) -> NFTAsset:
 def fetch_nft_asset_traits(network: str, address: str, token_id: str) -> NFTAssetTraits:
     price = _fetch_nft_asset_price_str(network, address, token_id)
     url = f"{API_URL}/v1/{network}/{address}/{token_id}"
-    response = requests.get(url, headers=HEADERS)
+    response = http_client.get(url, headers=HEADERS)
     response.raise_for_status()
     obj = response.json()
     asset = NFTAsset(
@@ -631,7 +666,7 @@ def fetch_nfts_owned_by_address_or_domain(network: str, address_or_domain: str)
     url = f"{API_URL}/v2/{normalized_network}/{address_or_domain}/nfts-owned?{q}"
 
     try:
-        response = requests.get(url, headers=HEADERS)
+        response = http_client.get(url, headers=HEADERS)
         response.raise_for_status()
     except requests.exceptions.HTTPError as err:
         print(err)
@@ -702,7 +737,7 @@ def _fetch_nft_asset_price_str(network: str, address: str, token_id: str) -> Opt
 def fetch_center_image(response, network: str, address: str, token_id: str, size: str, user_id:str=None):
     
     url = f"{API_URL}/v2/{network}/{address}/nft/{token_id}/render/{size}"
-    resp = requests.get(url, headers=HEADERS)
+    resp = http_client.get(url, headers=HEADERS)
 
     # Check if user is authenticated
     if not user_id: return None 
@@ -1,11 +1,17 @@
-import requests
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+import threading
+
+import numpy as np
 
 from chat.container import ContainerMixin, dataclass_to_container_params
+from . import cache
 
 DEFILLAMA_API_URL = "https://yields.llama.fi"
 
+# the pools dataset is many megabytes and only updated every hour or so
+_pools_cache = cache.IntegrationCache('defillama_pools', ttl=600, stale_ttl=3600, maxsize=1)
+
 
 @dataclass
 class Yield(ContainerMixin):
@@ -23,6 +29,62 @@ class Yield(ContainerMixin):
         return dataclass_to_container_params(self)
 
 
+class YieldStore:
+    """Snapshot of the DefiLlama pools, indexed for yield queries.
+
+    Only single-sided pools with a non-zero APY and TVL are kept. For each
+    normalized (lowercase) symbol, chain and (symbol, chain) pair, as well as
+    for all pools, the store keeps a posting list of pool row numbers sorted
+    by TVL (descending), so a query is a dict lookup plus a slice.
+
+    """
+
+    def __init__(self, pools: List[Dict]) -> None:
+        exposure = np.array([pool["exposure"] for pool in pools], dtype=object)
+        apy = np.array([pool["apy"] or 0 for pool in pools], dtype=np.float64)
+        tvl_usd = np.array([pool["tvlUsd"] or 0 for pool in pools], dtype=np.float64)
+        rows = np.flatnonzero((exposure == "single") & (apy != 0) & (tvl_usd != 0))
+        # stable sort, so that pools with the same TVL keep their order in the dataset
+        rows = rows[np.argsort(-tvl_usd[rows], kind="stable")]
+
+        self.pools = pools
+        self._all = rows
+        postings: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+        for row in rows.tolist():
+            symbol = pools[row]["symbol"].lower()
+            chain = pools[row]["chain"].lower()
+            for key in ((symbol, chain), (symbol, None), (None, chain)):
+                postings.setdefault(key, []).append(row)
+        self._postings = {key: np.array(posting, dtype=np.int64) for key, posting in postings.items()}
+
+    def query(self, token: str, network: str, count: int) -> List[Dict]:
+        """Return the count pools with the highest TVL for token on network, either of which can be '*'."""
+        token = token.lower()
+        network = network.lower()
+        if token == "*" and network == "*":
+            rows = self._all
+        else:
+            key = (None if token == "*" else token, None if network == "*" else network)
+            rows = self._postings.get(key, self._all[:0])
+        return [self.pools[row] for row in rows[:count].tolist()]
+
+
+_yield_store: Optional[YieldStore] = None
+_yield_store_source = None
+_yield_store_lock = threading.Lock()
+
+
+def get_yield_store() -> YieldStore:
+    """Return the yield store for the current pools dataset, rebuilt when the cached dataset is refreshed."""
+    global _yield_store, _yield_store_source
+    obj = cache.get_json(_pools_cache, f"{DEFILLAMA_API_URL}/pools")
+    with _yield_store_lock:
+        if obj is not _yield_store_source:
+            _yield_store = YieldStore(obj["data"])
+            _yield_store_source = obj
+        return _yield_store
+
+
 def fetch_yields(token, network, count) -> List[Yield]:
     normalized_network_name = _network_name_normalizer(network)
 
@@ -30,15 +92,8 @@ def fetch_yields(token, network, count) -> List[Yield]:
     if count == "*":
         count = 5
 
-    url = f"{DEFILLAMA_API_URL}/pools"
-    response = requests.get(url)
-    response.raise_for_status()
-    obj = response.json()
-    yields = obj["data"]
-    filtered_yields = list(filter(lambda yield_obj: _filter_yield_list(token, normalized_network_name, yield_obj), yields))
-    # Sorting on TVL to select the top N blue-chip projects
-    filtered_yields.sort(key=lambda yield_obj: yield_obj["tvlUsd"], reverse=True)
-    selected_yields = filtered_yields[:int(count)]
+    # Sorted on TVL to select the top N blue-chip projects
+    selected_yields = get_yield_store().query(token, normalized_network_name, int(count))
 
     return [
         Yield(
@@ -51,28 +106,6 @@ def fetch_yields(token, network, count) -> List[Yield]:
         for yield_obj in selected_yields]
 
 
-def _filter_yield_list(input_token, input_network, yield_obj) -> bool:
-    normalized_symbol = yield_obj["symbol"].lower()
-    normalized_network = yield_obj["chain"].lower()
-    input_token = input_token.lower()
-    input_network = input_network.lower()
-
-    # Only select single-sided yield pools
-    if yield_obj["exposure"] != "single" or yield_obj["apy"] == 0 or yield_obj["tvlUsd"] == 0:
-        return False
-
-    if input_token == "*" and input_network == "*":
-        return True
-
-    if input_network == "*":
-        return normalized_symbol == input_token
-
-    if input_token == "*":
-        return normalized_network == input_network
-
-    return normalized_symbol == input_token and normalized_network == input_network
-
-
 def _network_name_normalizer(network: str) -> str:
     # Convert the inferred network name to what DefiLlama uses for filtering
     if "binance" in network.lower():
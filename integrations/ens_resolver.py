@@ -0,0 +1,165 @@
+"""
+ENS resolution, cached in both directions.
+
+Names and addresses are resolved with direct calls to the ENS registry and
+resolvers, each step made for several names or addresses in one batched
+JSON-RPC request. Resolutions are cached per RPC endpoint, including the
+names and addresses that do not resolve, which are kept for a shorter
+negative TTL. Our ENS workflows invalidate the entries they change.
+"""
+from typing import Any, List, Optional
+
+import sha3 # 'pip install pysha3'
+from idna import encode, IDNAError
+from web3 import Web3
+from web3.constants import ADDRESS_ZERO
+from web3.exceptions import ContractLogicError
+
+from utils.abi import ContractABI, get_contract
+from utils.constants import ENS_CACHE_TTL, ENS_CACHE_STALE_TTL, ENS_NEGATIVE_CACHE_TTL
+import utils.web3_provider as web3_provider
+
+from . import cache
+
+
+ENS_REGISTRY_ADDRESS = Web3.to_checksum_address("0x00000000000C2E074eC69A0dFb2997BA6C7d2e1e")
+
+# the functions of the registry and resolvers needed to resolve names and addresses
+_registry_abi = ContractABI([{
+    "inputs": [{"internalType": "bytes32", "name": "node", "type": "bytes32"}],
+    "name": "resolver",
+    "outputs": [{"internalType": "address", "name": "", "type": "address"}],
+    "stateMutability": "view",
+    "type": "function",
+}])
+_resolver_abi = ContractABI([{
+    "inputs": [{"internalType": "bytes32", "name": "node", "type": "bytes32"}],
+    "name": "addr",
+    "outputs": [{"internalType": "address payable", "name": "", "type": "address"}],
+    "stateMutability": "view",
+    "type": "function",
+}, {
+    "inputs": [{"internalType": "bytes32", "name": "node", "type": "bytes32"}],
+    "name": "name",
+    "outputs": [{"internalType": "string", "name": "", "type": "string"}],
+    "stateMutability": "view",
+    "type": "function",
+}])
+
+# address -> primary name
+_names_cache = cache.IntegrationCache('ens_names', ttl=ENS_CACHE_TTL, stale_ttl=ENS_CACHE_STALE_TTL, negative_ttl=ENS_NEGATIVE_CACHE_TTL, maxsize=10000)
+# name -> address
+_addresses_cache = cache.IntegrationCache('ens_addresses', ttl=ENS_CACHE_TTL, stale_ttl=ENS_CACHE_STALE_TTL, negative_ttl=ENS_NEGATIVE_CACHE_TTL, maxsize=10000)
+
+
+def keccak_256(data):
+    k = sha3.keccak_256()
+    k.update(data)
+    return k.hexdigest()
+
+def to_unicode(name):
+    try:
+        return encode(name, uts46=True, transitional=False, std3_rules=True).decode('utf-8')
+    except IDNAError as e:
+        return name
+
+def get_node_namehash(domain):
+    # namehash
+    node = bytes.fromhex("00" * 32)
+    name = to_unicode(domain)
+    if name:
+        labels = name.split(".")
+
+        for label in reversed(labels):
+            label_sha = bytes.fromhex(keccak_256(label.encode()))
+            node_sha = keccak_256(node + label_sha)
+            node = bytes.fromhex(node_sha)
+
+    return "0x" + node.hex()
+
+
+def _call_all(web3: Web3, calls: List[Any]) -> List[Any]:
+    """Make the contract function calls in one round trip, with None for the calls that revert."""
+    if not calls:
+        return []
+    try:
+        return web3_provider.batch_call(web3, calls)
+    except ValueError:
+        # a call reverted, e.g. on a resolver without the function, so make them one by one to tell which
+        results = []
+        for call in calls:
+            try:
+                results.append(call.call())
+            except (ContractLogicError, ValueError):
+                results.append(None)
+        return results
+
+
+def _resolve_records(web3: Web3, nodes: List[str], fn_name: str) -> List[Any]:
+    """Return the record of each node from its resolver, or None if it has no resolver or record."""
+    registry = get_contract(web3, ENS_REGISTRY_ADDRESS, _registry_abi)
+    resolvers = _call_all(web3, [registry.functions.resolver(node) for node in nodes])
+    indexes = [i for i, resolver in enumerate(resolvers) if resolver and resolver != ADDRESS_ZERO]
+    records = _call_all(web3, [
+        getattr(get_contract(web3, resolvers[i], _resolver_abi).functions, fn_name)(nodes[i])
+        for i in indexes
+    ])
+    ret = [None] * len(nodes)
+    for i, record in zip(indexes, records):
+        ret[i] = record
+    return ret
+
+
+def _fetch_addresses(web3: Web3, names: List[str]) -> List[Optional[str]]:
+    addresses = _resolve_records(web3, [get_node_namehash(name) for name in names], 'addr')
+    return [address if address and address != ADDRESS_ZERO else None for address in addresses]
+
+
+def _fetch_names(web3: Web3, addresses: List[str]) -> List[Optional[str]]:
+    nodes = [get_node_namehash(f'{address[2:].lower()}.addr.reverse') for address in addresses]
+    names = _resolve_records(web3, nodes, 'name')
+    # a reverse record only counts if the name resolves back to the address
+    indexes = [i for i, name in enumerate(names) if name]
+    forward_addresses = resolve_addresses(web3, [names[i] for i in indexes])
+    ret = [None] * len(addresses)
+    for i, address in zip(indexes, forward_addresses):
+        if address is not None and address.lower() == addresses[i].lower():
+            ret[i] = names[i]
+    return ret
+
+
+def _get_key(web3: Web3, name_or_address: str) -> str:
+    return f'{web3.provider.endpoint_uri}:{name_or_address.lower()}'
+
+
+def resolve_addresses(web3: Web3, names: List[str]) -> List[Optional[str]]:
+    """Return the address each ENS name resolves to, or None if it does not resolve."""
+    keys = [_get_key(web3, name) for name in names]
+    names_by_key = dict(zip(keys, names))
+    return _addresses_cache.get_many(keys, lambda keys: _fetch_addresses(web3, [names_by_key[key] for key in keys]))
+
+
+def resolve_names(web3: Web3, addresses: List[str]) -> List[Optional[str]]:
+    """Return the primary ENS name of each address, or None if it has none."""
+    for address in addresses:
+        if not Web3.is_address(address):
+            raise ValueError(f'Invalid address {address}')
+    keys = [_get_key(web3, address) for address in addresses]
+    addresses_by_key = dict(zip(keys, addresses))
+    return _names_cache.get_many(keys, lambda keys: _fetch_names(web3, [addresses_by_key[key] for key in keys]))
+
+
+def resolve_address(web3: Web3, name: str) -> Optional[str]:
+    return resolve_addresses(web3, [name])[0]
+
+
+def resolve_name(web3: Web3, address: str) -> Optional[str]:
+    return resolve_names(web3, [address])[0]
+
+
+def invalidate(web3: Web3, name: Optional[str] = None, address: Optional[str] = None) -> None:
+    """Drop the cached resolutions of a name and of an address, after they were changed."""
+    if name:
+        _addresses_cache.invalidate(_get_key(web3, name))
+    if address:
+        _names_cache.invalidate(_get_key(web3, address))
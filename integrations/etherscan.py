@@ -1,19 +1,43 @@
-import requests
+"""
+Etherscan API, with the activity of an address.
 
-from utils import ETHERSCAN_API_KEY
+The totals of the transactions of an address (ETH in and out, gas, counts)
+and of its token transfers are computed from its transaction list,
+downloaded in pages and added up page by page, and cached. When they are
+stale, only the transactions after the last block seen are downloaded, and
+added to them. At most MAX_PAGES pages are downloaded per refresh, so the
+totals of busy addresses are truncated until later refreshes catch up.
+"""
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from utils import ETHERSCAN_API_KEY, FetchError
+from utils.cache import LRUCache
+import utils.http_client as http_client
+
+from . import cache
+
+
+API_URL = 'https://api.etherscan.io/api'
+# records per page of txlist and tokentx, the most Etherscan returns
+PAGE_SIZE = 10000
+# pages fetched per refresh of the totals of an address
+MAX_PAGES = 10
+
+_activity_cache = cache.IntegrationCache('etherscan_address_activity', ttl=60, maxsize=1000)
+# the last totals of each address, kept past the ttl, to refresh them from the last block seen
+_last_activity = LRUCache('etherscan_last_activity', maxsize=1000)
 
 
 def get_ABI(contract_address):
     url = f'https://api.etherscan.io/api?module=contract&action=getabi&address={contract_address}&apikey={ETHERSCAN_API_KEY}'
-    response = requests.get(url)
+    response = http_client.get(url)
     response.raise_for_status()
     result = response.json()['result']
     return result
 
 
-erc_20_abi = get_ABI("0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2")
-
-
 TOKEN_TO_CONTRACT_ADDRESS = {
     'ETH': '0x0000000000000000000000000000000000000000',
     'USDT': '0xdac17f958d2ee523a2206206994597c13d831ec7',
@@ -36,11 +60,198 @@ def is_zero_address(address):
     return address == '0x0000000000000000000000000000000000000000'
 
 
+@dataclass
+class TokenTransferTotals:
+    symbol: str
+    decimals: int
+    num_in: int = 0
+    num_out: int = 0
+    value_in: int = 0
+    value_out: int = 0
+
+
+@dataclass
+class AddressActivity:
+    """Totals of the transactions of an address, up to last_block, in wei and gas units.
+
+    is_truncated tells whether there are later transactions, not counted yet.
+    """
+    address: str
+    last_block: int = -1
+    is_truncated: bool = False
+    num_transactions: int = 0
+    num_in: int = 0
+    num_out: int = 0
+    eth_in: int = 0
+    eth_out: int = 0
+    gas: int = 0
+    gas_used: int = 0
+
+
+@dataclass
+class TokenActivity:
+    """Totals of the ERC-20 transfers of an address, up to last_block, by token contract address.
+
+    is_truncated tells whether there are later transfers, not counted yet.
+    """
+    address: str
+    last_block: int = -1
+    is_truncated: bool = False
+    tokens: Dict[str, TokenTransferTotals] = field(default_factory=dict)
+
+
+def _fetch_pages(action: str, address: str, start_block: int, contract_address: Optional[str] = None) -> Iterator[Tuple[List[Dict[str, Any]], bool]]:
+    """Fetch the records of an account action from start_block on, paging through them by block.
+
+    Yields each page with whether it is the last one, for at most MAX_PAGES pages.
+    """
+    for _ in range(MAX_PAGES):
+        params = dict(
+            module='account',
+            action=action,
+            address=address,
+            startblock=start_block,
+            endblock=99999999,
+            page=1,
+            offset=PAGE_SIZE,
+            sort='asc',
+            apikey=ETHERSCAN_API_KEY,
+        )
+        if contract_address is not None:
+            params['contractaddress'] = contract_address
+        response = http_client.get(f'{API_URL}?{urlencode(params)}')
+        response.raise_for_status()
+        page = response.json()['result']
+        if not isinstance(page, list):
+            raise FetchError(f'Failed to fetch the transactions of {address}: {page}')
+        if len(page) < PAGE_SIZE:
+            yield page, True
+            return
+        # the page may end partway through a block, so fetch that block again with the next page
+        last_block = int(page[-1]['blockNumber'])
+        complete_blocks = [record for record in page if int(record['blockNumber']) < last_block]
+        if not complete_blocks:
+            yield page, True
+            return
+        yield complete_blocks, False
+        start_block = last_block
+
+
+def _transaction_totals(address: str, transactions: List[Dict[str, Any]]) -> AddressActivity:
+    activity = AddressActivity(address=address, num_transactions=len(transactions))
+    for transaction in transactions:
+        value = int(transaction['value'])
+        if transaction['from'].lower() == address:
+            activity.num_out += 1
+            activity.eth_out += value
+        if transaction['to'].lower() == address:
+            activity.num_in += 1
+            activity.eth_in += value
+        activity.gas += int(transaction['gas'])
+        activity.gas_used += int(transaction['gasUsed'])
+    if transactions:
+        activity.last_block = int(transactions[-1]['blockNumber'])
+    return activity
+
+
+def _token_transfer_totals(address: str, transfers: List[Dict[str, Any]]) -> TokenActivity:
+    activity = TokenActivity(address=address)
+    for transfer in transfers:
+        contract = transfer['contractAddress'].lower()
+        totals = activity.tokens.get(contract)
+        if totals is None:
+            totals = activity.tokens[contract] = TokenTransferTotals(
+                symbol=transfer['tokenSymbol'],
+                decimals=int(transfer['tokenDecimal'] or 0),
+            )
+        value = int(transfer['value'])
+        if transfer['from'].lower() == address:
+            totals.num_out += 1
+            totals.value_out += value
+        if transfer['to'].lower() == address:
+            totals.num_in += 1
+            totals.value_in += value
+    if transfers:
+        activity.last_block = int(transfers[-1]['blockNumber'])
+    return activity
+
+
+def _add_transaction_totals(activity: AddressActivity, new: AddressActivity) -> AddressActivity:
+    return AddressActivity(
+        address=activity.address,
+        last_block=max(activity.last_block, new.last_block),
+        **{
+            key: getattr(activity, key) + getattr(new, key)
+            for key in ['num_transactions', 'num_in', 'num_out', 'eth_in', 'eth_out', 'gas', 'gas_used']
+        },
+    )
+
+
+def _add_token_transfer_totals(activity: TokenActivity, new: TokenActivity) -> TokenActivity:
+    tokens = dict(activity.tokens)
+    for contract, totals in new.tokens.items():
+        previous = tokens.get(contract)
+        if previous is not None:
+            totals = TokenTransferTotals(
+                symbol=previous.symbol,
+                decimals=previous.decimals,
+                num_in=previous.num_in + totals.num_in,
+                num_out=previous.num_out + totals.num_out,
+                value_in=previous.value_in + totals.value_in,
+                value_out=previous.value_out + totals.value_out,
+            )
+        tokens[contract] = totals
+    return TokenActivity(address=activity.address, last_block=max(activity.last_block, new.last_block), tokens=tokens)
+
+
+def _get_activity_key(action: str, address: str, contract_address: Optional[str]) -> str:
+    return f'{action}:{address}' if contract_address is None else f'{action}:{address}:{contract_address}'
+
+
+def _refresh_activity(action: str, address: str, contract_address: Optional[str] = None) -> Dict[str, Any]:
+    """Fetch the records after the last block seen for the address, and add their totals to the last ones."""
+    key = _get_activity_key(action, address, contract_address)
+    if action == 'txlist':
+        activity: Any = _last_activity.get(key) or AddressActivity(address=address)
+        get_totals, add_totals = _transaction_totals, _add_transaction_totals
+    else:
+        activity = _last_activity.get(key) or TokenActivity(address=address)
+        get_totals, add_totals = _token_transfer_totals, _add_token_transfer_totals
+    # add up each page as it comes, rather than keeping the records of all of them
+    for page, is_last in _fetch_pages(action, address, activity.last_block + 1, contract_address):
+        activity = add_totals(activity, get_totals(address, page))
+        activity.is_truncated = not is_last
+    _last_activity.set(key, activity)
+    return asdict(activity)
+
+
+def get_address_activity(address: str) -> AddressActivity:
+    """Return the totals of the transactions of an address."""
+    address = address.lower()
+    obj = _activity_cache.get(_get_activity_key('txlist', address, None), lambda: _refresh_activity('txlist', address))
+    return AddressActivity(**obj)
+
+
+def get_token_activity(address: str, contract_address: Optional[str] = None) -> TokenActivity:
+    """Return the totals of the ERC-20 transfers of an address, by token, or of one token only if contract_address is given."""
+    address = address.lower()
+    if contract_address is not None:
+        contract_address = contract_address.lower()
+    key = _get_activity_key('tokentx', address, contract_address)
+    obj = _activity_cache.get(key, lambda: _refresh_activity('tokentx', address, contract_address))
+    return TokenActivity(
+        address=obj['address'],
+        last_block=obj['last_block'],
+        is_truncated=obj['is_truncated'],
+        tokens={contract: TokenTransferTotals(**totals) for contract, totals in obj['tokens'].items()},
+    )
+
+
 def get_all_transactions(address):
     # Construct the Etherscan API URL
     url = f'https://api.etherscan.io/api?module=account&action=getabi&address={address}&apikey={ETHERSCAN_API_KEY}'
     # Make the GET request
-    response = requests.get(url)
+    response = http_client.get(url)
     response.raise_for_status()
     # Parse the response
     data = response.json()
@@ -48,56 +259,22 @@ def get_all_transactions(address):
 
 
 def get_all_eth_from_address(address):
-    # Construct the Etherscan API URL
-    url = f'https://api.etherscan.io/api?module=account&action=txlist&address={address}&apikey={ETHERSCAN_API_KEY}&sort=desc'
-    # Make the GET request
-    response = requests.get(url)
-    response.raise_for_status()
-    # Parse the response
-    data = response.json()
-    transactions = data['result']
-    value = 0
-    for trans in transactions:
-        if trans['from'].lower() == address.lower():
-            value += int(trans['value'])
-    return value
+    return get_address_activity(address).eth_out
 
 
 def get_all_eth_to_address(address):
-    # Construct the Etherscan API URL
-    url = f'https://api.etherscan.io/api?module=account&action=txlist&address={address}&apikey={ETHERSCAN_API_KEY}&sort=desc'
-    # Make the GET request
-    response = requests.get(url)
-    response.raise_for_status()
-    # Parse the response
-    data = response.json()
-    transactions = data['result']
-    value = 0
-    for trans in transactions:
-        if trans['to'].lower() == address.lower():
-            value += int(trans['value'])
-    return value
+    return get_address_activity(address).eth_in
 
 
 def get_all_gas_for_address(address):
-    # Construct the Etherscan API URL
-    url = f'https://api.etherscan.io/api?module=account&action=txlist&address={address}&apikey={ETHERSCAN_API_KEY}&sort=desc'
-    # Make the GET request
-    response = requests.get(url)
-    # Parse the response
-    data = response.json()
-    transactions = data['result']
-    value = 0
-    for trans in transactions:
-        value += int(trans['gas'])
-    return value
+    return get_address_activity(address).gas
 
 
 def get_token_transfer_history(token_address, address):
     # Construct the Etherscan API URL
     url = f'https://api.etherscan.io/api?module=account&action=tokentx&address={address}&contractaddress={token_address}&apikey={ETHERSCAN_API_KEY}&sort=desc'
     # Make the GET request
-    response = requests.get(url)
+    response = http_client.get(url)
     response.raise_for_status()
     # Parse the response
     data = response.json()
@@ -124,27 +301,19 @@ def get_token_transfer_history_from_address(token_address, address):
 
 
 def get_total_token_transfer_history_to_address(token_address, address):
-    transactions = get_token_transfer_history_to_address(token_address,
-                                                          address)
-    value = 0
-    for trans in transactions:
-        value += int(trans['value'])
-    return value
+    totals = get_token_activity(address, token_address).tokens.get(token_address.lower())
+    return totals.value_in if totals else 0
 
 
 def get_total_token_transfer_history_from_address(token_address, address):
-    transactions = get_token_transfer_history_from_address(token_address,
-                                                            address)
-    value = 0
-    for trans in transactions:
-        value += int(trans['value'])
-    return value
+    totals = get_token_activity(address, token_address).tokens.get(token_address.lower())
+    return totals.value_out if totals else 0
 
 def get_nft_transfer_history(token_address, address):
     # Construct the Etherscan API URL
     url = f'https://api.etherscan.io/api?module=account&action=tokennfttx&address={address}&contractaddress={token_address}&apikey={ETHERSCAN_API_KEY}&sort=desc'
     # Make the GET request
-    response = requests.get(url)
+    response = http_client.get(url)
     response.raise_for_status()
     # Parse the response
     data = response.json()
@@ -1,15 +1,17 @@
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-import requests
 from web3 import Web3
 
 from urllib.parse import urlencode
-from gpt_index.utils import ErrorToRetry, retry_on_exceptions_with_backoff
 
 import utils
+import utils.http_client as http_client
+import utils.metrics as metrics
 from chat.container import ContainerMixin, dataclass_to_container_params
 
+from . import cache
+
 
 HEADERS = {
     "accept": "application/json",
@@ -25,6 +27,10 @@ API_V2_URL = "https://api.opensea.io/v2"
 MAX_RESULTS = 100
 PAGE_LIMIT = 100
 
+_contract_slugs_cache = cache.IntegrationCache('opensea_contract_slugs', ttl=86400, maxsize=1000)
+# listings change often, cache them briefly, for the asset views of a collection browsed after its grid
+_listing_prices_cache = cache.IntegrationCache('opensea_listing_prices', ttl=60, stale_ttl=60, maxsize=200)
+
 # this represents an NFT collection
 @dataclass
 class NFTContract:
@@ -54,21 +60,17 @@ class NFTFulfillmentData:
 
 def fetch_contract(address: str) -> NFTContract:
     """Fetch data about a contract (collection)."""
-    url = f"{API_V2_URL}/chain/ethereum/contract/{address}/nfts"
-
-    def _exec_request():
-        response = requests.get(url, headers=HEADERS)
+    def fetch():
+        url = f"{API_V2_URL}/chain/ethereum/contract/{address}/nfts"
+        response = http_client.get(url, headers=HEADERS)
         response.raise_for_status()
-        return response.json()
+        obj = response.json()
+        return obj["nfts"][0]["collection"]
 
-    obj = retry_on_exceptions_with_backoff(
-        _exec_request,
-        [ErrorToRetry(requests.exceptions.HTTPError, _should_retry_exception)],
-    )
     return NFTContract(
         chain='ethereum',
         address=address,
-        slug=obj["nfts"][0]["collection"],
+        slug=_contract_slugs_cache.get(address, fetch),
     )
 
 def fetch_listings(address: str, token_id: str) -> List[NFTListing]:
@@ -85,15 +87,9 @@ def fetch_listings(address: str, token_id: str) -> List[NFTListing]:
     ))
     url = f"{API_V2_URL}/orders/{chain}/seaport/listings?{q}"
 
-    def _exec_request():
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        return response.json()
-
-    obj = retry_on_exceptions_with_backoff(
-        _exec_request,
-        [ErrorToRetry(requests.exceptions.HTTPError, _should_retry_exception)],
-    )
+    response = http_client.get(url, headers=HEADERS)
+    response.raise_for_status()
+    obj = response.json()
     for item in obj['orders']:
         price_value = int(item["current_price"])
         currency = "ETH"
@@ -114,6 +110,12 @@ def fetch_listings(address: str, token_id: str) -> List[NFTListing]:
 
 def fetch_all_listings(address: str, max_results: Optional[int] = None) -> List[NFTListing]:
     """Fetch all listings for a collection."""
+    listings, _ = _fetch_all_listings(address, max_results=max_results)
+    return listings
+
+
+def _fetch_all_listings(address: str, max_results: Optional[int] = None) -> Tuple[List[NFTListing], bool]:
+    """Fetch the listings for a collection, and whether these are all of them."""
     # NOTE: a given token ID might have more than one listing
     contract = fetch_contract(address)
     slug = contract.slug
@@ -132,15 +134,9 @@ def fetch_all_listings(address: str, max_results: Optional[int] = None) -> List[
         ))
         url = f"{API_V2_URL}/listings/collection/{slug}/all?{q}"
 
-        def _exec_request():
-            response = requests.get(url, headers=HEADERS)
-            response.raise_for_status()
-            return response.json()
-
-        obj = retry_on_exceptions_with_backoff(
-            _exec_request,
-            [ErrorToRetry(requests.exceptions.HTTPError, _should_retry_exception)],
-        )
+        response = http_client.get(url, headers=HEADERS)
+        response.raise_for_status()
+        obj = response.json()
         for item in obj['listings']:
             offer = item["protocol_data"]["parameters"]["offer"][0]
             item_address = offer["token"]
@@ -164,10 +160,48 @@ def fetch_all_listings(address: str, max_results: Optional[int] = None) -> List[
         next_cursor = obj.get("next")
         if not next_cursor:
             break
-    return ret[:max_results]
+    is_complete = not next_cursor and len(ret) <= max_results
+    return ret[:max_results], is_complete
+
+
+def _fetch_listing_prices(address: str, max_results: Optional[int]) -> Dict[str, Any]:
+    listings, is_complete = _fetch_all_listings(address, max_results=max_results)
+    cheapest: Dict[str, NFTListing] = {}
+    for listing in listings:
+        if listing.token_id not in cheapest or cheapest[listing.token_id].price_value > listing.price_value:
+            cheapest[listing.token_id] = listing
+    return dict(
+        prices={token_id: dict(price_str=listing.price_str, price_value=listing.price_value) for token_id, listing in cheapest.items()},
+        is_complete=is_complete,
+    )
+
+
+def _get_listing_prices_key(address: str, max_results: Optional[int]) -> str:
+    return f'{address}:{max_results}'
+
+
+def get_listing_prices(address: str, max_results: Optional[int] = None) -> Dict[str, Any]:
+    """Return the cheapest listing price of each listed token of a collection, fetched in bulk.
+
+    The prices by token id are under 'prices', and 'is_complete' tells
+    whether all the listings of the collection were fetched, i.e. whether
+    a token missing from prices is unlisted. The result is cached briefly
+    and shared, so don't modify it.
+
+    """
+    return _listing_prices_cache.get(_get_listing_prices_key(address, max_results), lambda: _fetch_listing_prices(address, max_results))
 
 
 def fetch_asset_listing_prices_with_retries(address: str, token_id: str) -> Optional[Dict[str, Union[str, int]]]:
+    # use the listings of the collection if they were just fetched in bulk,
+    # e.g. for its grid, but don't page through them for a single asset
+    is_cached, listing_prices = _listing_prices_cache.peek(_get_listing_prices_key(address, None))
+    if is_cached:
+        price_dict = listing_prices['prices'].get(token_id)
+        if price_dict is not None or listing_prices['is_complete']:
+            metrics.incr('opensea.listing_price_lookups', source='collection')
+            return price_dict
+    metrics.incr('opensea.listing_price_lookups', source='asset')
     listings = fetch_listings(address, token_id)
     for listing in listings:
         return dict(price_str=listing.price_str, price_value=listing.price_value)
@@ -178,12 +212,7 @@ def fetch_asset_listing_with_retries(address: str, token_id: str) -> Optional[NF
     return listings[0] if len(listings) > 0 else None
 
 def fetch_contract_listing_prices_with_retries(address: str, max_results: Optional[int] = None) -> Dict[str, Dict[str, Union[str, int]]]:
-    listings = fetch_all_listings(address, max_results=max_results)
-    ret = {}
-    for listing in listings:
-        if listing.token_id not in ret or ret[listing.token_id].price_value > listing.price_value:
-            ret[listing.token_id] = listing
-    return {token_id: dict(price_str=listing.price_str, price_value=listing.price_value) for token_id, listing in ret.items()}
+    return get_listing_prices(address, max_results=max_results)['prices']
 
 def fetch_fulfillment_data_with_retries(network: str, order_hash: str, fulfiller_address: str, protocol_address: str) -> NFTFulfillmentData:
     normalized_network = NETWORKS_MAP.get(network, network)
@@ -199,24 +228,11 @@ def fetch_fulfillment_data_with_retries(network: str, order_hash: str, fulfiller
         },
     }
 
-    def _exec_request():
-        response = requests.post(url, headers=HEADERS, json=data)
-        response.raise_for_status()
-        return response.json()
-
-    fulfillment_data = retry_on_exceptions_with_backoff(
-        _exec_request,
-        [ErrorToRetry(requests.exceptions.HTTPError, _should_retry_exception)],
-    )
+    response = http_client.post(url, headers=HEADERS, json=data, idempotent=True)
+    response.raise_for_status()
+    fulfillment_data = response.json()
     return NFTFulfillmentData(
         parameters=fulfillment_data["fulfillment_data"]["orders"][0]["parameters"],
         signature=fulfillment_data["fulfillment_data"]["orders"][0]["signature"],
         value_amount=fulfillment_data["fulfillment_data"]["transaction"]["value"],
     )
-
-
-def _should_retry_exception(exception):
-    if exception.response.status_code in (400, 401, 402, 403, 404, 405, 406):
-        # forbidden, unauthorized, invalid requests
-        return False
-    return True
@@ -0,0 +1,64 @@
+"""
+Concurrent fetching of paginated results from the NFT APIs.
+
+Pages are fetched on a thread pool shared by the process, ahead of the page
+being consumed, so that the next page is on its way while the results of
+the current one are streamed. Independent requests, e.g. the same search on
+several networks, can be fanned out on the same pool. Requests in flight to
+each upstream are bounded by the HTTP client, to respect its rate limits.
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Generator, Iterable, Optional, TypeVar
+import contextvars
+import itertools
+
+import context
+import utils.widget_executor as widget_executor
+from utils.constants import PAGINATOR_CONCURRENCY
+
+
+T = TypeVar('T')
+
+# pages fetched ahead of the one being consumed
+PREFETCH_PAGES = 1
+
+# separate from the widget command pool, as the commands themselves wait on these fetches
+_executor = ThreadPoolExecutor(max_workers=PAGINATOR_CONCURRENCY, thread_name_prefix='paginator')
+
+
+def submit(fn: Callable[..., T], *args: Any) -> 'Future[T]':
+    """Run fn on the paginator pool, with the request context and context variables of the caller."""
+    return _executor.submit(contextvars.copy_context().run, context.run_with_request_context, context.get_request_context(), fn, *args)
+
+
+def map_concurrently(fn: Callable[[Any], T], items: Iterable[Any], max_in_flight: int = PAGINATOR_CONCURRENCY) -> Generator[T, None, None]:
+    """Yield fn(item) for each item, in order, evaluating up to max_in_flight items ahead."""
+    futures: Deque[Future] = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            if widget_executor.is_cancelled():
+                # the widget command consuming the results timed out, stop fetching
+                return
+            futures.append(submit(fn, item))
+            if len(futures) >= max_in_flight:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        # the consumer stopped early, drop the evaluations not started yet
+        for future in futures:
+            future.cancel()
+
+
+def fetch_pages(fetch_page: Callable[[int], T], max_pages: Optional[int] = None, prefetch: int = PREFETCH_PAGES) -> Generator[T, None, None]:
+    """Yield fetch_page(0), fetch_page(1), ... in order, fetching up to prefetch pages ahead.
+
+    The consumer stops when it has enough results or reaches the last page,
+    so a page past the last one may be fetched, but not waited on.
+
+    """
+    pages = range(max_pages) if max_pages is not None else itertools.count()
+    yield from map_concurrently(fetch_page, pages, max_in_flight=prefetch + 1)
+
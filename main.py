@@ -1,9 +1,11 @@
 import env
 import asyncio
+import hmac
+import json
 from dataclasses import dataclass
 from typing import Any, Dict, Optional, Set
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.responses import StreamingResponse
@@ -11,8 +13,11 @@ from fastapi.responses import StreamingResponse
 import server
 import chat
 import auth
+import scheduler
+import utils.metrics as metrics
 
-from  utils import SERVER_ORIGINS, SERVER_SECRET_KEY
+from  utils import SERVER_ORIGINS, SERVER_SECRET_KEY, ASYNC_CHAT_PIPELINE, CHAT_MAX_CONCURRENT_TURNS, CHAT_MAX_QUEUED_TURNS, METRICS_API_KEY, ETH_MAINNET_CHAIN_ID
+from utils.common import prefetch_user_info
 from app import chat as app_chat
 from app import share as app_share
 
@@ -69,6 +74,14 @@ async def handle_unset_session_cookie(request: Request, call_next: Any):
 
 websockets: Set[WebSocket] = set()
 
+chat_turn_scheduler = scheduler.ChatTurnScheduler(
+    max_concurrent_turns=CHAT_MAX_CONCURRENT_TURNS,
+    max_queued_turns=CHAT_MAX_QUEUED_TURNS,
+)
+
+# message types that are cheap to process and bypass chat turn admission control
+_UNSCHEDULED_MESSAGE_TYPES = ('cfg', 'clear', 'init')
+
 
 @dataclass
 class ClientState:
@@ -86,6 +99,15 @@ async def api_nonce(request: Request):
 async def fetch_nft_image(request: Request, network: str, address: str, token_id: str, size: str):
     return center.fetch_center_image(request, network, address, token_id, size)
 
+@app.get("/metrics")
+async def api_metrics(request: Request) -> Dict:
+    # internal only: upstream errors and latencies, and scheduler state
+    if not METRICS_API_KEY:
+        raise HTTPException(status_code=404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_API_KEY}'):
+        raise HTTPException(status_code=401)
+    return metrics.snapshot()
+
 @app.post("/login")
 async def api_login(request: Request, data: auth.AcceptJSON):
     return auth.api_login(request, data)
@@ -168,17 +190,70 @@ async def _handle_websocket(websocket: WebSocket):
 
             # Fetch authenticated wallet address from the session cookies. If
             # not authenticated, this is None, and we handle this inside
-            client_state.wallet_address = auth.fetch_authenticated_wallet_address(websocket)
+            wallet_address = auth.fetch_authenticated_wallet_address(websocket)
             client_state.user_id = auth.fetch_authenticated_user_id(websocket)
 
             queue = asyncio.queues.Queue()
+            loop = asyncio.get_running_loop()
+
+            if wallet_address and wallet_address != client_state.wallet_address:
+                # resolve the user info (ENS name etc.) of the system prompt
+                # while the turn starts, rather than on the way to the LLM call,
+                # on mainnet like the chat turns, as the client doesn't pick a chain
+                loop.run_in_executor(None, prefetch_user_info, wallet_address, ETH_MAINNET_CHAIN_ID, None)
+            client_state.wallet_address = wallet_address
 
             def send_response(msg):
-                queue.put_nowait(msg)
+                # this may get called from a worker thread, so hand off to the event loop
+                loop.call_soon_threadsafe(queue.put_nowait, msg)
+
+            async def handle_message():
+                if ASYNC_CHAT_PIPELINE:
+                    await server.amessage_received(client_state, send_response, message)
+                else:
+                    await asyncio.to_thread(server.message_received, client_state, send_response, message)
+
+            is_queued = False
+
+            def send_queue_position(position):
+                # the client shows the position while the turn waits, and clears it on an empty payload
+                send_response(json.dumps({
+                    'messageId': '',
+                    'actor': 'system',
+                    'type': 'queued',
+                    'payload': str(position) if position else '',
+                    'feedback': 'n/a',
+                }))
+
+            def send_queued(position):
+                nonlocal is_queued
+                is_queued = True
+                send_queue_position(position)
+
+            async def handle_admitted_message():
+                if is_queued:
+                    send_queue_position(None)
+                await handle_message()
 
             async def process_message():
-                await asyncio.to_thread(server.message_received, client_state, send_response, message)
-                send_response(None)  # send sentinel
+                try:
+                    if json.loads(message).get('type') in _UNSCHEDULED_MESSAGE_TYPES:
+                        await handle_message()
+                    else:
+                        user_key = client_state.user_id or id(websocket)
+                        await chat_turn_scheduler.run(user_key, handle_admitted_message, on_queued=send_queued)
+                except scheduler.SchedulerQueueFull:
+                    send_response(json.dumps({
+                        'messageId': 0,
+                        'actor': 'bot',
+                        'type': 'text',
+                        'payload': 'The server is busy right now, please try again in a moment.',
+                        'stillThinking': False,
+                        'operation': 'create',
+                        'feedback': 'n/a',
+                    }))
+                finally:
+                    send_response(None)  # send sentinel
 
             async def send_responses():
                 while True:
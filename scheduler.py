@@ -0,0 +1,131 @@
+"""
+Admission control for chat turns.
+
+Caps the number of chat turns processed concurrently in this worker process.
+Turns beyond the cap wait in a bounded queue that is served round-robin across
+users, so that one user sending many messages cannot starve others. When the
+queue is full, new turns are rejected right away instead of piling up.
+"""
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+import utils.metrics as metrics
+
+
+class SchedulerQueueFull(Exception):
+    pass
+
+
+class ChatTurnScheduler:
+    def __init__(self, max_concurrent_turns: int, max_queued_turns: int) -> None:
+        assert max_concurrent_turns > 0, 'expecting at least one concurrent turn'
+        self.max_concurrent_turns = max_concurrent_turns
+        self.max_queued_turns = max_queued_turns
+        self._active = 0
+        self._num_queued = 0
+        # user key -> waiters of that user, in arrival order. The order of users
+        # in this dict is the round-robin order in which they will be served.
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = collections.OrderedDict()
+
+    @property
+    def num_active(self) -> int:
+        return self._active
+
+    @property
+    def num_queued(self) -> int:
+        return self._num_queued
+
+    async def run(self, user_key: Hashable, turn: Callable[[], Awaitable[Any]], on_queued: Optional[Callable[[int], None]] = None) -> Any:
+        """Run a chat turn once admitted.
+
+        If the turn has to wait, on_queued is called with its 1-based position
+        in the queue. Raises SchedulerQueueFull if the queue is already full.
+
+        """
+        await self._acquire(user_key, on_queued)
+        try:
+            return await turn()
+        finally:
+            self._release()
+
+    async def _acquire(self, user_key: Hashable, on_queued: Optional[Callable[[int], None]]) -> None:
+        start = time.time()
+        if self._active < self.max_concurrent_turns and not self._num_queued:
+            self._active += 1
+            self._update_gauges()
+            metrics.observe('chat_scheduler.wait_time', 0.0)
+            return
+
+        if self._num_queued >= self.max_queued_turns:
+            metrics.incr('chat_scheduler.rejected')
+            raise SchedulerQueueFull()
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_key, collections.deque()).append(fut)
+        self._num_queued += 1
+        self._update_gauges()
+        metrics.incr('chat_scheduler.queued')
+        if on_queued is not None:
+            on_queued(self._position(user_key, fut))
+
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # we were already admitted, give the slot to the next waiter
+                self._release()
+            else:
+                self._remove_waiter(user_key, fut)
+            raise
+        metrics.observe('chat_scheduler.wait_time', time.time() - start)
+
+    def _release(self) -> None:
+        self._active -= 1
+        while self._waiters and self._active < self.max_concurrent_turns:
+            fut = self._pop_next_waiter()
+            if fut.done():  # cancelled while waiting
+                continue
+            self._active += 1
+            fut.set_result(None)
+        self._update_gauges()
+
+    def _pop_next_waiter(self) -> asyncio.Future:
+        # take the first waiter of the user at the front, then move that user
+        # to the back of the rotation if they have more waiters
+        user_key, waiters = next(iter(self._waiters.items()))
+        fut = waiters.popleft()
+        del self._waiters[user_key]
+        if waiters:
+            self._waiters[user_key] = waiters
+        self._num_queued -= 1
+        return fut
+
+    def _remove_waiter(self, user_key: Hashable, fut: asyncio.Future) -> None:
+        waiters = self._waiters.get(user_key)
+        if waiters is None or fut not in waiters:
+            return
+        waiters.remove(fut)
+        if not waiters:
+            del self._waiters[user_key]
+        self._num_queued -= 1
+        self._update_gauges()
+
+    def _position(self, user_key: Hashable, fut: asyncio.Future) -> int:
+        """Position at which this waiter will be admitted, following the round-robin order."""
+        rank = self._waiters[user_key].index(fut)
+        position = rank + 1
+        before_us = True
+        for other_key, other_waiters in self._waiters.items():
+            if other_key == user_key:
+                before_us = False
+                continue
+            # each round serves one waiter per user, users ahead of us in the
+            # rotation get one more turn than those behind us before we are served
+            position += min(len(other_waiters), rank + 1 if before_us else rank)
+        return position
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge('chat_scheduler.active_turns', self._active)
+        metrics.set_gauge('chat_scheduler.queue_depth', self._num_queued)
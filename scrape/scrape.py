@@ -1,9 +1,10 @@
 from typing import Any, Dict, Set
 import json
 import os
-import requests
 from urllib.parse import urlparse
 
+import utils.http_client as http_client
+
 
 from .models import (
     db_session,
@@ -13,6 +14,8 @@ from .models import (
 
 BROWSERLESS_API_KEY = os.getenv('BROWSERLESS_API_KEY', '')
 SCRAPE_API_URL = f'https://chrome.browserless.io/scrape?token={BROWSERLESS_API_KEY}'
+# scraping renders the page in a browser, so it can take much longer than other requests
+SCRAPE_TIMEOUT = 120
 
 
 def sanitize_url(url: str) -> str:
@@ -68,18 +71,12 @@ def _scrape_url(url: str) -> Dict:
 
 
 def _request(payload, max_tries=10):
-    for attempt in range(max_tries):
-        try:
-            r = requests.post(SCRAPE_API_URL, headers={
-                'Cache-Control': 'no-cache',
-                'Content-Type': 'application/json',
-            }, data=payload)
-            r.raise_for_status()
-            return r
-        except:
-            if attempt < max_tries - 1:
-                continue
-            raise
+    r = http_client.post(SCRAPE_API_URL, headers={
+        'Cache-Control': 'no-cache',
+        'Content-Type': 'application/json',
+    }, data=payload, idempotent=True, retries=max_tries - 1, timeout=(http_client.HTTP_CONNECT_TIMEOUT, SCRAPE_TIMEOUT))
+    r.raise_for_status()
+    return r
 
 
 def has_scrape_error(output: Any) -> bool:
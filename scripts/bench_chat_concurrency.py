@@ -0,0 +1,152 @@
+"""
+Load benchmark for the websocket chat turn pipeline.
+
+Simulates many concurrent chat sessions within a single worker process, each
+streaming an llm response, and compares the thread-based path (every turn in
+a worker thread, as with asyncio.to_thread(server.message_received, ...))
+against the async path (BaseChat.areceive_input with an async llm stream).
+
+The function_call path runs the async path of ChatGPTFunctionCallChat, with
+its token handling, against a simulated llm stream.
+
+The llm and db are simulated with fixed latencies so that the result reflects
+how many turns a process can serve at once, not upstream speed.
+
+Run with: python3 -m scripts.bench_chat_concurrency --sessions 16,64,256
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import time
+import uuid
+
+from langchain.schema import AIMessage
+
+from chat.base import BaseChat, ChatHistory, Response
+import streaming
+
+
+class _SimulatedChat(BaseChat):
+    """Chat module streaming a fixed number of tokens at a fixed rate."""
+
+    def __init__(self, num_tokens: int, token_delay: float, native_async: bool) -> None:
+        self.num_tokens = num_tokens
+        self.token_delay = token_delay
+        self.native_async = native_async
+
+    def receive_input(self, history, user_input, send, message_id=None, before_message_id=None):
+        bot_chat_message_id = None
+        for i in range(self.num_tokens):
+            time.sleep(self.token_delay)  # blocking llm stream
+            bot_chat_message_id = send(Response(
+                response=f'token{i} ',
+                operation='append' if bot_chat_message_id is not None else 'create',
+            ), last_chat_message_id=bot_chat_message_id)
+
+    async def areceive_input(self, history, user_input, send, message_id=None, before_message_id=None):
+        if not self.native_async:
+            return await super().areceive_input(history, user_input, send, message_id, before_message_id)
+        bot_chat_message_id = None
+        for i in range(self.num_tokens):
+            await asyncio.sleep(self.token_delay)  # async llm stream
+            bot_chat_message_id = await send(Response(
+                response=f'token{i} ',
+                operation='append' if bot_chat_message_id is not None else 'create',
+            ), last_chat_message_id=bot_chat_message_id)
+
+
+class _SimulatedLLM:
+    """Async llm client streaming a fixed number of tokens at a fixed rate to its handler."""
+
+    def __init__(self, new_token_handler, num_tokens: int, token_delay: float) -> None:
+        self.new_token_handler = new_token_handler
+        self.num_tokens = num_tokens
+        self.token_delay = token_delay
+
+    async def apredict_messages(self, messages, functions=None):
+        content = ''
+        for i in range(self.num_tokens):
+            await asyncio.sleep(self.token_delay)  # async llm stream
+            token = f'token{i} '
+            await self.new_token_handler(token)
+            content += token
+        return AIMessage(content=content)
+
+
+def _get_function_call_chat(args: argparse.Namespace) -> BaseChat:
+    from chat.chatgpt_function_call import ChatGPTFunctionCallChat
+
+    streaming.get_streaming_llm = lambda new_token_handler, **kwargs: _SimulatedLLM(new_token_handler, args.num_tokens, args.token_delay)
+    chat = ChatGPTFunctionCallChat(widget_index=None, model_name='gpt-4-0613')
+    # each session has a single message, so skip the history truncation and its tokenizer
+    chat.token_limit = None
+    return chat
+
+
+async def _run_session(chat: BaseChat, db_delay: float, first_token_latencies: list) -> None:
+    start = time.time()
+    first_token = True
+
+    async def send_message(resp, last_chat_message_id=None, before_message_id=None):
+        nonlocal first_token
+        if first_token:
+            first_token_latencies.append(time.time() - start)
+            first_token = False
+        if resp.operation == 'create':
+            await asyncio.sleep(db_delay)  # simulated insert
+            return uuid.uuid4()
+        return last_chat_message_id
+
+    history = ChatHistory.new(uuid.uuid4())
+    await chat.areceive_input(history, 'hello', send_message, None, None)
+
+
+async def _run(num_sessions: int, path: str, args: argparse.Namespace) -> dict:
+    loop = asyncio.get_running_loop()
+    # use the same default executor sizing as asyncio
+    max_workers = args.max_workers or min(32, (os.cpu_count() or 1) + 4)
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=max_workers))
+
+    if path == 'function_call':
+        chat = _get_function_call_chat(args)
+    else:
+        chat = _SimulatedChat(args.num_tokens, args.token_delay, native_async=path == 'async')
+    first_token_latencies: list = []
+    start = time.time()
+    await asyncio.gather(*[
+        _run_session(chat, args.db_delay, first_token_latencies)
+        for _ in range(num_sessions)
+    ])
+    duration = time.time() - start
+    single_turn = args.num_tokens * args.token_delay
+    first_token_latencies.sort()
+    return dict(
+        duration=duration,
+        # how many turns were effectively served at once
+        effective_concurrency=num_sessions * single_turn / duration,
+        p50_first_token=first_token_latencies[len(first_token_latencies) // 2],
+        max_first_token=first_token_latencies[-1],
+        max_workers=max_workers,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', default='16,64,256')
+    parser.add_argument('--num-tokens', type=int, default=50)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--db-delay', type=float, default=0.005)
+    parser.add_argument('--max-workers', type=int, default=None)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'path':>13} {'duration':>9} {'concurrency':>12} {'p50 first':>10} {'max first':>10}")
+    for num_sessions in [int(n) for n in args.sessions.split(',')]:
+        for path in ['thread', 'async', 'function_call']:
+            ret = asyncio.run(_run(num_sessions, path, args))
+            print(f"{num_sessions:>8} {path:>13} {ret['duration']:>8.2f}s {ret['effective_concurrency']:>12.1f} {ret['p50_first_token']:>9.3f}s {ret['max_first_token']:>9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Microbenchmark for ChatHistory message lookups on long histories.
+
+Times insert-before, find_next_human_message and truncate_from_message (as
+done by an edit/regenerate) at random positions, against a plain linear scan
+by message id for reference, which is what every lookup used to cost.
+
+Run with: python3 -m scripts.bench_chat_history --messages 10000
+"""
+
+import argparse
+import random
+import time
+import uuid
+
+from chat.base import ChatHistory
+
+
+def _build_history(num_messages: int) -> ChatHistory:
+    history = ChatHistory.new(uuid.uuid4())
+    for i in range(num_messages // 2):
+        history.add_user_message(f'question {i}', message_id=uuid.uuid4())
+        history.add_bot_message(f'answer {i}', message_id=uuid.uuid4())
+    return history
+
+
+def _scan(history: ChatHistory, message_id: uuid.UUID) -> int:
+    for idx in range(len(history.messages)):
+        if history.messages[idx].message_id == message_id:
+            return idx
+    return -1
+
+
+def _time_us(fn, args_list) -> float:
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) * 1e6 / len(args_list)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--ops', type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    history = _build_history(args.messages)
+
+    def random_ids(actor=None):
+        messages = [m for m in history.messages if actor is None or m.actor == actor]
+        return [(random.choice(messages).message_id,) for _ in range(args.ops)]
+
+    results = {}
+    results['linear scan (reference)'] = _time_us(lambda message_id: _scan(history, message_id), random_ids())
+    results['insert before'] = _time_us(
+        lambda message_id: history.add_system_message('inserted', message_id=uuid.uuid4(), before_message_id=message_id),
+        random_ids(),
+    )
+    results['find next human'] = _time_us(history.find_next_human_message, random_ids())
+
+    def regenerate(message_id):
+        # truncate from a user message up to the next one, then add the answer back
+        before_message_id = history.find_next_human_message(message_id)
+        history.truncate_from_message(message_id, before_message_id=before_message_id)
+        history.add_user_message('question', message_id=message_id, before_message_id=before_message_id)
+        history.add_bot_message('answer', message_id=uuid.uuid4(), before_message_id=before_message_id)
+
+    results['regenerate'] = _time_us(regenerate, random_ids('user'))
+
+    print(f"{len(history.messages)} messages, mean over {args.ops} ops")
+    for name, us in results.items():
+        print(f"{name:>24} {us:>10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark for resolving tokens against the CoinGecko coin list.
+
+Times resolving token queries by scanning the coin list (as fetch_price did
+before), against lookups in the CoinIndex, and reports the time to build the
+index and the memory it takes on top of the coin list. Queries are ids,
+symbols and names from the list, in mixed case, and unknown tokens, which
+were the worst case of the scan.
+
+Run with: python3 -m scripts.bench_coin_index [--queries 1000]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from utils.coingecko.coingecko_coin_currency import get_coin_list
+from utils.coingecko.coin_index import CoinIndex, load_ranks
+
+
+def _scan(basetoken):
+    for c in get_coin_list():
+        if c['id'].lower() == basetoken.lower() or \
+            c['symbol'].lower() == basetoken.lower() or \
+                c['name'].lower() == basetoken.lower():
+            return c
+    return None
+
+
+def _time_ms(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    coin_list = get_coin_list()
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = CoinIndex(coin_list, load_ranks())
+    build_ms = (time.perf_counter() - start) * 1000
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+
+    rng = random.Random(0)
+    coins = rng.sample(coin_list, args.queries)
+    hits = [coin[rng.choice(['id', 'symbol', 'name'])].upper() for coin in coins]
+    misses = [f"{coin['symbol']}x" for coin in coins[:args.queries // 10]]
+    typos = [coin['name'][:-1] for coin in coins[:args.queries // 10] if len(coin['name']) > 4]
+
+    print(f"{len(coin_list)} coins, index built in {build_ms:.1f}ms, {memory_mb:.1f}MB")
+    print(f"{'':>16} {'hit':>10} {'miss':>10}")
+    print(f"{'scan':>16} {_time_ms(_scan, hits):>10.4f}ms {_time_ms(_scan, misses):>10.4f}ms")
+    print(f"{'index resolve':>16} {_time_ms(index.resolve, hits):>10.4f}ms {_time_ms(index.resolve, misses):>10.4f}ms")
+    print(f"{'index prefix':>16} {_time_ms(index.prefix, typos):>10.4f}ms")
+    print(f"{'index fuzzy':>16} {_time_ms(index.fuzzy, typos):>10.4f}ms")
+
+
+if __name__ == "__main__":
+    main()
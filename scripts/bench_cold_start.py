@@ -0,0 +1,49 @@
+"""
+Benchmark for the cold start of the server and the eval and finetune CLIs.
+
+Times importing main (what uvicorn main:app does before serving),
+eval.validate and finetune.generate in fresh processes, with the reference
+data cache cleared before the first run (cold) and filled for the following
+runs (warm). The cache is off by default, set REFERENCE_DATA_CACHE_DIR to a
+directory private to the user (mode 0700) to measure it. Compare against the same runs on a previous commit to see the
+effect of a change.
+
+Run with: python3 -m scripts.bench_cold_start [--runs 5]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from utils.constants import REFERENCE_DATA_CACHE_DIR
+
+
+MODULES = ['main', 'eval.validate', 'finetune.generate']
+
+
+def _time_import(module: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':>20} {'cold':>8} {'warm':>8}")
+    for module in MODULES:
+        if REFERENCE_DATA_CACHE_DIR and os.path.exists(REFERENCE_DATA_CACHE_DIR):
+            shutil.rmtree(REFERENCE_DATA_CACHE_DIR)
+        cold = _time_import(module)
+        warm = statistics.median(_time_import(module) for _ in range(args.runs))
+        print(f"{module:>20} {cold:>7.2f}s {warm:>7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark for building the calldata of Aave supply and borrow transactions.
+
+Builds the calldata as the Aave workflows do, first the way they did before
+(reading and parsing the ABI file, creating the contract and matching the
+function against the whole ABI on every transaction), then through the
+contract factory (ABI parsed once, contract cached per provider and address,
+function selectors precomputed). No requests are made to the node.
+
+Run with: python3 -m scripts.bench_contract_factory [--iterations 2000]
+"""
+
+import argparse
+import time
+
+from web3 import Web3
+
+from utils import load_contract_abi, get_contract, get_contract_abi
+
+
+AAVE_POOL_V3_PROXY_ADDRESS = Web3.to_checksum_address("0x87870bca3f3fd6335c3f4ce8392d69350b4fa4e2")
+AAVE_POOL_V3_ABI_PATH = "../ui_workflows/aave/abis/aave_pool_v3.abi.json"
+USDC_ADDRESS = Web3.to_checksum_address("0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48")
+WALLET_ADDRESS = Web3.to_checksum_address("0xd8da6bf26964af9d7eed9e03e53415d37aa96045")
+
+
+def _build_txs(get_pool_contract):
+    supply = get_pool_contract().encodeABI(fn_name='supply', args=[USDC_ADDRESS, 10 ** 9, WALLET_ADDRESS, 0])
+    borrow = get_pool_contract().encodeABI(fn_name='borrow', args=[USDC_ADDRESS, 10 ** 8, 2, 0, WALLET_ADDRESS])
+    return supply, borrow
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    web3_provider = Web3(Web3.HTTPProvider('http://127.0.0.1:8545'))
+
+    def uncached():
+        return web3_provider.eth.contract(address=AAVE_POOL_V3_PROXY_ADDRESS, abi=load_contract_abi(__file__, AAVE_POOL_V3_ABI_PATH))
+
+    def cached():
+        return get_contract(web3_provider, AAVE_POOL_V3_PROXY_ADDRESS, get_contract_abi(__file__, AAVE_POOL_V3_ABI_PATH))
+
+    assert _build_txs(uncached) == _build_txs(cached)
+    print(f"{args.iterations} supply + borrow transactions")
+    for name, get_pool_contract in [('uncached', uncached), ('cached', cached)]:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            _build_txs(get_pool_contract)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10} {elapsed / args.iterations * 1e6:>8.0f}us per supply + borrow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark for the shared HTTP client against a local mock API.
+
+Sends sequential GET requests to a local server with a simulated service
+time, with bare requests.get (as the integrations did before), and with the
+shared http_client, and reports the mean latency. With --tls, the server
+uses a self-signed certificate (generated with openssl), so that the cost
+of the TLS handshake avoided by keep-alive connections shows. It then makes
+the server fail a fraction of the requests with 503, and reports the
+fraction of calls that succeed, without and with retries.
+
+Run with: python3 -m scripts.bench_http_client [--requests 200] [--tls] [--failure-rate 0.2]
+"""
+
+import argparse
+import http.server
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+
+import utils.http_client as http_client
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent separately, which stalls on delayed ACKs with keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.service_time)
+        status = 503 if random.random() < self.server.failure_rate else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server(tls_dir):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.service_time = 0.001
+    server.failure_rate = 0.0
+    scheme = 'http'
+    if tls_dir:
+        cert_path = os.path.join(tls_dir, 'cert.pem')
+        key_path = os.path.join(tls_dir, 'key.pem')
+        subprocess.run([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-keyout', key_path, '-out', cert_path, '-subj', '/CN=127.0.0.1',
+            '-addext', 'subjectAltName=IP:127.0.0.1',
+        ], check=True, capture_output=True)
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(cert_path, key_path)
+        server.socket = ssl_context.wrap_socket(server.socket, server_side=True)
+        server.cert_path = cert_path
+        scheme = 'https'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f'{scheme}://127.0.0.1:{server.server_address[1]}'
+    return server
+
+
+def _mean_ms(fn, num_requests):
+    start = time.perf_counter()
+    for i in range(num_requests):
+        fn(i)
+    return (time.perf_counter() - start) * 1000 / num_requests
+
+
+def _is_ok(get, url, **kwargs):
+    try:
+        return get(url, **kwargs).ok
+    except http_client.CircuitOpenError:
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--failure-rate', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tls_dir:
+        server = _start_server(tls_dir if args.tls else None)
+        kwargs = dict(verify=server.cert_path) if args.tls else {}
+
+        print(f"{args.requests} sequential requests to {server.url}")
+        bare_ms = _mean_ms(lambda i: requests.get(f'{server.url}/{i}', **kwargs).raise_for_status(), args.requests)
+        client_ms = _mean_ms(lambda i: http_client.get(f'{server.url}/{i}', **kwargs).raise_for_status(), args.requests)
+        print(f"{'requests.get':>16} {bare_ms:>8.2f}ms")
+        print(f"{'http_client.get':>16} {client_ms:>8.2f}ms")
+
+        server.failure_rate = args.failure_rate
+        http_client.BACKOFF_BASE = 0.001
+        bare_ok = sum(_is_ok(requests.get, f'{server.url}/{i}', **kwargs) for i in range(args.requests))
+        client_ok = sum(_is_ok(http_client.get, f'{server.url}/{i}', **kwargs) for i in range(args.requests))
+        print(f"{args.failure_rate:.0%} of responses failing with 503, successful calls:")
+        print(f"{'requests.get':>16} {bare_ok / args.requests:>8.1%}")
+        print(f"{'http_client.get':>16} {client_ok / args.requests:>8.1%}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark for fetching pages of NFT API results ahead of streaming them.
+
+Pages through a local mock API with a simulated service time, and streams
+each result to a consumer that takes a little time per result (as the
+StreamingListContainer does, sending each item to the client), first one
+page after the other (as center.py did before), then with the paginator
+fetching the next pages ahead. Reports the time to the first result and the
+total time.
+
+Run with: python3 -m scripts.bench_nft_pagination [--pages 5] [--service-time 0.2]
+"""
+
+import argparse
+import http.server
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import utils.http_client as http_client
+from integrations import paginator
+
+
+PAGE_LIMIT = 12
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.service_time)
+        offset = int(parse_qs(urlparse(self.path).query)['offset'][0])
+        items = list(range(offset, min(offset + PAGE_LIMIT, self.server.num_results)))
+        body = json.dumps(dict(items=items, onLastPage=offset + PAGE_LIMIT >= self.server.num_results)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _consume(pages, time_per_result):
+    start = time.perf_counter()
+    first = None
+    for obj in pages:
+        for _ in obj['items']:
+            if first is None:
+                first = time.perf_counter() - start
+            time.sleep(time_per_result)
+        if obj['onLastPage']:
+            break
+    return first, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--service-time', type=float, default=0.2)
+    parser.add_argument('--time-per-result', type=float, default=0.01)
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.service_time = args.service_time
+    server.num_results = args.pages * PAGE_LIMIT
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/traits'
+
+    def fetch_page(page):
+        return http_client.get(f'{url}?offset={page * PAGE_LIMIT}').json()
+
+    def sequential():
+        page = 0
+        while True:
+            yield fetch_page(page)
+            page += 1
+
+    print(f"{args.pages} pages of {PAGE_LIMIT} results, {args.service_time * 1000:.0f}ms per page")
+    print(f"{'':>12} {'first':>8} {'total':>8}")
+    for name, pages in [
+            ('sequential', sequential()),
+            ('prefetch', paginator.fetch_pages(fetch_page)),
+    ]:
+        first, total = _consume(pages, args.time_per_result)
+        print(f"{name:>12} {first * 1000:>6.0f}ms {total * 1000:>6.0f}ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
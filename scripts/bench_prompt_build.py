@@ -0,0 +1,63 @@
+"""
+Benchmark for building the prompt of a chat turn from long chat histories.
+
+For each history size, simulates turns (add the user message, build the
+prompt with ChatHistory.to_openai_messages under a token limit, add the bot
+response) and reports the mean prompt build time. For reference it also
+times the build with token counts dropped before every turn, i.e. with the
+history re-tokenized on every turn. This is an upper bound of the previous
+cost, which re-tokenized from the newest message back to the token limit.
+
+Run with: python3 -m scripts.bench_prompt_build --messages 50,500,5000
+"""
+
+import argparse
+import random
+import time
+import uuid
+
+from chat.base import ChatHistory
+
+
+def _build_history(num_messages: int) -> ChatHistory:
+    history = ChatHistory.new(uuid.uuid4())
+    for i in range(num_messages // 2):
+        history.add_user_message(f'what is the price of token number {i} on uniswap today?', message_id=uuid.uuid4())
+        history.add_bot_message(' '.join(['the price is about 1.23 usd'] * random.randint(1, 20)), message_id=uuid.uuid4())
+    return history
+
+
+def _run_turns(history: ChatHistory, num_turns: int, token_limit: int, cached: bool) -> float:
+    total = 0.0
+    for i in range(num_turns):
+        history.add_user_message(f'question {i}', message_id=uuid.uuid4())
+        if not cached:
+            history._token_sums.clear()
+            for message in history.messages:
+                message.token_counts.clear()
+        start = time.perf_counter()
+        history.to_openai_messages(system_message='You are an agent named Cacti.', system_prefix=None, token_limit=token_limit)
+        total += time.perf_counter() - start
+        history.add_bot_message(f'answer {i}', message_id=uuid.uuid4())
+    return total * 1000 / num_turns
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default='50,500,5000')
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--token-limit', type=int, default=12000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"{'messages':>8} {'uncached':>11} {'cached':>11}")
+    for num_messages in [int(n) for n in args.messages.split(',')]:
+        uncached_ms = _run_turns(_build_history(num_messages), args.turns, args.token_limit, cached=False)
+        history = _build_history(num_messages)
+        history.to_openai_messages(system_message='', system_prefix=None, token_limit=args.token_limit)  # warm up counts
+        cached_ms = _run_turns(history, args.turns, args.token_limit, cached=True)
+        print(f"{num_messages:>8} {uncached_ms:>9.2f}ms {cached_ms:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark for chat message sequence number allocation.
+
+Fills a scratch chat session with a number of messages, then times appending
+a message and inserting a message before the first one, using the previous
+scheme (query max(sequence_number), then renumber later rows one by one) and
+using database.sequence (counter on the chat session, gapped numbers). The
+scratch session is deleted afterwards.
+
+This writes to the chat db, so it only runs against a local db.
+
+Run with: ENV_TAG=local python3 -m scripts.bench_sequence_allocation --messages 1000
+"""
+
+import argparse
+import time
+import uuid
+
+from sqlalchemy import func, insert  # type: ignore
+
+import env
+from database.models import db_session, ChatMessage, ChatSession, SystemConfig
+from database.sequence import SEQUENCE_GAP, allocate_sequence_numbers, sequence_number_before
+from scripts.verify_local_db import verify_local_db
+
+
+def _create_session(num_messages: int, system_config_id: int, gap: int) -> ChatSession:
+    chat_session = ChatSession(id=uuid.uuid4(), name='bench_sequence_allocation', last_sequence_number=num_messages * gap)
+    db_session.add(chat_session)
+    db_session.flush()
+    db_session.execute(insert(ChatMessage), [dict(
+        actor='user' if i % 2 == 0 else 'bot',
+        type='text',
+        payload=f'message {i}',
+        sequence_number=(i + 1) * gap,
+        chat_session_id=chat_session.id,
+        system_config_id=system_config_id,
+    ) for i in range(num_messages)])
+    db_session.commit()
+    return chat_session
+
+
+def _first_message_id(chat_session: ChatSession) -> uuid.UUID:
+    return ChatMessage.query.filter(ChatMessage.chat_session_id == chat_session.id).order_by(ChatMessage.sequence_number).first().id
+
+
+def _add_message(chat_session: ChatSession, system_config_id: int, seq_num: int) -> None:
+    db_session.add(ChatMessage(actor='bot', type='text', payload='new', sequence_number=seq_num, chat_session_id=chat_session.id, system_config_id=system_config_id))
+    db_session.commit()
+
+
+def _old_append(chat_session: ChatSession, system_config_id: int) -> None:
+    seq_num = (db_session.query(func.max(ChatMessage.sequence_number)).filter(ChatMessage.chat_session_id == chat_session.id).scalar() or 0) + 1
+    _add_message(chat_session, system_config_id, seq_num)
+
+
+def _old_insert_before(chat_session: ChatSession, system_config_id: int, before_message_id: uuid.UUID) -> None:
+    before_seq_num = ChatMessage.query.get(before_message_id).sequence_number
+    seq_num = (db_session.query(func.max(ChatMessage.sequence_number)).filter(ChatMessage.chat_session_id == chat_session.id, ChatMessage.sequence_number < before_seq_num).scalar() or 0) + 1
+    if seq_num >= before_seq_num:
+        for message in ChatMessage.query.filter(ChatMessage.chat_session_id == chat_session.id, ChatMessage.sequence_number >= before_seq_num).all():
+            message.sequence_number += 1
+            db_session.add(message)
+    _add_message(chat_session, system_config_id, seq_num)
+
+
+def _new_append(chat_session: ChatSession, system_config_id: int) -> None:
+    _add_message(chat_session, system_config_id, allocate_sequence_numbers(db_session, chat_session.id))
+
+
+def _new_insert_before(chat_session: ChatSession, system_config_id: int, before_message_id: uuid.UUID) -> None:
+    _add_message(chat_session, system_config_id, sequence_number_before(db_session, chat_session.id, before_message_id))
+
+
+def _time(fn, repeat: int) -> float:
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - start) * 1000 / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    assert env.is_local(), 'this benchmark writes to the chat db, run it with ENV_TAG=local'
+    verify_local_db()
+
+    system_config_id = SystemConfig.query.first().id
+    results = {}
+    for name, gap, append, insert_before in [
+            ('max + renumber', 1, _old_append, _old_insert_before),
+            ('gapped', SEQUENCE_GAP, _new_append, _new_insert_before),
+    ]:
+        chat_session = _create_session(args.messages, system_config_id, gap)
+        try:
+            append_ms = _time(lambda: append(chat_session, system_config_id), args.repeat)
+            # always insert before the (original) first message, the worst case for renumbering
+            # and for running out of room between gapped numbers
+            before_message_id = _first_message_id(chat_session)
+            insert_before_ms = _time(lambda: insert_before(chat_session, system_config_id, before_message_id), args.repeat)
+        finally:
+            db_session.rollback()
+            db_session.delete(chat_session)
+            db_session.commit()
+        results[name] = (append_ms, insert_before_ms)
+
+    print(f"{args.messages} messages per session, mean over {args.repeat} runs")
+    print(f"{'scheme':>16} {'append':>10} {'insert before':>14}")
+    for name, (append_ms, insert_before_ms) in results.items():
+        print(f"{name:>16} {append_ms:>8.2f}ms {insert_before_ms:>12.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark for coalescing of streamed chat responses.
+
+Streams simulated answers token by token through the same path as the server
+(serialize each frame to json, hand it to a send function) with coalescing
+disabled and with a few time windows, and reports the number of frames per
+answer, frames/sec and cpu time per streamed answer.
+
+The websocket send is simulated with a fixed amount of cpu work per frame,
+to stand in for framing and syscall overhead.
+
+Run with: python3 -m scripts.bench_stream_coalescing --windows 0,10,25,50
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+
+import coalescing
+from chat.base import Response
+
+
+def _send_text(frame: str, frame_cost: int) -> None:
+    # stand-in for websocket.send_text, which costs cpu per frame regardless of size
+    for _ in range(frame_cost):
+        pass
+
+
+def _stream_answer(args: argparse.Namespace, window_ms: float, frames: list) -> None:
+    lock = threading.Lock()
+
+    def send_frame(resp, chat_message_id, before_message_id):
+        frame = json.dumps({
+            'messageId': str(chat_message_id),
+            'actor': resp.actor,
+            'type': 'text',
+            'payload': resp.response,
+            'stillThinking': resp.still_thinking,
+            'operation': resp.operation,
+            'feedback': 'none',
+            'beforeMessageId': before_message_id,
+        })
+        _send_text(frame, args.frame_cost)
+        with lock:
+            frames.append(frame)
+
+    if window_ms > 0:
+        coalescer = coalescing.ResponseCoalescer(send_frame, window_ms, args.max_bytes)
+        send, flush = coalescer.send, coalescer.flush
+    else:
+        send, flush = send_frame, lambda: None
+
+    message_id = uuid.uuid4()
+    send(Response(response='token0 ', operation='create'), message_id)
+    for i in range(1, args.num_tokens):
+        time.sleep(args.token_delay)
+        send(Response(response=f'token{i} ', operation='append'), message_id)
+    send(Response(response='full answer', operation='replace'), message_id)
+    flush()
+
+
+def _run(window_ms: float, args: argparse.Namespace) -> dict:
+    frames: list = []
+    threads = [threading.Thread(target=_stream_answer, args=(args, window_ms, frames)) for _ in range(args.sessions)]
+    start = time.time()
+    start_cpu = time.process_time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cpu = time.process_time() - start_cpu
+    duration = time.time() - start
+    return dict(
+        frames_per_answer=len(frames) / args.sessions,
+        frames_per_sec=len(frames) / duration,
+        cpu_ms_per_answer=cpu * 1000 / args.sessions,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--windows', default='0,10,25,50')
+    parser.add_argument('--sessions', type=int, default=32)
+    parser.add_argument('--num-tokens', type=int, default=300)
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    parser.add_argument('--max-bytes', type=int, default=1024)
+    parser.add_argument('--frame-cost', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'window':>8} {'frames/answer':>14} {'frames/sec':>11} {'cpu/answer':>11}")
+    for window_ms in [float(w) for w in args.windows.split(',')]:
+        ret = _run(window_ms, args)
+        name = f'{window_ms:g}ms' if window_ms > 0 else 'off'
+        print(f"{name:>8} {ret['frames_per_answer']:>14.1f} {ret['frames_per_sec']:>11.1f} {ret['cpu_ms_per_answer']:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
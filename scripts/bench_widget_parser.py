@@ -0,0 +1,112 @@
+"""
+Throughput benchmark for parsing widget commands out of streamed responses.
+
+Streams synthetic responses token by token through the previous injection
+handler loop, which re-scanned the whole response buffer on every token
+while a command was open, and through WidgetParser, and reports tokens per
+second. Commands are left as is instead of being evaluated, so that only the
+parsing is timed. The responses are:
+- many short widgets between text
+- one widget with a long (nested) parameter list
+- an unbalanced WIDGET_START early on, followed by a long text
+
+Run with: python3 -m scripts.bench_widget_parser --tokens 1000,10000
+"""
+
+import argparse
+import time
+from typing import Callable, Generator, List
+
+import tools.index_widget as index_widget
+from utils.widget_parser import WIDGET_START, WIDGET_END, WidgetParser
+
+
+def _short_widgets(num_tokens: int) -> List[str]:
+    tokens = []
+    while len(tokens) < num_tokens:
+        tokens += ['The', ' price', ' is', ' ', WIDGET_START, 'display', '-price', '(', 'eth', ',', 'usd', ')', WIDGET_END, '\n']
+    return tokens[:num_tokens]
+
+
+def _long_widget(num_tokens: int) -> List[str]:
+    params = [f'param{i},' for i in range(num_tokens - 8)]
+    return ['Here', ' you', ' go', ' ', WIDGET_START, 'display-list', '('] + params + [')' + WIDGET_END]
+
+
+def _unbalanced(num_tokens: int) -> List[str]:
+    return ['a', ' ', WIDGET_START, ' ', 'b'] + [' word'] * (num_tokens - 5)
+
+
+def _buffer_rescanning(tokens: List[str]) -> None:
+    new_token_handler = lambda token: None
+    response_buffer = ""
+
+    def injection_handler(token):
+        nonlocal response_buffer
+
+        response_buffer += token
+        while WIDGET_START in response_buffer:
+            if WIDGET_END in response_buffer:
+                response_buffer = index_widget.iterative_evaluate(response_buffer)
+                if isinstance(response_buffer, (Callable, Generator)):
+                    response_buffer = ""
+                    return
+                elif len(response_buffer.split(WIDGET_START)) == len(response_buffer.split(WIDGET_END)):
+                    response_buffer = response_buffer.replace(WIDGET_END, WIDGET_END + '\n')
+                    break
+                else:
+                    return
+            else:
+                return
+        if 0 < len(response_buffer) < len(WIDGET_START) and WIDGET_START.startswith(response_buffer):
+            return
+        token = response_buffer
+        response_buffer = ""
+        new_token_handler(token)
+
+    for token in tokens:
+        injection_handler(token)
+
+
+def _incremental(tokens: List[str]) -> None:
+    new_token_handler = lambda token: None
+    parser = WidgetParser()
+    for token in tokens:
+        for event in parser.feed(token):
+            index_widget.handle_widget_event(event, new_token_handler)
+
+
+def _tokens_per_second(fn, tokens: List[str], min_seconds: float = 0.2) -> float:
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn(tokens)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > min_seconds:
+            return runs * len(tokens) / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', default='1000,10000')
+    args = parser.parse_args()
+
+    # time the parsing, not the commands
+    index_widget.replace_match = lambda m: m.group(0)
+
+    print(f"{'response':>14} {'tokens':>7} {'rescanning':>14} {'incremental':>14}")
+    for name, make_tokens in [
+            ('short widgets', _short_widgets),
+            ('long widget', _long_widget),
+            ('unbalanced', _unbalanced),
+    ]:
+        for num_tokens in [int(n) for n in args.tokens.split(',')]:
+            tokens = make_tokens(num_tokens)
+            old = _tokens_per_second(_buffer_rescanning, tokens)
+            new = _tokens_per_second(_incremental, tokens)
+            print(f"{name:>14} {num_tokens:>7} {old:>10.0f} t/s {new:>10.0f} t/s")
+
+
+if __name__ == "__main__":
+    main()
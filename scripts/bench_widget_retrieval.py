@@ -0,0 +1,62 @@
+"""
+Benchmark for widget retrieval, Weaviate vs the in-process LocalWidgetIndex.
+
+For each user input in the eval file, retrieves the top k widgets from both
+indexes and reports the mean latency of each, split for the local index into
+query embedding (still a call to OpenAI) and scoring, plus the recall@k of
+the local index against the Weaviate results.
+
+Run with: python3 -m scripts.bench_widget_retrieval --k 32
+"""
+
+import argparse
+import csv
+import time
+
+import index
+from index.local_widgets import LocalWidgetIndex
+from utils import get_widget_index_name
+
+
+def _time_ms(fn):
+    start = time.perf_counter()
+    ret = fn()
+    return ret, (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', default='eval/example_test_file.csv')
+    parser.add_argument('--k', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [row['user_input'] for row in csv.DictReader(f)][:args.limit]
+
+    weaviate_index = index.weaviate.WeaviateIndex(index_name=get_widget_index_name(), text_key='content')
+    local_index, load_ms = _time_ms(lambda: LocalWidgetIndex())
+    print(f"loaded {len(local_index.documents)} widget embeddings in {load_ms:.1f}ms")
+
+    weaviate_total = embed_total = score_total = recall_total = 0.0
+    for query in queries:
+        weaviate_docs, weaviate_ms = _time_ms(lambda: weaviate_index.similarity_search(query, k=args.k))
+        embedding, embed_ms = _time_ms(lambda: local_index.embed_query(query))
+        local_docs, score_ms = _time_ms(lambda: local_index.similarity_search_by_vector(embedding, k=args.k))
+        expected = set(doc.page_content for doc in weaviate_docs)
+        found = set(doc.page_content for doc in local_docs)
+        recall_total += len(expected & found) / len(expected) if expected else 1.0
+        weaviate_total += weaviate_ms
+        embed_total += embed_ms
+        score_total += score_ms
+
+    n = len(queries)
+    print(f"{n} queries, k={args.k}")
+    print(f"{'weaviate':>16} {weaviate_total / n:>8.2f}ms")
+    print(f"{'local (embed)':>16} {embed_total / n:>8.2f}ms")
+    print(f"{'local (score)':>16} {score_total / n:>8.3f}ms")
+    print(f"{'recall@k':>16} {recall_total / n:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark for yield queries over a recorded DefiLlama pools payload.
+
+Times answering fetch_yields queries by filtering and sorting all pools
+(as done before), against a lookup in the pre-indexed YieldStore, and checks
+that both give the same pools. Queries are the most common symbols and
+chains in the payload, with wildcards.
+
+The default fixture is a sample of 2000 pools in the /pools schema. It is
+synthetic, as the API could not be reached when it was added. --record
+replaces it with the live /pools dataset, trimmed to the first --trim pools.
+
+Run with: python3 -m scripts.bench_yield_store [--fixture tests/fixtures/defillama/pools.json.gz] [--record --trim 2000]
+"""
+
+import argparse
+import collections
+import gzip
+import json
+import time
+
+import requests
+
+from integrations.defillama import DEFILLAMA_API_URL, YieldStore
+
+
+def _filter_yield_list(input_token, input_network, yield_obj) -> bool:
+    """The per-pool filter of fetch_yields, before the YieldStore."""
+    normalized_symbol = yield_obj["symbol"].lower()
+    normalized_network = yield_obj["chain"].lower()
+    input_token = input_token.lower()
+    input_network = input_network.lower()
+
+    # Only select single-sided yield pools
+    if yield_obj["exposure"] != "single" or yield_obj["apy"] == 0 or yield_obj["tvlUsd"] == 0:
+        return False
+
+    if input_token == "*" and input_network == "*":
+        return True
+
+    if input_network == "*":
+        return normalized_symbol == input_token
+
+    if input_token == "*":
+        return normalized_network == input_network
+
+    return normalized_symbol == input_token and normalized_network == input_network
+
+
+def _filter_and_sort(pools, token, network, count):
+    filtered_yields = list(filter(lambda yield_obj: _filter_yield_list(token, network, yield_obj), pools))
+    filtered_yields.sort(key=lambda yield_obj: yield_obj["tvlUsd"], reverse=True)
+    return filtered_yields[:count]
+
+
+def _time_ms(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(*query)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixture', default='tests/fixtures/defillama/pools.json.gz')
+    parser.add_argument('--record', action='store_true')
+    parser.add_argument('--trim', type=int, default=2000)
+    parser.add_argument('--count', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.record:
+        response = requests.get(f"{DEFILLAMA_API_URL}/pools")
+        response.raise_for_status()
+        obj = response.json()
+        obj["data"] = obj["data"][:args.trim]
+        with gzip.open(args.fixture, 'wb') as f:
+            f.write(json.dumps(obj).encode())
+
+    with gzip.open(args.fixture, 'rb') as f:
+        pools = json.load(f)["data"]
+
+    start = time.perf_counter()
+    store = YieldStore(pools)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    symbols = [symbol for symbol, _ in collections.Counter(pool["symbol"].lower() for pool in pools).most_common(20)]
+    chains = [chain for chain, _ in collections.Counter(pool["chain"].lower() for pool in pools).most_common(5)]
+    queries = [('*', '*', args.count)]
+    queries += [(symbol, '*', args.count) for symbol in symbols]
+    queries += [('*', chain, args.count) for chain in chains]
+    queries += [(symbol, chain, args.count) for symbol in symbols for chain in chains]
+
+    for query in queries:
+        assert store.query(*query) == _filter_and_sort(pools, *query), query
+
+    print(f"{len(pools)} pools, store built in {build_ms:.1f}ms, {len(queries)} queries")
+    print(f"{'filter + sort':>14} {_time_ms(lambda *query: _filter_and_sort(pools, *query), queries):>10.3f}ms")
+    print(f"{'yield store':>14} {_time_ms(store.query, queries):>10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ import re
 from chat.display_widgets import parse_widgets_into_text
 from index.widgets import backfill, get_client as weviate_get_client, TEXT_KEY
 from utils import get_widget_index_name
-from utils.common import WIDGETS
+from utils.common import get_widgets
 
 
 BATCH_SIZE = 20
@@ -54,7 +54,7 @@ def check_widgets_for_textual_translation(widgets, is_from_index):
 
 def main():
     widgets_from_index = read_widgets_from_index()
-    widgets_from_file = WIDGETS.split('---')
+    widgets_from_file = get_widgets().split('---')
 
     check_widgets_for_textual_translation(widgets_from_index, True)
     check_widgets_for_textual_translation(widgets_from_file, False)
@@ -0,0 +1,43 @@
+"""
+Download the market cap rank of the top CoinGecko coins to
+utils/coingecko/coin_ranks.json, used by the coin index to rank coins sharing
+a symbol or name (e.g. USDC, UNI).
+
+Run with: python3 -m scripts.update_coingecko_ranks [--pages 4]
+"""
+
+import argparse
+import json
+import time
+
+import requests
+
+from utils.coingecko.coin_index import COIN_RANKS_PATH
+
+
+COINGECKO_MARKETS_URL = "https://api.coingecko.com/api/v3/coins/markets"
+PER_PAGE = 250
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=4)
+    args = parser.parse_args()
+
+    ranks = {}
+    for page in range(1, args.pages + 1):
+        response = requests.get(COINGECKO_MARKETS_URL, params=dict(vs_currency='usd', order='market_cap_desc', per_page=PER_PAGE, page=page))
+        response.raise_for_status()
+        for coin in response.json():
+            if coin.get('market_cap_rank'):
+                ranks[coin['id']] = coin['market_cap_rank']
+        # stay under the rate limit of the public API
+        time.sleep(5)
+
+    with open(COIN_RANKS_PATH, 'w', encoding="utf8") as f:
+        json.dump(ranks, f, indent=0, sort_keys=True)
+    print(f"Saved the rank of {len(ranks)} coins to {COIN_RANKS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
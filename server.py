@@ -1,24 +1,33 @@
-from typing import Dict
+from dataclasses import dataclass, field
+from typing import Dict, List
+import asyncio
+import itertools
 import json
 import logging
 logging.basicConfig(level=logging.INFO)
 import uuid
 from urllib.parse import urlparse, parse_qs
 
-from sqlalchemy import func
+from sqlalchemy.orm import joinedload  # type: ignore
 
 import env
 import chat
+import coalescing
 import index
 import system
 import config
 from database import utils as db_utils
+from database.message_writer import ChatMessageWriter
 from database.models import (
     db_session, FeedbackStatus, PrivacyType,
     ChatSession, ChatMessage, ChatMessageFeedback,
     SystemConfig,
 )
-from utils import set_api_key
+from utils import set_api_key, STREAM_COALESCE_MS, STREAM_COALESCE_BYTES, ETH_MAINNET_CHAIN_ID
+from utils.common import invalidate_user_info
+from utils.crypto_token import invalidate_portfolio_balances
+from utils.cache import LRUCache
+from integrations import ens_resolver
 from ui_workflows.multistep_handler import process_multistep_workflow
 import context
 
@@ -78,35 +87,91 @@ def _generate_random_conversation():
         )
 
 
-def _load_existing_history_and_messages(session_id):
-    """Given an existing session_id, recreate the ChatHistory instance along with the individual Messages"""
-    history = chat.ChatHistory.new(session_id)
-    messages = []
+@dataclass
+class _SessionSnapshot:
+    """Messages of a chat session as loaded from the db, rehydrated into a chat history."""
+    history: chat.ChatHistory
+    # messages in the format sent to the client, and their index by message id
+    messages: List[Dict] = field(default_factory=list)
+    index_by_id: Dict[str, int] = field(default_factory=dict)
+    last_sequence_number: int = 0
+
+    def copy(self):
+        history = chat.ChatHistory(messages=list(self.history.messages), session_id=self.history.session_id, wallet_address=None)
+        return _SessionSnapshot(history, list(self.messages), dict(self.index_by_id), self.last_sequence_number)
+
+    def add_messages(self, message_iter):
+        for message in message_iter:
+            message_id = str(message.id)
+            if message.id is not None and message_id in self.index_by_id:
+                # already added, when messages got appended while the snapshot was loading
+                continue
+            self.index_by_id[message_id] = len(self.messages)
+            self.messages.append({
+                'messageId': message_id,
+                'actor': message.actor,
+                'type': message.type,
+                'payload': message.payload,
+                'feedback': str(message.chat_message_feedback.feedback_status.name) if message.chat_message_feedback else 'none',
+            })
+
+            # register user/bot messages to history
+            if message.type == 'text':
+                if message.actor == 'user':
+                    self.history.add_user_message(message.payload, message_id=message.id)
+                elif message.actor == 'bot':
+                    self.history.add_bot_message(message.payload, message_id=message.id)
+                elif message.actor == 'system':
+                    self.history.add_system_message(message.payload, message_id=message.id)
+                elif message.actor == 'commenter':
+                    self.history.add_commenter_message(message.payload, message_id=message.id)
+                elif message.actor == 'function':
+                    self.history.add_function_message(message.payload, message_id=message.id)
+                else:
+                    assert 0, f'unrecognized actor: {message.actor}'
+
+
+# Rehydrated chat sessions, so that resuming a session (on reconnects, tab
+# switches) doesn't reload all of its messages. Entries are topped up with
+# messages appended since they were loaded, and dropped when messages are
+# edited, deleted or regenerated. The ttl bounds how long changes made by other
+# worker processes can go unnoticed.
+_session_snapshot_cache = LRUCache('chat_session_snapshot', maxsize=1000, ttl=10 * 60)
+
+
+def _get_session_snapshot(session_id):
+    # the chat session was loaded when checking permissions, so this doesn't hit the db
+    last_sequence_number = ChatSession.query.get(session_id).last_sequence_number
+
+    snapshot = _session_snapshot_cache.get(session_id)
+    if snapshot is None:
+        query = ChatMessage.query.filter(ChatMessage.chat_session_id == session_id)
+        snapshot = _SessionSnapshot(chat.ChatHistory.new(session_id))
+    elif snapshot.last_sequence_number < last_sequence_number:
+        # only fetch the messages appended since the snapshot was taken
+        query = ChatMessage.query.filter(ChatMessage.chat_session_id == session_id, ChatMessage.sequence_number > snapshot.last_sequence_number)
+        snapshot = snapshot.copy()
+    else:
+        return snapshot
+
+    # load feedback in the same query
+    query = query.options(joinedload(ChatMessage.chat_message_feedback))
+    snapshot.add_messages(query.order_by(ChatMessage.sequence_number, ChatMessage.created).all())
+    snapshot.last_sequence_number = last_sequence_number
+    _session_snapshot_cache.set(session_id, snapshot)
+    return snapshot
+
 
+def _load_existing_history_and_messages(session_id):
+    """Given an existing session_id, recreate the ChatHistory instance along with the messages to send to the client"""
     if session_id == RANDOM_CONVERSATION_UUID and not env.is_prod():
-        message_iter = _generate_random_conversation()
+        snapshot = _SessionSnapshot(chat.ChatHistory.new(session_id))
+        snapshot.add_messages(_generate_random_conversation())
     else:
-        message_iter = ChatMessage.query.filter(ChatMessage.chat_session_id == session_id).order_by(ChatMessage.sequence_number, ChatMessage.created).all()
-
-    for message in message_iter:
-        messages.append(message)
-
-        # register user/bot messages to history
-        if message.type == 'text':
-            if message.actor == 'user':
-                history.add_user_message(message.payload, message_id=message.id)
-            elif message.actor == 'bot':
-                history.add_bot_message(message.payload, message_id=message.id)
-            elif message.actor == 'system':
-                history.add_system_message(message.payload, message_id=message.id)
-            elif message.actor == 'commenter':
-                history.add_commenter_message(message.payload, message_id=message.id)
-            elif message.actor == 'function':
-                history.add_function_message(message.payload, message_id=message.id)
-            else:
-                assert 0, f'unrecognized actor: {message.actor}'
+        snapshot = _get_session_snapshot(session_id)
 
-    return history, messages
+    # the history gets modified as the chat goes on, so it has to be a copy
+    return snapshot.copy().history, snapshot
 
 
 def _ensure_authenticated(client_state, send_response):
@@ -157,10 +222,14 @@ def _ensure_can_view_chat_session(session_id, client_state, send_response):
 
 def _ensure_can_edit_chat_session(session_id, client_state, send_response):
     """Returns true if we are allowed to view the chat session."""
+    chat_session = ChatSession.query.filter(ChatSession.id == session_id).one_or_none()
+    return _check_can_edit_chat_session(chat_session, client_state, send_response)
+
+
+def _check_can_edit_chat_session(chat_session, client_state, send_response):
+    """Returns true if we are allowed to edit the given (already loaded) chat session."""
     user_id = client_state.user_id
     assert user_id, 'expecting user id to be known here'
-
-    chat_session = ChatSession.query.filter(ChatSession.id == session_id).one_or_none()
     assert chat_session, 'expecting chat session to be known here'
 
     if str(chat_session.user_id) == str(user_id):
@@ -181,8 +250,47 @@ def _ensure_can_edit_chat_session(session_id, client_state, send_response):
     return False
 
 
+def _serialize_response(resp, chat_message_id, before_message_id):
+    """Serialize a chat response into the message format expected by the client."""
+    before_message_id = str(before_message_id) if before_message_id is not None else None
+    return json.dumps({
+        'messageId': str(chat_message_id),
+        'actor': resp.actor,
+        'type': 'text',
+        'payload': resp.response,
+        'stillThinking': resp.still_thinking,
+        'operation': resp.operation,
+        'feedback': 'none',
+        'beforeMessageId': before_message_id,
+    })
+
+
+def _get_response_sender(send_response):
+    """Return the function used to send chat responses to the client, and the function to flush it.
+
+    When stream coalescing is enabled, streamed appends are batched into fewer
+    frames, and need to be flushed once the message has been processed.
+
+    """
+    def send_frame(resp, chat_message_id, before_message_id):
+        send_response(_serialize_response(resp, chat_message_id, before_message_id))
+
+    if STREAM_COALESCE_MS <= 0:
+        return send_frame, lambda: None
+    coalescer = coalescing.ResponseCoalescer(send_frame, STREAM_COALESCE_MS, STREAM_COALESCE_BYTES)
+    return coalescer.send, coalescer.flush
+
+
 @db_utils.close_db_session()
 def message_received(client_state, send_response, message):
+    send_frame, flush_frames = _get_response_sender(send_response)
+    try:
+        _message_received(client_state, send_response, send_frame, message)
+    finally:
+        flush_frames()
+
+
+def _message_received(client_state, send_response, send_frame, message):
     obj = json.loads(message)
     assert isinstance(obj, dict), obj
     actor = obj['actor']
@@ -230,7 +338,7 @@ def message_received(client_state, send_response, message):
             return
 
         # load DB stored chat history and associated messages
-        history, messages = _load_existing_history_and_messages(session_id)
+        history, snapshot = _load_existing_history_and_messages(session_id)
         assert client_state.chat_history is None
         client_state.chat_history = history
 
@@ -238,30 +346,22 @@ def message_received(client_state, send_response, message):
         if resume_from_message_id is None:
             message_start_idx = 0
         else:
-            message_start_indexes = [i for i, message in enumerate(messages) if str(message.id) == resume_from_message_id]
-            #assert len(message_start_indexes) == 1, f'expected one message to match id {resume_from_message_id}, got {len(message_start_indexes)} for session {session_id}'
-            if len(message_start_indexes) != 1:
-                print(f'expected one message to match id {resume_from_message_id}, got {len(message_start_indexes)} for session {session_id}')
+            message_idx = snapshot.index_by_id.get(resume_from_message_id)
+            #assert message_idx is not None, f'expected one message to match id {resume_from_message_id} for session {session_id}'
+            if message_idx is None:
+                print(f'expected one message to match id {resume_from_message_id}, got 0 for session {session_id}')
                 message_start_idx = 0  # pick zero to cause every message to load in (more visible to help debug)
             else:
-                message_start_idx = message_start_indexes[0] + 1
+                message_start_idx = message_idx + 1
 
         # it's possible we are trying to restore connection after an intermediate section
         # of messages was deleted and getting regenerated halfway
         before_message_id = str(before_message_id) if before_message_id is not None else None
 
-        for i in range(message_start_idx, len(messages)):
-            message = messages[i]
-            if before_message_id is not None and str(message.id) == before_message_id:
+        for message in itertools.islice(snapshot.messages, message_start_idx, None):
+            if before_message_id is not None and message['messageId'] == before_message_id:
                 break
-            msg = json.dumps({
-                'messageId': str(message.id),
-                'actor': message.actor,
-                'type': message.type,
-                'payload': message.payload,
-                'feedback': str(message.chat_message_feedback.feedback_status.name) if message.chat_message_feedback else 'none',
-                'beforeMessageId': before_message_id,
-            })
+            msg = json.dumps(dict(message, beforeMessageId=before_message_id))
             send_response(msg)
         return
 
@@ -307,6 +407,8 @@ def message_received(client_state, send_response, message):
     if not _ensure_can_edit_chat_session(history.session_id, client_state, send_response):
         return
 
+    message_writer = ChatMessageWriter(chat_session.id, system_config_id)
+
     def send_message(resp, last_chat_message_id=None, before_message_id=None):
         """Send message function.
 
@@ -329,60 +431,14 @@ def message_received(client_state, send_response, message):
         Returns
         -------
         chat message id representing the row in the db that this message
-        is being stored in.
+        is being stored in. This is assigned up front, the row itself may
+        only be written once the message writer is flushed.
 
         """
         nonlocal send_response
 
-        # store response (if not streaming)
-        if resp.operation in ('create', 'create_then_replace'):
-            # figure out the current sequence number
-            if before_message_id:
-                before_seq_num = ChatMessage.query.get(before_message_id).sequence_number
-                seq_num = (db_session.query(func.max(ChatMessage.sequence_number)).filter(ChatMessage.chat_session_id == chat_session.id, ChatMessage.sequence_number < before_seq_num).scalar() or 0) + 1
-                if seq_num >= before_seq_num:
-                    # bump sequence number of everything else
-                    for message in ChatMessage.query.filter(ChatMessage.chat_session_id == chat_session.id, ChatMessage.sequence_number >= before_seq_num).all():
-                        message.sequence_number += 1
-                        db_session.add(message)
-            else:
-                seq_num = (db_session.query(func.max(ChatMessage.sequence_number)).filter(ChatMessage.chat_session_id == chat_session.id).scalar() or 0) + 1
-            chat_message = ChatMessage(
-                actor=resp.actor,
-                type='text',
-                payload=resp.response,
-                sequence_number=seq_num,
-                chat_session_id=chat_session.id,
-                system_config_id=system_config_id,
-            )
-            db_session.add(chat_message)
-            db_session.commit()
-            chat_message_id = chat_message.id
-        elif resp.operation == 'append':
-            # don't write to db
-            chat_message_id = last_chat_message_id
-        elif resp.operation == 'replace':
-            assert last_chat_message_id
-            chat_message = ChatMessage.query.get(last_chat_message_id)
-            chat_message.payload = resp.response
-            db_session.add(chat_message)
-            db_session.commit()
-            chat_message_id = last_chat_message_id
-        else:
-            assert 0, f'unrecognized operation: {resp.operation}'
-
-        before_message_id = str(before_message_id) if before_message_id is not None else None
-        msg = json.dumps({
-            'messageId': str(chat_message_id),
-            'actor': resp.actor,
-            'type': 'text',
-            'payload': resp.response,
-            'stillThinking': resp.still_thinking,
-            'operation': resp.operation,
-            'feedback': 'none',
-            'beforeMessageId': before_message_id,
-        })
-        send_response(msg)
+        chat_message_id = _queue_response(message_writer, resp, last_chat_message_id, before_message_id)
+        send_frame(resp, chat_message_id, before_message_id)
 
         return chat_message_id
 
@@ -390,6 +446,7 @@ def message_received(client_state, send_response, message):
     if typ == 'multistep-workflow':
         with context.with_request_context(history.wallet_address, None):
             process_multistep_workflow(payload, send_message)
+        _flush_messages(message_writer)
         return
 
     # check if it is an action
@@ -416,6 +473,12 @@ def message_received(client_state, send_response, message):
             tx_message = f"Transaction with hash {tx_hash} "
             if success:
                 tx_message += "succeeded."
+                if history.wallet_address:
+                    # the transaction may have changed the balances and the primary name of the wallet, on mainnet like the chat turns
+                    with context.with_request_context(history.wallet_address, None, wallet_chain_id=ETH_MAINNET_CHAIN_ID, fork_id=None):
+                        invalidate_portfolio_balances(context.get_web3_provider(), history.wallet_address)
+                        ens_resolver.invalidate(context.get_web3_provider(), address=history.wallet_address)
+                        invalidate_user_info()
             else:
                 tx_message += "failed"
                 if error:
@@ -444,11 +507,12 @@ def message_received(client_state, send_response, message):
                         continue
                     db_session.delete(ChatMessage.query.get(removed_id))  # use this delete approach to have cascade
                 db_session.commit()
-                system.chat.receive_input(
-                    history, payload, send_message,
-                    message_id=edit_message_id,
-                    before_message_id=before_message_id,
-                )
+                with index.embeddings.track_turn():
+                    system.chat.receive_input(
+                        history, payload, send_message,
+                        message_id=edit_message_id,
+                        before_message_id=before_message_id,
+                    )
         elif action_type == 'delete':
             delete_message_id = uuid.UUID(obj['payload']['messageId'])
             chat_message = ChatMessage.query.get(delete_message_id)
@@ -460,6 +524,9 @@ def message_received(client_state, send_response, message):
             assert 0, f'unrecognized action type: {action_type}'
 
         db_session.commit()
+        _flush_messages(message_writer)
+        # edits, deletions and feedback change existing messages
+        _session_snapshot_cache.invalidate(history.session_id)
         return
 
     # NB: here this could be regular user message or a system message replay
@@ -472,8 +539,8 @@ def message_received(client_state, send_response, message):
         actor=actor,
         # NB: the frontend already appends a placeholder message immediately
         # as part of an optimistic update for smooth UX purposes, but
-        # that one does not have the message_id since that is only obtained
-        # after a db write. Hence, we have a hybrid operation here, where we
+        # that one does not have the message_id since that is only assigned
+        # by the backend. Hence, we have a hybrid operation here, where we
         # do a 'create' behavior in the backend (create a message in the db),
         # but we do a 'replace' behavior in the frontend, to replace the
         # placeholder message with one that now contains the message_id. We
@@ -484,6 +551,144 @@ def message_received(client_state, send_response, message):
     ), last_chat_message_id=None)
 
     if actor == 'user':
-        system.chat.receive_input(history, payload, send_message, message_id=message_id)
+        with index.embeddings.track_turn():
+            system.chat.receive_input(history, payload, send_message, message_id=message_id)
 
     db_session.commit()
+    _flush_messages(message_writer)
+
+
+
+# message types that are not part of the chat turn hot path, these are
+# always handled by the thread-based message_received
+_THREADED_MESSAGE_TYPES = ('cfg', 'clear', 'init', 'action', 'multistep-workflow')
+
+
+async def amessage_received(client_state, send_response, message):
+    """Async variant of message_received.
+
+    Regular chat turns are processed on the event loop, using the async db
+    session and the chat module's areceive_input, so that we don't hold a
+    worker thread for the duration of the llm stream. Other message types
+    fall back to running message_received in a worker thread.
+
+    """
+    send_frame, flush_frames = _get_response_sender(send_response)
+    try:
+        await _amessage_received(client_state, send_response, send_frame, message)
+    finally:
+        flush_frames()
+
+
+async def _amessage_received(client_state, send_response, send_frame, message):
+    obj = json.loads(message)
+    assert isinstance(obj, dict), obj
+    actor = obj['actor']
+    typ = obj['type']
+    payload = obj['payload']
+
+    if typ in _THREADED_MESSAGE_TYPES:
+        await asyncio.to_thread(message_received, client_state, send_response, message)
+        return
+
+    # Only allow chatting if authenticated
+    if not _ensure_authenticated(client_state, send_response):
+        return
+
+    system_config_id = client_state.system_config_id or default_system_config_id
+    system = _system_config_id_to_system.get(system_config_id)
+    if not system:
+        system = await asyncio.to_thread(db_utils.close_db_session()(_get_system), system_config_id)
+
+    async with db_utils.async_db_session() as session:
+        history = client_state.chat_history
+
+        # first message received - first create a new session history instance
+        if history is None:
+            # generate uuid, commit to database immediately so user's chat list can fetch this
+            session_id = uuid.uuid4()
+            session.add(ChatSession(
+                id=session_id,
+                user_id=client_state.user_id,
+                name=payload,
+            ))
+            await session.commit()
+
+            # set up session history instance
+            history = chat.ChatHistory.new(session_id)
+            client_state.chat_history = history
+
+            # inform client of the newly created session id
+            msg = json.dumps({
+                'messageId': '',
+                'actor': 'system',
+                'type': 'uuid',
+                'payload': str(session_id),
+                'feedback': 'n/a',
+            })
+            send_response(msg)
+
+        assert actor in ('user', 'commenter') or (actor == 'system' and typ == 'replay-user-msg'), obj
+
+        # set wallet address onto chat history prior to processing input
+        history.wallet_address = client_state.wallet_address
+
+        chat_session = await session.get(ChatSession, history.session_id)
+        assert chat_session is not None, 'expected to already have session in db at this point'
+
+        if not _check_can_edit_chat_session(chat_session, client_state, send_response):
+            return
+
+        message_writer = ChatMessageWriter(chat_session.id, system_config_id)
+
+        async def send_message(resp, last_chat_message_id=None, before_message_id=None):
+            """Async send message function, see send_message in message_received."""
+            chat_message_id = _queue_response(message_writer, resp, last_chat_message_id, before_message_id)
+            send_frame(resp, chat_message_id, before_message_id)
+            return chat_message_id
+
+        # store new user/commenter message, see message_received for the operation used
+        still_thinking = True if actor == 'user' else False
+        message_id = await send_message(chat.Response(
+            response=payload,
+            still_thinking=still_thinking,
+            actor=actor,
+            operation='create_then_replace',
+        ), last_chat_message_id=None)
+
+        if actor == 'user':
+            with index.embeddings.track_turn():
+                await system.chat.areceive_input(history, payload, send_message, message_id=message_id, before_message_id=None)
+
+        await session.commit()
+        await asyncio.to_thread(_flush_messages, message_writer)
+
+
+def _flush_messages(message_writer):
+    """Flush the message writes of a turn, blocking until they are committed."""
+    message_writer.flush()
+    # cached snapshots are only topped up with appended messages, so drop them if
+    # any of their messages got changed
+    snapshot = _session_snapshot_cache.get(message_writer.chat_session_id)
+    if snapshot is not None and any(str(message_id) in snapshot.index_by_id for message_id in message_writer.rewritten_message_ids):
+        _session_snapshot_cache.invalidate(message_writer.chat_session_id)
+
+
+def _queue_response(message_writer, resp, last_chat_message_id, before_message_id):
+    """Queue a response to be stored, returning the chat message id.
+
+    The writes are flushed to the db in the background and at the end of the
+    turn, so the returned id may not be in the db yet.
+
+    """
+    if resp.operation in ('create', 'create_then_replace'):
+        return message_writer.create(resp.actor, resp.response, before_message_id=before_message_id)
+    elif resp.operation == 'append':
+        # don't write to db
+        return last_chat_message_id
+    elif resp.operation == 'replace':
+        assert last_chat_message_id
+        message_writer.replace(last_chat_message_id, resp.response)
+        return last_chat_message_id
+    else:
+        assert 0, f'unrecognized operation: {resp.operation}'
@@ -1,11 +1,11 @@
-from typing import Any, Callable
+from typing import Any, Awaitable, Callable
 
 from text_generation import Client
 from langchain.llms import OpenAI, HuggingFaceTextGenInference
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import LLMChain
 from langchain.agents import initialize_agent
-from langchain.callbacks.base import BaseCallbackManager
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackManager
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 
 import config
@@ -29,12 +29,31 @@ class StreamingCallbackHandler(StreamingStdOutCallbackHandler):
         self.new_token_handler(token)
 
 
-def get_streaming_llm(new_token_handler, model_name=None, max_tokens=None):
+class AsyncStreamingCallbackHandler(AsyncCallbackHandler):
+    """Async handler to get the token, for use with the async llm client."""
+
+    def __init__(self, new_token_handler: Callable[[str], Awaitable[None]]) -> None:
+        self.new_token_handler = new_token_handler
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        await self.new_token_handler(token)
+
+
+def get_streaming_llm(new_token_handler, model_name=None, max_tokens=None, use_async=False):
+    # when use_async is set, new_token_handler should be a coroutine function and
+    # the llm is expected to be invoked through its async methods (e.g. apredict_messages)
+    callback_handler_cls = AsyncStreamingCallbackHandler if use_async else StreamingCallbackHandler
+
     if model_name=='huggingface-llm':
         # falls back to non-streaming if none provided
         streaming_kwargs = dict(
             stream=True,
-            callbacks=[StreamingCallbackHandler(new_token_handler)],
+            callbacks=[callback_handler_cls(new_token_handler)],
         ) if new_token_handler else {}
 
         inference_server_url = HUGGINGFACE_INFERENCE_ENDPOINT
@@ -54,7 +73,7 @@ def get_streaming_llm(new_token_handler, model_name=None, max_tokens=None):
         # falls back to non-streaming if none provided
         streaming_kwargs = dict(
             streaming=True,
-            callbacks=[StreamingCallbackHandler(new_token_handler)],
+            callbacks=[callback_handler_cls(new_token_handler)],
         ) if new_token_handler else {}
 
         model_kwargs = dict(
@@ -0,0 +1,77 @@
+import http.server
+import json
+import socket
+import threading
+from urllib.parse import urlparse
+
+import pytest
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Passes each request to server.respond, and writes what it returns as JSON."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.num_connections += 1
+            self.server.connections.append(self.connection)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        status, obj, *headers = self.server.respond(self.server, self.command, urlparse(self.path), body)
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        for name, value in (headers[0] if headers else {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Starts local stand-ins for external APIs.
+
+    stub_server(respond, **attrs) serves requests on a new port with
+    respond(server, method, url, body) -> (status, obj[, headers]), where url
+    is the parsed path and body the parsed JSON body, if any. The attrs are
+    set on the server, along with lock, num_connections and url.
+    """
+    servers = []
+
+    def start(respond, **attrs):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        server.respond = respond
+        server.lock = threading.Lock()
+        server.num_connections = 0
+        server.connections = []
+        for name, value in attrs.items():
+            setattr(server, name, value)
+        server.url = f'http://127.0.0.1:{server.server_address[1]}'
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        # also end the keep-alive connections, which would otherwise still be
+        # served by this server if a later test gets the same port
+        with server.lock:
+            for connection in server.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
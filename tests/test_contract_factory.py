@@ -0,0 +1,62 @@
+import os
+
+from web3 import Web3
+
+from utils import get_contract, get_contract_abi
+
+# Invoke this with python3 -m pytest -s tests/test_contract_factory.py
+
+WORKFLOWS_DIR = os.path.join(os.path.dirname(__file__), '..', 'ui_workflows')
+AAVE_POOL_V3_ABI_PATH = os.path.join(WORKFLOWS_DIR, 'aave', 'abis', 'aave_pool_v3.abi.json')
+ENS_RESOLVER_ABI_PATH = os.path.join(WORKFLOWS_DIR, 'ens', 'abis', 'ens_resolver.abi.json')
+POOL_ADDRESS = Web3.to_checksum_address('0x87870bca3f3fd6335c3f4ce8392d69350b4fa4e2')
+RESOLVER_ADDRESS = Web3.to_checksum_address('0x231b0ee14048e9dccd1d247744d114a4eb5e8e63')
+USDC_ADDRESS = Web3.to_checksum_address('0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48')
+WALLET_ADDRESS = Web3.to_checksum_address('0xd8da6bf26964af9d7eed9e03e53415d37aa96045')
+
+
+def _web3():
+    return Web3(Web3.HTTPProvider('http://127.0.0.1:8545'))
+
+
+def test_contract_abi_parsed_once():
+    contract_abi = get_contract_abi(__file__, AAVE_POOL_V3_ABI_PATH)
+    assert get_contract_abi(__file__, AAVE_POOL_V3_ABI_PATH) is contract_abi
+    fn_abi, selector = contract_abi.functions['supply']
+    assert selector == '0x617ba037'  # supply(address,uint256,address,uint16)
+    assert contract_abi.selectors[selector] is fn_abi
+
+
+def test_contracts_cached_per_provider_and_address():
+    web3, other_web3 = _web3(), _web3()
+    contract_abi = get_contract_abi(__file__, AAVE_POOL_V3_ABI_PATH)
+    contract = get_contract(web3, POOL_ADDRESS, contract_abi)
+    assert get_contract(web3, POOL_ADDRESS, contract_abi) is contract
+    assert get_contract(other_web3, POOL_ADDRESS, contract_abi) is not contract
+    assert get_contract(web3, USDC_ADDRESS, contract_abi) is not contract
+
+
+def test_encode_abi_matches_web3():
+    web3 = _web3()
+    contract_abi = get_contract_abi(__file__, AAVE_POOL_V3_ABI_PATH)
+    contract = get_contract(web3, POOL_ADDRESS, contract_abi)
+    plain = web3.eth.contract(address=POOL_ADDRESS, abi=contract_abi.abi)
+    for fn_name, args in [
+            ('supply', [USDC_ADDRESS, 10 ** 9, WALLET_ADDRESS, 0]),
+            ('borrow', [USDC_ADDRESS, 10 ** 8, 2, 0, WALLET_ADDRESS]),
+            ('getReserveData', [USDC_ADDRESS]),
+    ]:
+        assert contract.encodeABI(fn_name=fn_name, args=args) == plain.encodeABI(fn_name=fn_name, args=args)
+    kwargs = dict(asset=USDC_ADDRESS, amount=1, to=WALLET_ADDRESS)
+    assert contract.encodeABI(fn_name='withdraw', kwargs=kwargs) == plain.encodeABI(fn_name='withdraw', kwargs=kwargs)
+
+
+def test_encode_abi_of_overloaded_function():
+    web3 = _web3()
+    contract_abi = get_contract_abi(__file__, ENS_RESOLVER_ABI_PATH)
+    assert 'setAddr' not in contract_abi.functions
+    contract = get_contract(web3, RESOLVER_ADDRESS, contract_abi)
+    plain = web3.eth.contract(address=RESOLVER_ADDRESS, abi=contract_abi.abi)
+    node = '0x' + '11' * 32
+    for args in [[node, WALLET_ADDRESS], [node, 60, bytes.fromhex(WALLET_ADDRESS[2:])]]:
+        assert contract.encodeABI(fn_name='setAddr', args=args) == plain.encodeABI(fn_name='setAddr', args=args)
@@ -0,0 +1,121 @@
+import pytest
+from eth_abi import decode, encode
+from web3 import Web3
+
+from integrations import cache, ens_resolver
+from utils import web3_provider
+
+# Invoke this with python3 -m pytest -s tests/test_ens_resolver.py
+
+RESOLVER_SELECTOR = Web3.keccak(text='resolver(bytes32)')[:4]
+ADDR_SELECTOR = Web3.keccak(text='addr(bytes32)')[:4]
+NAME_SELECTOR = Web3.keccak(text='name(bytes32)')[:4]
+RESOLVER_ADDRESS = Web3.to_checksum_address('0x231b0ee14048e9dccd1d247744d114a4eb5e8e63')
+VITALIK = Web3.to_checksum_address('0xd8da6bf26964af9d7eed9e03e53415d37aa96045')
+NICK = Web3.to_checksum_address('0xb8c2c29ee19d8307cb7255e1cd9cbde883a267d5')
+NO_NAME = Web3.to_checksum_address('0x' + '12' * 20)
+IMPOSTOR = Web3.to_checksum_address('0x' + '34' * 20)
+
+
+def _namehash(name):
+    node = b'\x00' * 32
+    if name:
+        for label in reversed(name.split('.')):
+            node = Web3.keccak(node + Web3.keccak(text=label))
+    return node
+
+
+def _reverse_node(address):
+    return _namehash(f'{address[2:].lower()}.addr.reverse')
+
+
+def _call(server, call):
+    to = Web3.to_checksum_address(call['to'])
+    data = Web3.to_bytes(hexstr=call['data'])
+    (node,) = decode(['bytes32'], data[4:])
+    if to == ens_resolver.ENS_REGISTRY_ADDRESS and data[:4] == RESOLVER_SELECTOR:
+        is_known = node in server.addresses or node in server.names
+        return encode(['address'], [RESOLVER_ADDRESS if is_known else '0x' + '00' * 20])
+    assert to == RESOLVER_ADDRESS
+    if data[:4] == ADDR_SELECTOR:
+        return encode(['address'], [server.addresses.get(node, '0x' + '00' * 20)])
+    if data[:4] == NAME_SELECTOR:
+        return encode(['string'], [server.names.get(node, '')])
+    raise ValueError('execution reverted')
+
+
+def _respond_one(server, request):
+    assert request['method'] == 'eth_call'
+    with server.lock:
+        server.num_calls += 1
+    return dict(jsonrpc='2.0', id=request['id'], result='0x' + _call(server, request['params'][0]).hex())
+
+
+def _respond(server, method, url, body):
+    """Stand-in for a node with the ENS registry and a resolver, answering batched requests."""
+    with server.lock:
+        server.num_requests += 1
+    if isinstance(body, list):
+        return 200, [_respond_one(server, request) for request in body]
+    return 200, _respond_one(server, body)
+
+
+@pytest.fixture
+def server(monkeypatch, stub_server):
+    server = stub_server(
+        _respond,
+        num_requests=0,
+        num_calls=0,
+        addresses={
+            _namehash('vitalik.eth'): VITALIK,
+            _namehash('nick.eth'): NICK,
+        },
+        names={
+            _reverse_node(VITALIK): 'vitalik.eth',
+            _reverse_node(NICK): 'nick.eth',
+            # claims a name that does not resolve back to it
+            _reverse_node(IMPOSTOR): 'vitalik.eth',
+        },
+    )
+    monkeypatch.setattr(ens_resolver, '_names_cache', cache.IntegrationCache('test_ens_names', ttl=60, negative_ttl=60))
+    monkeypatch.setattr(ens_resolver, '_addresses_cache', cache.IntegrationCache('test_ens_addresses', ttl=60, negative_ttl=60))
+    server.web3 = web3_provider.get_web3_from_rpc_url(server.url)
+    return server
+
+
+def test_namehash():
+    assert ens_resolver.get_node_namehash('') == '0x' + '00' * 32
+    assert ens_resolver.get_node_namehash('Vitalik.eth') == Web3.to_hex(_namehash('vitalik.eth'))
+
+
+def test_resolve_addresses(server):
+    addresses = ens_resolver.resolve_addresses(server.web3, ['vitalik.eth', 'nick.eth', 'unregistered.eth'])
+    assert addresses == [VITALIK, NICK, None]
+    # one batch for the resolvers, one for the addresses
+    assert server.num_requests == 2
+    assert ens_resolver.resolve_address(server.web3, 'VITALIK.eth') == VITALIK
+    assert ens_resolver.resolve_address(server.web3, 'unregistered.eth') is None
+    assert server.num_requests == 2
+
+
+def test_resolve_names(server):
+    names = ens_resolver.resolve_names(server.web3, [VITALIK, NICK.lower(), NO_NAME, IMPOSTOR])
+    assert names == ['vitalik.eth', 'nick.eth', None, None]
+    # the reverse records, then the names forward to check them, in two batches each
+    assert server.num_requests == 4
+    assert ens_resolver.resolve_name(server.web3, NO_NAME) is None
+    assert ens_resolver.resolve_address(server.web3, 'nick.eth') == NICK
+    assert server.num_requests == 4
+    with pytest.raises(ValueError):
+        ens_resolver.resolve_name(server.web3, 'not an address')
+
+
+def test_invalidate(server):
+    assert ens_resolver.resolve_name(server.web3, NO_NAME) is None
+    assert ens_resolver.resolve_address(server.web3, 'new.eth') is None
+    # e.g. after our workflows register a name and set it as primary name
+    server.addresses[_namehash('new.eth')] = NO_NAME
+    server.names[_reverse_node(NO_NAME)] = 'new.eth'
+    assert ens_resolver.resolve_name(server.web3, NO_NAME) is None
+    ens_resolver.invalidate(server.web3, name='new.eth', address=NO_NAME)
+    assert ens_resolver.resolve_name(server.web3, NO_NAME) == 'new.eth'
@@ -0,0 +1,137 @@
+import random
+from urllib.parse import parse_qs
+
+import pytest
+
+from integrations import cache, etherscan
+from utils.cache import LRUCache
+
+# Invoke this with python3 -m pytest -s tests/test_etherscan_activity.py
+
+ADDRESS = '0x' + 'ab' * 20
+TOKENS = ['0x' + 'c1' * 20, '0x' + 'c2' * 20]
+
+
+def _make_transactions(num, start_block=1, seed=0):
+    rng = random.Random(seed)
+    transactions = []
+    block = start_block
+    for i in range(num):
+        block += rng.choice([0, 0, 1, 2])  # several transactions in some blocks
+        other = '0x%040x' % rng.randrange(1, 2 ** 160)
+        is_out = rng.random() < 0.5
+        transactions.append({
+            'blockNumber': str(block),
+            'from': ADDRESS.upper().replace('0X', '0x') if is_out else other,
+            'to': other if is_out else (ADDRESS if rng.random() < 0.9 else ''),
+            # up to 10^30, past what int64 and float64 sum exactly
+            'value': str(rng.randrange(0, 10 ** rng.choice([1, 18, 22, 30]))),
+            'gas': str(rng.randrange(21000, 10 ** 7)),
+            'gasUsed': str(rng.randrange(21000, 10 ** 7)),
+            'contractAddress': rng.choice(TOKENS),
+            'tokenSymbol': 'TKN',
+            'tokenDecimal': '18',
+        })
+    return transactions
+
+
+def _respond(server, method, url, body):
+    """Stand-in for the Etherscan account API, serving server.transactions."""
+    query = {k: v[0] for k, v in parse_qs(url.query).items()}
+    with server.lock:
+        server.requests.append(query)
+    start_block = int(query['startblock'])
+    offset = int(query['offset'])
+    result = [
+        t for t in server.transactions
+        if int(t['blockNumber']) >= start_block and query.get('contractaddress', t['contractAddress']) == t['contractAddress']
+    ][:offset]
+    return 200, dict(status='1', message='OK', result=result)
+
+
+@pytest.fixture
+def server(monkeypatch, stub_server):
+    server = stub_server(_respond, requests=[], transactions=_make_transactions(250))
+    monkeypatch.setattr(etherscan, 'API_URL', f'{server.url}/api')
+    monkeypatch.setattr(etherscan, 'PAGE_SIZE', 40)
+    monkeypatch.setattr(etherscan, '_activity_cache', cache.IntegrationCache('test_etherscan_activity', ttl=60))
+    monkeypatch.setattr(etherscan, '_last_activity', LRUCache('test_etherscan_last_activity', maxsize=10))
+    return server
+
+
+def _expected_totals(transactions):
+    is_out = [t['from'].lower() == ADDRESS for t in transactions]
+    is_in = [t['to'].lower() == ADDRESS for t in transactions]
+    return dict(
+        num_transactions=len(transactions),
+        num_in=sum(is_in),
+        num_out=sum(is_out),
+        eth_in=sum(int(t['value']) for t, i in zip(transactions, is_in) if i),
+        eth_out=sum(int(t['value']) for t, o in zip(transactions, is_out) if o),
+        gas=sum(int(t['gas']) for t in transactions),
+        gas_used=sum(int(t['gasUsed']) for t in transactions),
+    )
+
+
+def test_address_activity(server):
+    activity = etherscan.get_address_activity(ADDRESS)
+    expected = _expected_totals(server.transactions)
+    for key, value in expected.items():
+        assert getattr(activity, key) == value, key
+    assert activity.last_block == int(server.transactions[-1]['blockNumber'])
+    # paged by block, without missing or repeating transactions at page boundaries
+    assert len(server.requests) > 1
+
+
+def test_in_out_and_gas_share_one_download(server):
+    etherscan.get_all_eth_to_address(ADDRESS)
+    num_requests = len(server.requests)
+    etherscan.get_all_eth_from_address(ADDRESS)
+    etherscan.get_all_gas_for_address(ADDRESS)
+    assert len(server.requests) == num_requests
+
+
+def test_incremental_refresh(server):
+    etherscan.get_address_activity(ADDRESS)
+    last_block = int(server.transactions[-1]['blockNumber'])
+    server.transactions += _make_transactions(30, start_block=last_block + 1, seed=1)
+    etherscan._activity_cache.invalidate(f'txlist:{ADDRESS}')
+    server.requests.clear()
+    activity = etherscan.get_address_activity(ADDRESS)
+    # only the transactions after the last block seen are fetched
+    assert [int(r['startblock']) for r in server.requests] == [last_block + 1]
+    assert activity.eth_in == _expected_totals(server.transactions)['eth_in']
+    assert activity.num_transactions == len(server.transactions)
+
+
+def test_token_activity(server):
+    activity = etherscan.get_token_activity(ADDRESS)
+    assert sorted(activity.tokens) == TOKENS
+    for token in TOKENS:
+        expected = _expected_totals([t for t in server.transactions if t['contractAddress'] == token])
+        totals = activity.tokens[token]
+        assert (totals.num_in, totals.num_out) == (expected['num_in'], expected['num_out'])
+        assert totals.value_in == expected['eth_in']
+        assert etherscan.get_total_token_transfer_history_from_address(token.upper().replace('0X', '0x'), ADDRESS) == expected['eth_out']
+
+
+def test_token_totals_query_one_contract(server):
+    token = TOKENS[0]
+    expected = _expected_totals([t for t in server.transactions if t['contractAddress'] == token])
+    assert etherscan.get_total_token_transfer_history_to_address(token, ADDRESS) == expected['eth_in']
+    assert etherscan.get_total_token_transfer_history_from_address(token, ADDRESS) == expected['eth_out']
+    assert {r['contractaddress'] for r in server.requests} == {token}
+
+
+def test_page_cap(server, monkeypatch):
+    monkeypatch.setattr(etherscan, 'MAX_PAGES', 2)
+    activity = etherscan.get_address_activity(ADDRESS)
+    assert activity.is_truncated
+    assert len(server.requests) == 2
+    assert 0 < activity.num_transactions < len(server.transactions)
+    # later refreshes carry on from the last block counted
+    while activity.is_truncated:
+        etherscan._activity_cache.invalidate(f'txlist:{ADDRESS}')
+        activity = etherscan.get_address_activity(ADDRESS)
+    assert activity.num_transactions == len(server.transactions)
+    assert activity.eth_in == _expected_totals(server.transactions)['eth_in']
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+
+import pytest
+from langchain.schema import AIMessage
+
+import context
+import streaming
+from chat import chatgpt_function_call
+from chat.base import ChatHistory
+
+# Invoke this with python3 -m pytest -s tests/test_function_call_chat.py
+
+WALLETS = ['0x' + '11' * 20, '0x' + '22' * 20]
+
+
+class _FakeLLM:
+    """LLM client answering every turn with the same message, recording the prompts."""
+
+    def __init__(self, prompts):
+        self.prompts = prompts
+
+    def predict_messages(self, messages, functions=None):
+        self.prompts.append(messages[0].content)
+        return AIMessage(content='hello')
+
+    async def apredict_messages(self, messages, functions=None):
+        return self.predict_messages(messages, functions=functions)
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(streaming, 'get_streaming_llm', lambda new_token_handler, **kwargs: _FakeLLM(prompts))
+    monkeypatch.setattr(chatgpt_function_call, 'get_user_info', lambda eval=False: f'User Wallet Address = {context.get_wallet_address()}')
+    return prompts
+
+
+@pytest.fixture
+def chat():
+    chat = chatgpt_function_call.ChatGPTFunctionCallChat(widget_index=None, model_name='gpt-4-0613')
+    # skip the history truncation and its tokenizer
+    chat.token_limit = None
+    return chat
+
+
+def _send(resp, last_chat_message_id=None, before_message_id=None):
+    return last_chat_message_id or uuid.uuid4()
+
+
+async def _async_send(resp, last_chat_message_id=None, before_message_id=None):
+    return _send(resp, last_chat_message_id, before_message_id)
+
+
+def test_user_info_per_turn(chat, prompts):
+    # the chat of a system config is shared by the users taking turns on it
+    for wallet_address in WALLETS + WALLETS:
+        chat.receive_input(ChatHistory.new(uuid.uuid4(), wallet_address), 'hi', _send)
+    assert [prompt.splitlines()[-1] for prompt in prompts] == [f'User Wallet Address = {wallet_address}' for wallet_address in WALLETS + WALLETS]
+    assert '{user_info}' in chatgpt_function_call.SYSTEM_MESSAGE_DEFAULT
+
+
+def test_user_info_per_async_turn(chat, prompts):
+    async def take_turns():
+        for wallet_address in WALLETS + WALLETS:
+            await chat.areceive_input(ChatHistory.new(uuid.uuid4(), wallet_address), 'hi', _async_send)
+
+    asyncio.run(take_turns())
+    assert [prompt.splitlines()[-1] for prompt in prompts] == [f'User Wallet Address = {wallet_address}' for wallet_address in WALLETS + WALLETS]
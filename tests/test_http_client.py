@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import utils.http_client as http_client
+
+# Invoke this with python3 -m pytest -s tests/test_http_client.py
+
+
+def _respond(server, method, url, body):
+    """Stand-in for an external API, failing with the statuses queued in server.statuses."""
+    with server.lock:
+        server.num_requests += 1
+        server.in_flight += 1
+        server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        status = server.statuses.pop(0) if server.statuses else 200
+    time.sleep(server.service_time)
+    with server.lock:
+        server.in_flight -= 1
+    headers = {'Retry-After': '0'} if status == 429 else {}
+    return status, dict(path=url.path), headers
+
+
+@pytest.fixture
+def server(monkeypatch, stub_server):
+    monkeypatch.setattr(http_client, 'BACKOFF_BASE', 0.001)
+    monkeypatch.setattr(http_client, 'HTTP_CIRCUIT_FAILURES', 3)
+    monkeypatch.setattr(http_client, 'HTTP_CIRCUIT_COOLDOWN', 0.2)
+    # a new port, and so a new upstream with its own circuit breaker, per test
+    return stub_server(_respond, num_requests=0, statuses=[], service_time=0, in_flight=0, max_in_flight=0)
+
+
+def test_keep_alive(server):
+    for i in range(5):
+        assert http_client.get(f'{server.url}/{i}').json() == dict(path=f'/{i}')
+    assert server.num_requests == 5
+    assert server.num_connections == 1
+
+
+def test_retries_idempotent_requests(server):
+    server.statuses = [503, 429, 502]
+    response = http_client.get(f'{server.url}/a')
+    assert response.status_code == 200
+    assert server.num_requests == 4
+
+
+def test_returns_last_response_when_retries_run_out(server):
+    server.statuses = [503] * 2
+    response = http_client.get(f'{server.url}/a', retries=1)
+    assert response.status_code == 503
+    assert server.num_requests == 2
+
+
+def test_does_not_retry_other_errors(server):
+    server.statuses = [404]
+    assert http_client.get(f'{server.url}/a').status_code == 404
+    assert server.num_requests == 1
+
+
+def test_does_not_retry_post_unless_idempotent(server):
+    server.statuses = [503]
+    assert http_client.post(f'{server.url}/a', json={}).status_code == 503
+    assert server.num_requests == 1
+    server.statuses = [503]
+    assert http_client.post(f'{server.url}/a', json={}, idempotent=True).status_code == 200
+    assert server.num_requests == 3
+
+
+def test_circuit_breaker(server):
+    server.statuses = [500] * 3
+    for _ in range(3):
+        assert http_client.get(f'{server.url}/a', retries=0).status_code == 500
+    # the upstream failed enough times in a row, requests to it fail fast
+    with pytest.raises(http_client.CircuitOpenError):
+        http_client.get(f'{server.url}/a')
+    assert server.num_requests == 3
+    # after the cooldown, a request probes the upstream, and closes the circuit on success
+    time.sleep(0.25)
+    assert http_client.get(f'{server.url}/a').status_code == 200
+    assert http_client.get(f'{server.url}/a').status_code == 200
+    assert server.num_requests == 5
+
+
+def test_circuit_breaker_counts_calls_not_attempts(server):
+    server.statuses = [500] * 2 + [503, 200] * 3
+    for _ in range(4):
+        assert http_client.get(f'{server.url}/a', retries=1).status_code in (200, 500)
+    assert http_client.get(f'{server.url}/a').status_code == 200
+
+
+def test_circuit_breaker_reopens_on_failed_probe(server):
+    server.statuses = [500] * 4
+    for _ in range(3):
+        http_client.get(f'{server.url}/a', retries=0)
+    time.sleep(0.25)
+    assert http_client.get(f'{server.url}/a', retries=0).status_code == 500
+    with pytest.raises(http_client.CircuitOpenError):
+        http_client.get(f'{server.url}/a')
+
+
+def test_bounds_requests_in_flight(server, monkeypatch):
+    monkeypatch.setattr(http_client, 'HTTP_MAX_CONCURRENCY_PER_UPSTREAM', 2)
+    server.service_time = 0.02
+    threads = [threading.Thread(target=http_client.get, args=(f'{server.url}/{i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.num_requests == 6
+    assert server.max_in_flight == 2
+
+
+def test_connection_errors(server):
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        http_client.get(f'{server.url}/a', retries=1)
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import pytest
+
+from integrations import cache
+
+# Invoke this with python3 -m pytest -s tests/test_integration_cache.py
+
+
+def _respond(server, method, url, body):
+    """Stand-in for an external API, returning the number of requests for a path so far."""
+    with server.lock:
+        server.num_requests[url.path] = server.num_requests.get(url.path, 0) + 1
+        count = server.num_requests[url.path]
+    time.sleep(server.delay)
+    if server.fail:
+        return 500, None
+    return 200, dict(path=url.path, count=count)
+
+
+@pytest.fixture
+def server(stub_server):
+    return stub_server(_respond, num_requests={}, delay=0, fail=False)
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_fresh(server):
+    c = cache.IntegrationCache('test_fresh', ttl=60)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    assert cache.get_json(c, f'{server.url}/b')['count'] == 1
+    assert server.num_requests == {'/a': 1, '/b': 1}
+
+
+def test_expired(server):
+    c = cache.IntegrationCache('test_expired', ttl=0.05)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    time.sleep(0.1)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 2
+
+
+def test_stale_while_revalidate(server):
+    c = cache.IntegrationCache('test_stale', ttl=0.05, stale_ttl=60)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    time.sleep(0.1)
+    # the stale value is returned right away, and refreshed in the background
+    server.delay = 0.2
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    _wait_for(lambda: cache.get_json(c, f'{server.url}/a')['count'] == 2)
+    assert server.num_requests['/a'] == 2
+
+
+def test_failed_refresh_keeps_stale_value(server):
+    c = cache.IntegrationCache('test_failed_refresh', ttl=0.05, stale_ttl=60)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    time.sleep(0.1)
+    server.fail = True
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    _wait_for(lambda: server.num_requests['/a'] == 2)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+
+
+def test_errors_are_not_cached(server):
+    c = cache.IntegrationCache('test_errors', ttl=60)
+    server.fail = True
+    with pytest.raises(Exception):
+        cache.get_json(c, f'{server.url}/a', retries=0)
+    server.fail = False
+    assert cache.get_json(c, f'{server.url}/a', retries=0)['count'] == 2
+
+
+def test_single_flight(server):
+    c = cache.IntegrationCache('test_single_flight', ttl=60)
+    server.delay = 0.2
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_json(c, f'{server.url}/a'))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [result['count'] for result in results] == [1] * 10
+    assert server.num_requests == {'/a': 1}
+
+
+def test_disk_tier(server, tmp_path):
+    c = cache.IntegrationCache('test_disk', ttl=60, tier_url=str(tmp_path))
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    # a new cache, e.g. in another worker or after a restart, reads from the disk tier
+    c = cache.IntegrationCache('test_disk', ttl=60, tier_url=str(tmp_path))
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    assert server.num_requests == {'/a': 1}
+
+
+def test_negative_ttl():
+    c = cache.IntegrationCache('test_negative_ttl', ttl=60, negative_ttl=0.05)
+    fetches = []
+
+    def fetch(value):
+        fetches.append(value)
+        return value
+
+    assert c.get('found', lambda: fetch('value')) == 'value'
+    assert c.get('not_found', lambda: fetch(None)) is None
+    assert c.get('not_found', lambda: fetch(None)) is None
+    assert fetches == ['value', None]
+    time.sleep(0.1)
+    assert c.get('found', lambda: fetch('value')) == 'value'
+    assert c.get('not_found', lambda: fetch('registered')) == 'registered'
+    assert fetches == ['value', None, 'registered']
+
+
+def test_negative_entries_not_served_stale():
+    c = cache.IntegrationCache('test_negative_stale', ttl=0.05, stale_ttl=60, negative_ttl=0.05)
+    assert c.get('found', lambda: 'value') == 'value'
+    assert c.get('not_found', lambda: None) is None
+    time.sleep(0.1)
+    # found entries are served stale while refreshed, missing ones are fetched again
+    assert c.get('found', lambda: 'new value') == 'value'
+    assert c.get('not_found', lambda: 'registered') == 'registered'
+
+
+def test_get_many():
+    c = cache.IntegrationCache('test_get_many', ttl=60)
+    batches = []
+
+    def fetch_many(keys):
+        batches.append(keys)
+        return [key.upper() for key in keys]
+
+    assert c.get_many(['a', 'b'], fetch_many) == ['A', 'B']
+    # only the missing keys are fetched, in one batch
+    assert c.get_many(['b', 'c', 'd', 'c'], fetch_many) == ['B', 'C', 'D', 'C']
+    assert c.get('d', lambda: 'unused') == 'D'
+    assert batches == [['a', 'b'], ['c', 'd']]
+
+
+def test_invalidate_disk_tier(server, tmp_path):
+    c = cache.IntegrationCache('test_invalidate_disk', ttl=60, tier_url=str(tmp_path))
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    c.invalidate(f'{server.url}/a')
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 2
+    # another worker sees the invalidation too
+    other = cache.IntegrationCache('test_invalidate_disk', ttl=60, tier_url=str(tmp_path))
+    assert cache.get_json(other, f'{server.url}/a')['count'] == 2
+
+
+def test_invalidate_during_refresh(server, tmp_path):
+    c = cache.IntegrationCache('test_invalidate_refresh', ttl=0.05, stale_ttl=60, tier_url=str(tmp_path))
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    time.sleep(0.1)
+    # a background refresh is in flight when the key is invalidated
+    server.delay = 0.2
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 1
+    _wait_for(lambda: server.num_requests['/a'] == 2)
+    c.invalidate(f'{server.url}/a')
+    server.delay = 0
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 3
+    # the refresh started before the invalidation does not overwrite the entry
+    _wait_for(lambda: not c._num_fetching)
+    assert cache.get_json(c, f'{server.url}/a')['count'] == 3
+    other = cache.IntegrationCache('test_invalidate_refresh', ttl=60, tier_url=str(tmp_path))
+    assert cache.get_json(other, f'{server.url}/a')['count'] == 3
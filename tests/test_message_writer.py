@@ -0,0 +1,121 @@
+import copy
+import uuid
+
+import pytest
+
+from database.message_writer import ChatMessageWriter
+
+# Invoke this with python3 -m pytest -s tests/test_message_writer.py
+
+
+SYSTEM_CONFIG_ID = 1
+
+
+class _Crash(Exception):
+    pass
+
+
+class _Store:
+    """In-memory stand-in for the chat_message table, applying each batch as a transaction."""
+
+    def __init__(self):
+        self.rows = {}  # message id -> dict(actor, payload, sequence_number)
+        self.fail_after = None  # crash after applying this many writes of the next batch
+        self.num_batches = 0
+
+    def apply_batch(self, chat_session_id, system_config_id, writes):
+        rows = copy.deepcopy(self.rows)
+        for i, write in enumerate(writes):
+            if self.fail_after is not None and i >= self.fail_after:
+                self.fail_after = None
+                raise _Crash()  # nothing from this batch is committed
+            if write.operation == 'update':
+                rows[write.message_id]['payload'] = write.payload
+                continue
+            if write.before_message_id:
+                seq_num = rows[write.before_message_id]['sequence_number']
+                for row in rows.values():
+                    if row['sequence_number'] >= seq_num:
+                        row['sequence_number'] += 1
+            else:
+                seq_num = max([row['sequence_number'] for row in rows.values()] or [0]) + 1
+            rows[write.message_id] = dict(actor=write.actor, payload=write.payload, sequence_number=seq_num)
+        self.rows = rows
+        self.num_batches += 1
+
+    def transcript(self):
+        return [(row['actor'], row['payload']) for row in sorted(self.rows.values(), key=lambda row: row['sequence_number'])]
+
+
+def _new_writer(store):
+    return ChatMessageWriter(uuid.uuid4(), SYSTEM_CONFIG_ID, apply_batch=store.apply_batch, flush_interval=None)
+
+
+def _stream_turn(writer, user_input, bot_response):
+    writer.create('user', user_input)
+    bot_message_id = writer.create('bot', bot_response[:1])
+    writer.replace(bot_message_id, bot_response)
+    writer.create('system', 'Timings - ')
+    return bot_message_id
+
+
+def test_end_of_turn_flush_is_durable():
+    store = _Store()
+    writer = _new_writer(store)
+    bot_message_id = _stream_turn(writer, 'hello', 'hi there')
+    assert store.rows == {}  # nothing written until flushed
+    writer.flush()
+
+    assert store.num_batches == 1
+    assert store.rows[bot_message_id]['payload'] == 'hi there'
+    assert store.transcript() == [('user', 'hello'), ('bot', 'hi there'), ('system', 'Timings - ')]
+    assert writer.num_pending == 0
+
+
+def test_crash_mid_turn_keeps_previous_turns():
+    store = _Store()
+    writer = _new_writer(store)
+    _stream_turn(writer, 'hello', 'hi there')
+    writer.flush()
+
+    # the process dies while the second turn is streaming, before its flush
+    writer.create('user', 'what is my balance?')
+    writer.create('bot', 'your')
+    del writer
+
+    # a fresh process resuming the session sees every turn that was flushed, and nothing partial
+    assert store.transcript() == [('user', 'hello'), ('bot', 'hi there'), ('system', 'Timings - ')]
+
+
+def test_failed_flush_is_atomic_and_retried():
+    store = _Store()
+    writer = _new_writer(store)
+    bot_message_id = _stream_turn(writer, 'hello', 'hi there')
+
+    store.fail_after = 1
+    with pytest.raises(_Crash):
+        writer.flush()
+    assert store.rows == {}
+    assert writer.num_pending == 4
+
+    # writes queued after the failure go after the ones being retried
+    writer.create('system', 'done')
+    writer.flush()
+    assert store.transcript() == [('user', 'hello'), ('bot', 'hi there'), ('system', 'Timings - '), ('system', 'done')]
+    assert store.rows[bot_message_id]['payload'] == 'hi there'
+
+
+def test_insert_before_message():
+    store = _Store()
+    writer = _new_writer(store)
+    writer.create('user', 'first')
+    writer.create('bot', 'answer')
+    second_message_id = writer.create('user', 'second')
+    writer.flush()
+
+    # regenerating the answer to the first message inserts before the second one
+    new_message_id = writer.create('bot', 'new', before_message_id=second_message_id)
+    writer.replace(new_message_id, 'new answer')
+    writer.flush()
+    assert store.transcript() == [('user', 'first'), ('bot', 'answer'), ('bot', 'new answer'), ('user', 'second')]
+
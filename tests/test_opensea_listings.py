@@ -0,0 +1,82 @@
+import json
+import os
+from urllib.parse import parse_qs
+
+import pytest
+
+from integrations import cache, opensea
+
+# Invoke this with python3 -m pytest -s tests/test_opensea_listings.py
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'opensea')
+ADDRESS = '0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D'
+
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+def _respond(server, method, url, body):
+    """Stand-in for the OpenSea API, replaying recorded responses."""
+    query = parse_qs(url.query)
+    if url.path.endswith('/nfts'):
+        route, obj = 'contract', _load_fixture('contract.json')
+    elif url.path.startswith('/listings/collection/boredapeyachtclub/all'):
+        route = 'listings'
+        obj = _load_fixture('listings_page_2.json' if 'next' in query else 'listings_page_1.json')
+        if not server.is_complete:
+            obj['next'] = 'cursor-3'
+    elif url.path == '/orders/ethereum/seaport/listings':
+        route, obj = 'orders', _load_fixture('orders.json')
+    else:
+        return 404, None
+    with server.lock:
+        server.num_requests[route] = server.num_requests.get(route, 0) + 1
+    return 200, obj
+
+
+@pytest.fixture
+def server(monkeypatch, stub_server):
+    server = stub_server(_respond, num_requests={}, is_complete=True)
+    monkeypatch.setattr(opensea, 'API_V2_URL', server.url)
+    monkeypatch.setattr(opensea, '_contract_slugs_cache', cache.IntegrationCache('test_opensea_contract_slugs', ttl=60))
+    monkeypatch.setattr(opensea, '_listing_prices_cache', cache.IntegrationCache('test_opensea_listing_prices', ttl=60))
+    return server
+
+
+def test_listing_prices(server):
+    listing_prices = opensea.get_listing_prices(ADDRESS)
+    assert listing_prices['is_complete']
+    prices = listing_prices['prices']
+    # cheapest listing of each token, across pages, and only for this contract
+    assert sorted(prices) == ['1', '11', '12', '2', '7']
+    assert prices['1'] == dict(price_str='29 eth', price_value=29 * 10 ** 18)
+    assert prices['2']['price_str'] == '31.5 eth'
+    assert prices['12']['price_str'] == '60000.0 usdc'
+    assert server.num_requests == dict(contract=1, listings=2)
+
+
+def test_asset_lookups_use_cached_listings(server):
+    # the grid of the collection fetches its listings in bulk
+    assert opensea.fetch_contract_listing_prices_with_retries(ADDRESS)['7']['price_str'] == '45 eth'
+    token_ids = [str(i + 1) for i in range(12)]
+    prices = [opensea.fetch_asset_listing_prices_with_retries(ADDRESS, token_id) for token_id in token_ids]
+    assert [token_id for token_id, price in zip(token_ids, prices) if price] == ['1', '2', '7', '11', '12']
+    assert server.num_requests == dict(contract=1, listings=2)
+
+
+def test_asset_lookup_without_cached_listings(server):
+    # a single asset view doesn't page through the listings of the collection
+    assert opensea.fetch_asset_listing_prices_with_retries(ADDRESS, '3')['price_str'] == '33 ETH'
+    assert server.num_requests == dict(orders=1)
+
+
+def test_asset_lookup_falls_back_when_listings_are_incomplete(server):
+    server.is_complete = False
+    assert not opensea.get_listing_prices(ADDRESS)['is_complete']
+    assert opensea.fetch_asset_listing_prices_with_retries(ADDRESS, '1')['price_str'] == '29 eth'
+    assert 'orders' not in server.num_requests
+    # a token not in the listings fetched in bulk might still be listed
+    assert opensea.fetch_asset_listing_prices_with_retries(ADDRESS, '3')['price_str'] == '33 ETH'
+    assert server.num_requests['orders'] == 1
@@ -0,0 +1,64 @@
+import contextvars
+import threading
+import time
+
+from integrations import paginator
+
+# Invoke this with python3 -m pytest -s tests/test_paginator.py
+
+
+def test_map_concurrently_keeps_order():
+    def slow_square(x):
+        time.sleep(0.01 * (5 - x))
+        return x * x
+
+    start = time.time()
+    assert list(paginator.map_concurrently(slow_square, range(5))) == [0, 1, 4, 9, 16]
+    # evaluated concurrently, so takes about as long as the slowest item
+    assert time.time() - start < 0.1
+
+
+def test_fetch_pages_fetches_ahead():
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch_page(page):
+        with lock:
+            fetched.append(page)
+        return page
+
+    pages = paginator.fetch_pages(fetch_page, prefetch=1)
+    assert next(pages) == 0
+    time.sleep(0.05)
+    # the next page is fetched while the first is consumed, but no further
+    assert sorted(fetched) == [0, 1]
+    pages.close()
+
+
+def test_fetch_pages_stops_with_consumer():
+    fetched = []
+    gate = threading.Event()
+
+    def fetch_page(page):
+        if page > 0:
+            gate.wait()
+        fetched.append(page)
+        return page
+
+    for page in paginator.fetch_pages(fetch_page, max_pages=10, prefetch=3):
+        break
+    gate.set()
+    time.sleep(0.05)
+    # pages queued but not started when the consumer stopped are not fetched
+    assert len(fetched) <= 1 + paginator.PAGINATOR_CONCURRENCY
+    assert 9 not in fetched
+
+
+def test_fetch_pages_max_pages():
+    assert list(paginator.fetch_pages(lambda page: page, max_pages=3)) == [0, 1, 2]
+
+
+def test_submit_copies_context_variables():
+    var = contextvars.ContextVar('test_paginator_var', default=None)
+    var.set('turn')
+    assert paginator.submit(var.get).result() == 'turn'
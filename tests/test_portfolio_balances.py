@@ -0,0 +1,116 @@
+import time
+
+import pytest
+from eth_abi import decode, encode
+from web3 import Web3
+
+from utils import crypto_token, web3_provider
+from utils.cache import LRUCache
+
+# Invoke this with python3 -m pytest -s tests/test_portfolio_balances.py
+
+WALLET_ADDRESS = Web3.to_checksum_address('0xd8da6bf26964af9d7eed9e03e53415d37aa96045')
+AGGREGATE3_SELECTOR = Web3.keccak(text='aggregate3((address,bool,bytes)[])')[:4]
+GET_ETH_BALANCE_SELECTOR = Web3.keccak(text='getEthBalance(address)')[:4]
+BALANCE_OF_SELECTOR = Web3.keccak(text='balanceOf(address)')[:4]
+BALANCES = {
+    crypto_token.MULTICALL3_ADDRESS: 2 * 10 ** 18,
+    Web3.to_checksum_address(crypto_token.MAINNET_TOKEN_TO_PROFILE_MAP['USDC']['address']): 1500 * 10 ** 6,
+    Web3.to_checksum_address(crypto_token.MAINNET_TOKEN_TO_PROFILE_MAP['DAI']['address']): 25 * 10 ** 17,
+}
+# a token whose balanceOf reverts
+REVERTING_TOKEN = Web3.to_checksum_address(crypto_token.MAINNET_TOKEN_TO_PROFILE_MAP['WBTC']['address'])
+
+
+def _aggregate3(data):
+    (calls,) = decode(['(address,bool,bytes)[]'], data[4:])
+    results = []
+    for target, allow_failure, call_data in calls:
+        target = Web3.to_checksum_address(target)
+        assert call_data[4:] == encode(['address'], [WALLET_ADDRESS])
+        if target == crypto_token.MULTICALL3_ADDRESS:
+            assert call_data[:4] == GET_ETH_BALANCE_SELECTOR
+        else:
+            assert call_data[:4] == BALANCE_OF_SELECTOR
+        if target == REVERTING_TOKEN:
+            assert allow_failure
+            results.append((False, b''))
+        else:
+            results.append((True, encode(['uint256'], [BALANCES.get(target, 0)])))
+    return '0x' + encode(['(bool,bytes)[]'], [results]).hex()
+
+
+def _respond(server, method, url, request):
+    """Stand-in for a mainnet node with Multicall3 and a few token contracts."""
+    with server.lock:
+        server.requests.append(request)
+    if request['method'] == 'eth_chainId':
+        result = '0x1'
+    elif request['method'] == 'eth_call':
+        call, block = request['params']
+        assert Web3.to_checksum_address(call['to']) == crypto_token.MULTICALL3_ADDRESS
+        assert block == 'latest'
+        data = Web3.to_bytes(hexstr=call['data'])
+        assert data[:4] == AGGREGATE3_SELECTOR
+        result = _aggregate3(data)
+    else:
+        result = None
+    return 200, dict(jsonrpc='2.0', id=request['id'], result=result)
+
+
+@pytest.fixture
+def server(stub_server):
+    server = stub_server(_respond, requests=[])
+    server.web3 = web3_provider.get_web3_from_rpc_url(server.url)
+    return server
+
+
+def _eth_calls(server):
+    return [request for request in server.requests if request['method'] == 'eth_call']
+
+
+def test_portfolio_balances_in_one_call(server):
+    balances = crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)
+    assert list(balances) == list(crypto_token.MAINNET_TOKEN_TO_PROFILE_MAP)
+    assert balances['ETH'] == 2 * 10 ** 18
+    assert balances['USDC'] == 1500 * 10 ** 6
+    assert balances['LINK'] == 0
+    assert balances['WBTC'] is None
+    assert len(_eth_calls(server)) == 1
+    assert crypto_token.format_portfolio_balances(1, balances) == {
+        'ETH': '2.0', 'WETH': '0.0', 'USDC': '1500.0', 'DAI': '2.5', 'USDT': '0.0',
+        'LINK': '0.0', 'AAVE': '0.0', 'LUSD': '0.0', 'CRV': '0.0',
+    }
+
+
+def test_portfolio_balances_of_tokens(server):
+    balances = crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS.lower(), tokens=['DAI', 'ETH'])
+    assert balances == {'DAI': 25 * 10 ** 17, 'ETH': 2 * 10 ** 18}
+
+
+def test_portfolio_balances_cached_briefly(server, monkeypatch):
+    monkeypatch.setattr(crypto_token, '_portfolio_balances_cache', LRUCache('test_portfolio_balances', maxsize=10, ttl=0.1))
+    crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)
+    balances = crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)
+    balances['ETH'] = 0  # callers get their own copy
+    assert crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)['ETH'] == 2 * 10 ** 18
+    assert len(_eth_calls(server)) == 1
+    server.requests.clear()
+    time.sleep(0.2)
+    crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)
+    # one round trip, without asking for the block number or the chain id again
+    assert [request['method'] for request in server.requests] == ['eth_call']
+
+
+def test_invalidate_portfolio_balances(server, monkeypatch):
+    monkeypatch.setattr(crypto_token, '_portfolio_balances_cache', LRUCache('test_portfolio_balances', maxsize=10, ttl=60))
+    assert crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)['ETH'] == 2 * 10 ** 18
+    # the balances of other tokens are served from the same call
+    assert crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS, tokens=['USDC']) == {'USDC': 1500 * 10 ** 6}
+    assert len(_eth_calls(server)) == 1
+    # a transaction spends some ETH
+    monkeypatch.setitem(BALANCES, crypto_token.MULTICALL3_ADDRESS, 10 ** 18)
+    assert crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)['ETH'] == 2 * 10 ** 18
+    crypto_token.invalidate_portfolio_balances(server.web3, WALLET_ADDRESS.lower())
+    assert crypto_token.get_portfolio_balances(server.web3, 1, WALLET_ADDRESS)['ETH'] == 10 ** 18
+    assert len(_eth_calls(server)) == 2
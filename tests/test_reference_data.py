@@ -0,0 +1,46 @@
+import json
+import os
+
+from utils import reference_data
+from utils.reference_data import ReferenceData
+
+# Invoke this with python3 -m pytest -s tests/test_reference_data.py
+
+
+def _write_source(tmp_path):
+    path = str(tmp_path / 'source.json')
+    with open(path, 'w') as f:
+        json.dump({'a': [1, 2]}, f)
+    return path
+
+
+def _counting_load(calls):
+    def load(path):
+        calls.append(path)
+        with open(path) as f:
+            return json.load(f)
+    return load
+
+
+def test_cache_in_private_dir(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(reference_data, 'REFERENCE_DATA_CACHE_DIR', cache_dir)
+    path = _write_source(tmp_path)
+    calls = []
+    assert ReferenceData('test', [path], _counting_load(calls)).get() == {'a': [1, 2]}
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+    assert ReferenceData('test', [path], _counting_load(calls)).get() == {'a': [1, 2]}
+    assert len(calls) == 1
+
+
+def test_no_cache_in_shared_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    cache_dir.chmod(0o777)
+    monkeypatch.setattr(reference_data, 'REFERENCE_DATA_CACHE_DIR', str(cache_dir))
+    path = _write_source(tmp_path)
+    calls = []
+    ReferenceData('test', [path], _counting_load(calls)).get()
+    ReferenceData('test', [path], _counting_load(calls)).get()
+    assert len(calls) == 2
+    assert os.listdir(cache_dir) == []
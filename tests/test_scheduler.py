@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+from scheduler import ChatTurnScheduler, SchedulerQueueFull
+
+# Invoke this with python3 -m pytest -s tests/test_scheduler.py
+
+
+class _Turns:
+    """Chat turns that record the order they run in, and block until released."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.started = []
+        self.positions = {}
+        self._events = {}
+
+    def start(self, user_key, name):
+        self._events[name] = asyncio.Event()
+
+        async def turn():
+            self.started.append(name)
+            await self._events[name].wait()
+            return name
+
+        def on_queued(position):
+            self.positions[name] = position
+
+        return asyncio.create_task(self.scheduler.run(user_key, turn, on_queued=on_queued))
+
+    def finish(self, name):
+        self._events[name].set()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_round_robin_across_users():
+    async def run():
+        scheduler = ChatTurnScheduler(max_concurrent_turns=1, max_queued_turns=10)
+        turns = _Turns(scheduler)
+        tasks = [turns.start('blocker', 'blocker')]
+        await _settle()
+        for user_key, name in [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('b', 'b2'), ('c', 'c1')]:
+            tasks.append(turns.start(user_key, name))
+            await _settle()
+        assert scheduler.num_active == 1
+        assert scheduler.num_queued == 6
+        for name in ['blocker', 'a1', 'b1', 'c1', 'a2', 'b2', 'a3']:
+            turns.finish(name)
+            await _settle()
+        assert await asyncio.gather(*tasks) == ['blocker', 'a1', 'a2', 'a3', 'b1', 'b2', 'c1']
+        return turns.started, scheduler
+
+    started, scheduler = asyncio.run(run())
+    assert started == ['blocker', 'a1', 'b1', 'c1', 'a2', 'b2', 'a3']
+    assert scheduler.num_active == 0
+    assert scheduler.num_queued == 0
+
+
+def test_positions():
+    async def run():
+        scheduler = ChatTurnScheduler(max_concurrent_turns=1, max_queued_turns=10)
+        turns = _Turns(scheduler)
+        tasks = [turns.start('blocker', 'blocker')]
+        await _settle()
+        for user_key, name in [('a', 'a1'), ('a', 'a2'), ('b', 'b1'), ('a', 'a3'), ('c', 'c1')]:
+            tasks.append(turns.start(user_key, name))
+            await _settle()
+        # the position in the round-robin order, when queued
+        assert turns.positions == dict(a1=1, a2=2, b1=2, a3=4, c1=3)
+        assert 'blocker' not in turns.positions
+        # and once everyone is queued, a1 b1 c1 a2 a3
+        waiters = {name: fut for name, fut in zip(['a1', 'a2', 'a3'], scheduler._waiters['a'])}
+        assert scheduler._position('a', waiters['a1']) == 1
+        assert scheduler._position('b', scheduler._waiters['b'][0]) == 2
+        assert scheduler._position('c', scheduler._waiters['c'][0]) == 3
+        assert scheduler._position('a', waiters['a2']) == 4
+        assert scheduler._position('a', waiters['a3']) == 5
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_queue_full():
+    async def run():
+        scheduler = ChatTurnScheduler(max_concurrent_turns=1, max_queued_turns=2)
+        turns = _Turns(scheduler)
+        tasks = [turns.start('a', 'a1'), turns.start('b', 'b1'), turns.start('c', 'c1')]
+        await _settle()
+        assert scheduler.num_queued == 2
+        with pytest.raises(SchedulerQueueFull):
+            await turns.start('d', 'd1')
+        assert scheduler.num_queued == 2
+        assert 'd1' not in turns.positions
+        for name in ['a1', 'b1', 'c1']:
+            turns.finish(name)
+        await asyncio.gather(*tasks)
+        assert turns.started == ['a1', 'b1', 'c1']
+
+    asyncio.run(run())
+
+
+def test_cancel_waiting_turn():
+    async def run():
+        scheduler = ChatTurnScheduler(max_concurrent_turns=1, max_queued_turns=10)
+        turns = _Turns(scheduler)
+        blocker = turns.start('blocker', 'blocker')
+        waiting = turns.start('a', 'a1')
+        next_turn = turns.start('b', 'b1')
+        await _settle()
+        assert scheduler.num_queued == 2
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert scheduler.num_queued == 1
+        assert scheduler.num_active == 1
+        turns.finish('blocker')
+        turns.finish('b1')
+        await asyncio.gather(blocker, next_turn)
+        assert turns.started == ['blocker', 'b1']
+        assert (scheduler.num_active, scheduler.num_queued) == (0, 0)
+
+    asyncio.run(run())
+
+
+def test_cancel_admitted_turn_passes_its_slot():
+    async def run():
+        scheduler = ChatTurnScheduler(max_concurrent_turns=1, max_queued_turns=10)
+        turns = _Turns(scheduler)
+        blocker = turns.start('blocker', 'blocker')
+        admitted = turns.start('a', 'a1')
+        next_turn = turns.start('b', 'b1')
+        await _settle()
+        release = scheduler._release
+
+        def release_and_cancel():
+            # a1 is admitted by this release, and cancelled before it resumes
+            release()
+            scheduler._release = release
+            admitted.cancel()
+
+        scheduler._release = release_and_cancel
+        turns.finish('blocker')
+        await blocker
+        with pytest.raises(asyncio.CancelledError):
+            await admitted
+        await _settle()
+        assert turns.started == ['blocker', 'b1']
+        assert (scheduler.num_active, scheduler.num_queued) == (1, 0)
+        turns.finish('b1')
+        await next_turn
+        assert scheduler.num_active == 0
+
+    asyncio.run(run())
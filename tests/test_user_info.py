@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+import context
+from integrations import cache
+from utils import common
+
+# Invoke this with python3 -m pytest -s tests/test_user_info.py
+
+WALLET_ADDRESS = '0xd8dA6BF26964aF9D7eEd9e03E53415D37aA96045'
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    fetches = []
+    lock = threading.Lock()
+
+    def fetch_user_info(web3, wallet_address, chain_id):
+        with lock:
+            fetches.append(wallet_address)
+            return {"Wallet Address": wallet_address, "ENS Domain": f"name{len(fetches)}.eth", "Network": "ethereum-mainnet"}
+
+    monkeypatch.setattr(common, '_fetch_user_info', fetch_user_info)
+    monkeypatch.setattr(common, '_user_info_cache', cache.IntegrationCache('test_user_info', ttl=60))
+    return fetches
+
+
+def _get_user_info():
+    with context.with_request_context(WALLET_ADDRESS, None):
+        return common.get_user_info()
+
+
+def test_user_info_cached_per_wallet(fetches):
+    assert _get_user_info() == f"User Wallet Address = {WALLET_ADDRESS}\nUser ENS Domain = name1.eth\nUser Network = ethereum-mainnet"
+    assert _get_user_info().endswith("name1.eth\nUser Network = ethereum-mainnet")
+    assert len(fetches) == 1
+    with context.with_request_context(None, None):
+        assert common.get_user_info() == "User Wallet Address = None\nUser ENS Domain = None\nUser Network = None"
+    assert len(fetches) == 1
+
+
+def test_stale_user_info_refreshed_in_background(fetches, monkeypatch):
+    monkeypatch.setattr(common, '_user_info_cache', cache.IntegrationCache('test_user_info_stale', ttl=0, stale_ttl=60))
+    assert "name1.eth" in _get_user_info()
+    # the stale entry is served right away, while it is refreshed
+    assert "name1.eth" in _get_user_info()
+    for _ in range(100):
+        if len(fetches) == 2:
+            break
+        time.sleep(0.01)
+    assert "name2.eth" in _get_user_info()
+
+
+def test_prefetch_user_info(fetches):
+    common.prefetch_user_info(WALLET_ADDRESS, 1, None)
+    assert fetches == [WALLET_ADDRESS]
+    assert "name1.eth" in _get_user_info()
+    assert len(fetches) == 1
+
+
+def test_prefetch_user_info_of_fork(fetches):
+    common.prefetch_user_info(WALLET_ADDRESS, None, 'test-fork')
+    assert len(fetches) == 1
+    # cached apart from the user info on mainnet
+    assert "name2.eth" in _get_user_info()
+    assert len(fetches) == 2
+
+
+def test_invalidate_user_info(fetches):
+    assert "name1.eth" in _get_user_info()
+    with context.with_request_context(WALLET_ADDRESS, None):
+        common.invalidate_user_info()
+    assert "name2.eth" in _get_user_info()
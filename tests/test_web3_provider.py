@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+from web3 import Web3
+
+from utils import http_client, web3_provider
+from utils.cache import LRUCache
+
+# Invoke this with python3 -m pytest -s tests/test_web3_provider.py
+
+ERC20_BALANCE_OF_ABI = [{
+    "inputs": [{"internalType": "address", "name": "account", "type": "address"}],
+    "name": "balanceOf",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function",
+}]
+TOKEN_ADDRESS = Web3.to_checksum_address('0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48')
+WALLET_ADDRESS = Web3.to_checksum_address('0xd8da6bf26964af9d7eed9e03e53415d37aa96045')
+
+
+def _result(request):
+    method = request['method']
+    if method == 'eth_chainId':
+        return '0x1'
+    if method == 'eth_getBalance':
+        return hex(10 ** 18)
+    if method == 'eth_call':
+        call = request['params'][0]
+        if call['to'].lower() != TOKEN_ADDRESS.lower():
+            raise ValueError('execution reverted')
+        # balanceOf(address) returns the last 4 bytes of the address as the balance
+        return '0x' + call['data'][-8:].rjust(64, '0')
+    raise ValueError(f'unknown method {method}')
+
+
+def _respond_one(request):
+    try:
+        return dict(jsonrpc='2.0', id=request['id'], result=_result(request))
+    except ValueError as e:
+        return dict(jsonrpc='2.0', id=request['id'], error=dict(code=-32000, message=str(e)))
+
+
+def _respond(server, method, url, body):
+    """Stand-in for a JSON-RPC node, answering single and batched requests."""
+    with server.lock:
+        server.num_requests += 1
+        server.in_flight += 1
+        server.max_in_flight = max(server.max_in_flight, server.in_flight)
+    time.sleep(server.service_time)
+    with server.lock:
+        server.in_flight -= 1
+    if isinstance(body, list):
+        # nodes may answer batches in any order
+        return 200, [_respond_one(request) for request in reversed(body)]
+    return 200, _respond_one(body)
+
+
+@pytest.fixture
+def server(stub_server):
+    return stub_server(_respond, num_requests=0, service_time=0, in_flight=0, max_in_flight=0)
+
+
+def test_registry_shares_web3_across_threads(server):
+    instances = []
+    threads = [threading.Thread(target=lambda: instances.append(web3_provider.get_web3_from_rpc_url(server.url))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(map(id, instances))) == 1
+
+
+def test_registry_is_bounded(monkeypatch):
+    monkeypatch.setattr(web3_provider, '_web3_by_rpc_url', LRUCache('test_web3_by_rpc_url', maxsize=2))
+    first = web3_provider.get_web3_from_rpc_url('http://127.0.0.1:1/fork-1')
+    for i in range(2, 4):
+        web3_provider.get_web3_from_rpc_url(f'http://127.0.0.1:1/fork-{i}')
+    assert len(web3_provider._web3_by_rpc_url) == 2
+    assert web3_provider.get_web3_from_rpc_url('http://127.0.0.1:1/fork-1') is not first
+
+
+def test_rpc_concurrency_is_bounded_apart(server, monkeypatch):
+    monkeypatch.setattr(http_client, 'HTTP_MAX_CONCURRENCY_PER_UPSTREAM', 1)
+    monkeypatch.setattr(web3_provider, 'RPC_MAX_CONCURRENCY', 3)
+    server.service_time = 0.05
+    web3 = web3_provider.get_web3_from_rpc_url(server.url)
+    threads = [threading.Thread(target=web3.eth.get_balance, args=(WALLET_ADDRESS,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.num_requests == 6
+    assert server.max_in_flight == 3
+
+
+def test_pooled_connections(server):
+    web3 = web3_provider.get_web3_from_rpc_url(server.url)
+
+    def get_balances():
+        for _ in range(5):
+            assert web3.eth.get_balance(WALLET_ADDRESS) == 10 ** 18
+
+    threads = [threading.Thread(target=get_balances) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.num_requests == 20
+    # connections are reused across threads, rather than one session per thread
+    assert server.num_connections <= 4
+    get_balances()
+    assert server.num_connections <= 4
+
+
+def test_batch_request(server):
+    web3 = web3_provider.get_web3_from_rpc_url(server.url)
+    results = web3.provider.make_batch_request([
+        ('eth_chainId', []),
+        ('eth_getBalance', [WALLET_ADDRESS, 'latest']),
+    ])
+    assert results == ['0x1', hex(10 ** 18)]
+    assert server.num_requests == 1
+
+
+def test_batch_call(server):
+    web3 = web3_provider.get_web3_from_rpc_url(server.url)
+    contract = web3.eth.contract(address=TOKEN_ADDRESS, abi=ERC20_BALANCE_OF_ABI)
+    addresses = [Web3.to_checksum_address('0x' + f'{i:040x}') for i in range(1, 6)]
+    balances = web3_provider.batch_call(web3, [contract.functions.balanceOf(address) for address in addresses])
+    assert balances == [1, 2, 3, 4, 5]
+    assert server.num_requests == 1
+    assert contract.functions.balanceOf(addresses[0]).call() == 1
+
+
+def test_batch_call_errors(server):
+    web3 = web3_provider.get_web3_from_rpc_url(server.url)
+    other = web3.eth.contract(address=WALLET_ADDRESS, abi=ERC20_BALANCE_OF_ABI)
+    with pytest.raises(ValueError, match='execution reverted'):
+        web3_provider.batch_call(web3, [other.functions.balanceOf(WALLET_ADDRESS)])
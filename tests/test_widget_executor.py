@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from integrations import paginator
+from utils import widget_executor
+
+# Invoke this with python3 -m pytest -s tests/test_widget_executor.py
+
+
+def test_timeout_starts_when_command_runs(monkeypatch):
+    # a single worker, busy with another command for longer than the timeout
+    monkeypatch.setattr(widget_executor, '_executor', ThreadPoolExecutor(max_workers=1))
+    command = widget_executor.WidgetCommand(name='test-command', fn=lambda: 'done', timeout=0.1)
+    widget_executor.submit(time.sleep, 0.2)
+    task = widget_executor.submit(command.run)
+    assert widget_executor.wait(command, task) == 'done'
+
+
+def test_timed_out_command_is_cancelled():
+    stopped = threading.Event()
+
+    def fetch_page(page):
+        time.sleep(0.02)
+        return page
+
+    def run():
+        for _ in paginator.fetch_pages(fetch_page):
+            pass
+        stopped.set()
+
+    command = widget_executor.WidgetCommand(name='test-command', fn=run, timeout=0.1)
+    task = widget_executor.submit(command.run)
+    assert widget_executor.wait(command, task) == 'Timed out evaluating test-command, please try again.'
+    # the command stops fetching pages once it is abandoned
+    assert stopped.wait(timeout=1)
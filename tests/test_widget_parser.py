@@ -0,0 +1,170 @@
+import random
+from typing import Callable, Generator, List
+
+import pytest
+
+import tools.index_widget as index_widget
+from utils.widget_parser import WIDGET_START, WIDGET_END, WidgetParser, TextEvent, CommandEvent
+
+# Invoke this with python3 -m pytest -s tests/test_widget_parser.py
+
+
+NUM_FUZZ_CASES = 2000
+
+
+def _fake_replace_match(m):
+    command = m.group('command')
+    params = m.group('params')
+    if command == 'fetch-items':
+        # fetch results can contain display commands, which are evaluated in turn
+        return f'{WIDGET_START}display-item({params}){WIDGET_END}'
+    if command.startswith('fetch-'):
+        return f'[{command}:{params}]'
+    return m.group(0)
+
+
+@pytest.fixture(autouse=True)
+def fake_replace_match(monkeypatch):
+    monkeypatch.setattr(index_widget, 'replace_match', _fake_replace_match)
+
+
+def _reference_stream(tokens: List[str]) -> str:
+    """Injection handler as it was before the parser, re-scanning the response buffer on every token."""
+    output = []
+    new_token_handler = output.append
+    response_buffer = ""
+
+    def injection_handler(token):
+        nonlocal response_buffer
+
+        response_buffer += token
+        while WIDGET_START in response_buffer:
+            if WIDGET_END in response_buffer:
+                response_buffer = index_widget.iterative_evaluate(response_buffer)
+                if isinstance(response_buffer, Callable):
+                    response_buffer(new_token_handler)
+                    response_buffer = ""
+                    return
+                elif isinstance(response_buffer, Generator):
+                    for item in response_buffer:
+                        new_token_handler(str(item) + "\n")
+                    response_buffer = ""
+                    return
+                elif len(response_buffer.split(WIDGET_START)) == len(response_buffer.split(WIDGET_END)):
+                    response_buffer = response_buffer.replace(WIDGET_END, WIDGET_END + '\n')
+                    break
+                else:
+                    return
+            else:
+                return
+        if 0 < len(response_buffer) < len(WIDGET_START) and WIDGET_START.startswith(response_buffer):
+            return
+        token = response_buffer
+        response_buffer = ""
+        new_token_handler(token)
+
+    for token in tokens:
+        injection_handler(token)
+    return ''.join(output)
+
+
+def _parsed_stream(tokens: List[str]) -> str:
+    output: List[str] = []
+    parser = WidgetParser()
+    for token in tokens:
+        for event in parser.feed(token):
+            index_widget.handle_widget_event(event, output.append)
+    for event in parser.flush():
+        index_widget.handle_widget_event(event, output.append)
+    return ''.join(output)
+
+
+def _random_text(rng: random.Random) -> str:
+    # no '|', so that text never forms a marker by itself
+    return ''.join(rng.choice('abc xyz,.()<>\n') for _ in range(rng.randint(0, 12)))
+
+
+def _random_params(rng: random.Random) -> str:
+    return ','.join(''.join(rng.choice('abcdef 0123') for _ in range(rng.randint(0, 5))) for _ in range(rng.randint(0, 3)))
+
+
+def _random_command(rng: random.Random, depth: int = 0) -> str:
+    name = rng.choice(['fetch-price', 'fetch-items', 'display-foo', 'display-bar', 'unknown-command'])
+    if depth < 2 and rng.random() < 0.3:
+        params = _random_params(rng) + ',' + _random_command(rng, depth + 1)
+    else:
+        params = _random_params(rng)
+    return f'{WIDGET_START}{name}({params}){WIDGET_END}'
+
+
+def _random_response(rng: random.Random) -> str:
+    pieces = []
+    for _ in range(rng.randint(1, 8)):
+        pieces.append(_random_text(rng) if rng.random() < 0.5 else _random_command(rng))
+    return ''.join(pieces) + ' end.'
+
+
+def _random_tokens(rng: random.Random, response: str) -> List[str]:
+    # the previous handler only detected markers within a token, or a WIDGET_START
+    # split right after a token of just its first char (when not after another
+    # one, which it flushed as text), so only cut there
+    cuts = []
+    for i in range(1, len(response)):
+        if rng.random() > 0.3:
+            continue
+        if response[i - 1:i + 1] == WIDGET_END:
+            continue
+        if response[i - 1:i + 1] == WIDGET_START:
+            if not cuts or cuts[-1] != i - 1 or response[i - 2:i - 1] == WIDGET_START[0]:
+                continue
+        cuts.append(i)
+    bounds = [0] + cuts + [len(response)]
+    return [response[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def test_fuzz_against_buffer_rescanning():
+    rng = random.Random(0)
+    for _ in range(NUM_FUZZ_CASES):
+        response = _random_response(rng)
+        tokens = _random_tokens(rng, response)
+        assert _parsed_stream(tokens) == _reference_stream(tokens), tokens
+
+
+def test_events():
+    parser = WidgetParser()
+    tokens = ['Price: <', '|fetch-price(eth', ')|', '> and <|display-foo(<|fetch', '-price(btc)|>)|', '>.', '<']
+    events = [event for token in tokens for event in parser.feed(token)]
+    assert events == [
+        TextEvent('Price: '),
+        CommandEvent('<|fetch-price(eth)|>'),
+        TextEvent(' and '),
+        CommandEvent('<|display-foo(<|fetch-price(btc)|>)|>'),
+        TextEvent('.'),
+    ]
+    assert parser.flush() == [TextEvent('<')]
+
+
+def test_incomplete_command_is_dropped():
+    parser = WidgetParser()
+    assert parser.feed('text <|fetch-price(eth') == [TextEvent('text ')]
+    assert parser.flush() == []
+    assert parser.feed('more') == [TextEvent('more')]
+
+
+def test_widget_stream(monkeypatch):
+    def stream_items(m):
+        return (f'item {i}' for i in range(3))
+
+    monkeypatch.setattr(index_widget, 'replace_match', stream_items)
+    assert _parsed_stream(['Results: <|fetch-nft-search(punks)|>', ' done']) == 'Results: item 0\nitem 1\nitem 2\n done'
+
+
+def test_index_widget_tool_flushes_parser():
+    output = []
+    tool = index_widget.IndexWidgetTool(name='widgets', index=None, top_k=1, new_token_handler=output.append)
+    injection_handler = tool._chain.llm.callbacks[0].new_token_handler
+    for token in ['## Response:', ' a <= b <']:
+        injection_handler(token)
+    assert ''.join(output) == ' a <= b '
+    tool._flush_handler()
+    assert ''.join(output) == ' a <= b <'
@@ -12,6 +12,7 @@ from .base import BaseTool
 
 from .index_lookup import IndexLookupTool
 from index.weaviate import WeaviateIndex
+from utils.coingecko.coin_index import get_coin_index
 from chains.api_chain import IndexAPIChain
 
 
@@ -57,24 +58,29 @@ class IndexAPITool(IndexLookupTool):
         api_spec = docs[0].metadata["spec"]
 
         if '__price_context_data__' in api_spec:
-            crypto_tokens_docs = retry_on_exceptions_with_backoff(
-                lambda: self.crypto_tokens_index.similarity_search(query, k=3),
-                [ErrorToRetry(TypeError)],
-            )
-            context_data = self._build_price_context_data(crypto_tokens_docs)
+            # tokens mentioned by symbol or name are looked up in the coin list, with the
+            # tokens index as a fallback for less literal mentions
+            coins = get_coin_index().find_in_text(query, limit=3)
+            if not coins:
+                crypto_tokens_docs = retry_on_exceptions_with_backoff(
+                    lambda: self.crypto_tokens_index.similarity_search(query, k=3),
+                    [ErrorToRetry(TypeError)],
+                )
+                coins = [dict(id=doc.page_content, symbol=doc.metadata["symbol"], name=doc.metadata["name"]) for doc in crypto_tokens_docs]
+            context_data = self._build_price_context_data(coins)
             api_spec = api_spec.format(__price_context_data__=context_data)
 
         print(api_spec)
         result = self._chain.run(question=query, api_docs=api_spec)
         return result
 
-    def _build_price_context_data(self, docs):
+    def _build_price_context_data(self, coins):
         context_data = ""
         context_data = '\n'.join([json.dumps({
-            "id": doc.page_content,
-            "symbol": doc.metadata["symbol"],
-            "name": doc.metadata["name"]
-        }) for doc in docs])
+            "id": coin["id"],
+            "symbol": coin["symbol"],
+            "name": coin["name"]
+        }) for coin in coins])
         return context_data
 
     async def _arun(self, query: str) -> str:
@@ -3,28 +3,32 @@ import json
 import re
 import requests
 from dataclasses import dataclass, asdict
-from typing import Any, Callable, Dict, Generator, List, Optional, Union, Literal, TypedDict
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Union, Literal, TypedDict
 import traceback
 
 from langchain.llms import OpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.prompts.base import BaseOutputParser
-from ens import ENS
 
 import ui_workflows
 import config
 import context
 import utils
-from utils import error_wrap, ensure_wallet_connected, ConnectedWalletRequired, FetchError, ExecError, ETH_MAINNET_CHAIN_ID, get_token_balance, format_token_balance
+from utils import error_wrap, ensure_wallet_connected, ConnectedWalletRequired, FetchError, ExecError, ETH_MAINNET_CHAIN_ID, get_token_balance, format_token_balance, get_portfolio_balances, MAINNET_TOKEN_TO_PROFILE_MAP
 import utils.timing as timing
-from utils.coingecko.coingecko_coin_currency import coin_list, currency_list, coingecko_api_url_prefix
+from utils.widget_parser import WIDGET_START, WIDGET_END, RE_COMMAND, WidgetParser, TextEvent, CommandEvent, ParserEvent
+import utils.widget_executor as widget_executor
+from utils.widget_executor import register_widget_command, get_widget_command
+from utils.coingecko.coingecko_coin_currency import get_currency_list, coingecko_api_url_prefix
+from utils.coingecko.coin_index import get_coin_index
 import registry
 import streaming
 from chat.container import ContainerMixin, dataclass_to_container_params
 from integrations import (
-    etherscan, defillama, center, opensea,
+    etherscan, defillama, center, opensea, ens_resolver,
 )
+from integrations import cache as integrations_cache
 from ui_workflows import (
     aave, ens
 )
@@ -33,12 +37,6 @@ from .index_lookup import IndexLookupTool
 from ui_workflows.multistep_handler import register_ens_domain, exec_aave_operation
 
 
-WIDGET_START = '<|'
-WIDGET_END = '|>'
-
-RE_COMMAND = re.compile(r"\<\|(?P<command>[^(]+)\((?P<params>[^)<{}]*)\)\|\>")
-
-
 TEMPLATE = '''You are a web3 widget tool. You have access to a list of widget magic commands that you can delegate work to, by invoking them and chaining them together, to provide a response to an input query. Magic commands have the structure "<|command(parameter1, parameter2, ...)|>" specifying the command and its input parameters. They can only be used with all parameters having known and assigned values, otherwise, they have to be kept secret. The command may either have a display- or a fetch- prefix. When you return a display- command, the user will see data, an interaction box, or other inline item rendered in its place. When you return a fetch- command, data is fetched over an API and injected in place. Users cannot type or use magic commands, so do not tell them to use them. Fill in the command with parameters as inferred from the input. If there are missing parameters, do not use magic commands but mention what parameters are needed instead. If there is no appropriate widget available, explain that more information is needed. Do not make up a non-existent widget magic command, only use the applicable ones for the situation, and only if all parameters are available. You might need to use the output of widget magic commands as the input to another to get your final answer. Here are the widgets that may be relevant:
 ---
 {task_info}
@@ -59,6 +57,7 @@ class IndexWidgetTool(IndexLookupTool):
 
     _chain: LLMChain
     _evaluate_widgets: bool
+    _flush_handler: Callable[[], None]
 
     def __init__(
             self,
@@ -77,14 +76,15 @@ class IndexWidgetTool(IndexLookupTool):
         response_buffer = ""
         response_state = 0  # finite-state machine state
         response_prefix = "## Response:"
+        widget_parser = WidgetParser()
 
         def injection_handler(token):
             nonlocal new_token_handler, response_buffer, response_state, response_prefix
 
             timing.log('first_widget_token')
 
-            response_buffer += token
             if response_state == 0:  # we are still waiting for response_prefix to appear
+                response_buffer += token
                 if response_prefix not in response_buffer:
                     # keep waiting
                     return
@@ -92,58 +92,30 @@ class IndexWidgetTool(IndexLookupTool):
                     # we have found the response_prefix, trim everything before that
                     timing.log('first_widget_response_token')
                     response_state = 1
-                    response_buffer = response_buffer[response_buffer.index(response_prefix) + len(response_prefix):]
+                    token = response_buffer[response_buffer.index(response_prefix) + len(response_prefix):]
+                    response_buffer = ""
 
             if response_state == 1:  # we are going to output the response incrementally, evaluating any fetch commands
-                while WIDGET_START in response_buffer and self._evaluate_widgets:
-                    if WIDGET_END in response_buffer:
-                        # parse fetch command
-                        response_buffer = iterative_evaluate(response_buffer)
-                        if isinstance(response_buffer, Callable):  # handle delegated streaming
-                            def handler(token):
-                                nonlocal new_token_handler
-                                timing.log('first_visible_widget_response_token')
-                                return new_token_handler(token)
-                            response_buffer(handler)
-                            response_buffer = ""
-                            return
-                        elif isinstance(response_buffer, Generator):  # handle stream of widgets
-                            for item in response_buffer:
-                                timing.log('first_visible_widget_response_token')
-                                new_token_handler(str(item) + "\n")
-                            response_buffer = ""
-                            return
-                        elif len(response_buffer.split(WIDGET_START)) == len(response_buffer.split(WIDGET_END)):
-                            # matching pairs of open/close, just flush
-                            # NB: for better frontend parsing of nested widgets, we need an invariant that
-                            # there are no two independent widgets on the same line, otherwise we can't
-                            # detect the closing tag properly when there is nesting.
-                            response_buffer = response_buffer.replace(WIDGET_END, WIDGET_END + '\n')
-                            break
-                        else:
-                            # keep waiting
-                            return
-                    else:
-                        # keep waiting
-                        return
-
-                if 0 < len(response_buffer) < len(WIDGET_START) and WIDGET_START.startswith(response_buffer):
-                    # keep waiting if we could potentially be receiving WIDGET_START
-                    return
-                token = response_buffer
-                response_buffer = ""
-                if token.strip():
-                    timing.log('first_visible_widget_response_token')
-                new_token_handler(token)
-                if '\n' in token:
-                    # we have found a line-break in the response, switch to the terminal state to mask subsequent output
-                    response_state = 2
+                events = widget_parser.feed(token) if self._evaluate_widgets else [TextEvent(token)]
+                for event in events:
+                    token = handle_widget_event(event, new_token_handler)
+                    if '\n' in token:
+                        # we have found a line-break in the response, switch to the terminal state to mask subsequent output
+                        response_state = 2
+                        break
+
+        def flush_handler():
+            # pass on text held back by the parser at the end of the stream
+            if response_state == 1:
+                for event in widget_parser.flush():
+                    handle_widget_event(event, new_token_handler)
 
         chain = streaming.get_streaming_chain(prompt, injection_handler, model_name=model_name)
         super().__init__(
             *args,
             _chain=chain,
             _evaluate_widgets=evaluate_widgets,
+            _flush_handler=flush_handler,
             content_description="widget magic command definitions for users to invoke web3 transactions or live data when the specific user action or transaction is clear. You can look up live prices, DeFi yields, wallet balances, ENS information, token contract addresses, do transfers or swaps or deposit tokens to farm yields, or search for NFTs, and retrieve data about NFT collections, assets, trait names and trait values. It cannot help the user with understanding how to use the app or how to perform certain actions.",
             input_description="a standalone query phrase with all relevant contextual details mentioned explicitly without using pronouns in order to invoke the right widget",
             output_description="a summarized answer with relevant magic command for widget(s), or a question prompt for more information to be provided",
@@ -159,9 +131,43 @@ class IndexWidgetTool(IndexLookupTool):
             "stop": "User",
         }
         result = self._chain.run(example)
+        self._flush_handler()
         return result.strip()
 
 
+def handle_widget_event(event: ParserEvent, new_token_handler: Callable[[str], Any]) -> str:
+    """Pass on text from the widget parser, evaluating any fetch commands.
+
+    Returns what was passed to the handler, or an empty string when the
+    command delegated streaming to the handler.
+
+    """
+    if isinstance(event, CommandEvent):
+        # parse fetch command
+        result = iterative_evaluate(event.text)
+        if isinstance(result, Callable):  # handle delegated streaming
+            def handler(token):
+                timing.log('first_visible_widget_response_token')
+                return new_token_handler(token)
+            result(handler)
+            return ""
+        elif isinstance(result, Generator):  # handle stream of widgets
+            for item in result:
+                timing.log('first_visible_widget_response_token')
+                new_token_handler(str(item) + "\n")
+            return ""
+        # NB: for better frontend parsing of nested widgets, we need an invariant that
+        # there are no two independent widgets on the same line, otherwise we can't
+        # detect the closing tag properly when there is nesting.
+        token = result.replace(WIDGET_END, WIDGET_END + '\n')
+    else:
+        token = event.text
+    if token.strip():
+        timing.log('first_visible_widget_response_token')
+    new_token_handler(token)
+    return token
+
+
 def iterative_evaluate(phrase: str) -> Union[str, Generator, Callable]:
     while True:
         # before we had streaming, we could use this
@@ -169,11 +175,11 @@ def iterative_evaluate(phrase: str) -> Union[str, Generator, Callable]:
         # now, iterate manually to find any streamable components
         eval_phrase = ""
         last_matched_char = 0
-        for match in RE_COMMAND.finditer(phrase):
+        matches = list(RE_COMMAND.finditer(phrase))
+        for match, replaced in zip(matches, evaluate_matches(matches)):
             span = match.span()
             eval_phrase += phrase[last_matched_char: span[0]]
             last_matched_char = span[1]
-            replaced = replace_match(match)
             if isinstance(replaced, str):
                 eval_phrase += replaced
             else:
@@ -198,84 +204,48 @@ def sanitize_str(s: str) -> str:
     return s
 
 
+def evaluate_matches(matches: List[re.Match]) -> Iterator[Union[str, Generator, Callable]]:
+    """Evaluate the commands matched in a phrase, yielding the results in order.
+
+    Matches can't be nested, so the commands are independent of each other.
+    Side-effect free commands before the first streaming one are submitted
+    to the widget command pool upfront, to run concurrently. The others are
+    evaluated in order as the results are consumed, so that nothing is
+    evaluated after a streaming command short-circuits the phrase.
+
+    """
+    tasks = {}
+    for i, m in enumerate(matches):
+        widget_command = get_widget_command(m.group('command'))
+        if widget_command is None:
+            continue
+        if widget_command.streaming:
+            break
+        if widget_command.side_effect_free:
+            tasks[i] = (widget_command, widget_executor.submit(replace_match, m))
+    for i, m in enumerate(matches):
+        if i in tasks:
+            yield widget_executor.wait(*tasks[i])
+        else:
+            yield replace_match(m)
+
+
 def replace_match(m: re.Match) -> Union[str, Generator, Callable]:
     command = m.group('command')
     params = m.group('params')
     params = list(map(sanitize_str, params.split(','))) if params else []
     timing.log('first_widget_command')
     print('found command:', command, params)
-    if command == 'fetch-nft-search':
-        return fetch_nft_search(*params)
-    elif command == 'fetch-price':
-        return str(fetch_price(*params))
-    elif command == 'fetch-nft-collection-assets-by-trait':
-        return fetch_nft_search_collection_by_trait(*params, for_sale_only=False)
-    elif command == 'fetch-nft-collection-assets-for-sale-by-trait':
-        return fetch_nft_search_collection_by_trait(*params, for_sale_only=True)
-    elif command == 'fetch-nft-collection-info':
-        # return str(fetch_nft_collection(*params))
-        # we also fetch some collection assets as a convenience
-        return str(fetch_nft_collection_assets(*params))
-    elif command == 'fetch-nft-collection-assets-for-sale':
-        return fetch_nft_collection_assets_for_sale(*params)
-    elif command == 'fetch-nft-collection-traits':
-        return str(fetch_nft_collection_traits(*params))
-    elif command == 'fetch-nft-collection-trait-values':
-        return str(fetch_nft_collection_trait_values(*params))
-    # elif command == 'fetch-nft-asset-info':
-    #    return str(fetch_nft_asset(*params))
-    elif command == 'fetch-nft-asset-traits':
-        return str(fetch_nft_asset_traits(*params))
-    elif command == 'fetch-nft-buy-asset':
-        return str(fetch_nft_buy(*params))
-    elif command == 'fetch-nfts-owned-by-address-or-domain':
-        return str(fetch_nfts_owned_by_address_or_domain(*params))
-    elif command == 'fetch-nfts-owned-by-user':
-        return str(fetch_nfts_owned_by_user(*params))
-    elif command == 'fetch-balance':
-        return str(fetch_balance(*params))
-    elif command == 'fetch-my-balance':
-        return str(fetch_my_balance(*params))
-    elif command == 'fetch-eth-in':
-        return str(fetch_eth_in(*params))
-    elif command == 'fetch-eth-out':
-        return str(fetch_eth_out(*params))
-    elif command == 'fetch-gas':
-        return str(fetch_gas(*params))
-    elif command == 'fetch-yields':
-        return str(fetch_yields(*params))
-    elif command == 'fetch-app-info':
-        return fetch_app_info(*params)
-    # elif command == 'fetch-scraped-sites':
-    #     return fetch_scraped_sites(*params)
-    elif command == 'fetch-link-suggestion':
-        return fetch_link_suggestion(*params) 
-    elif command == aave.AaveSupplyContractWorkflow.WORKFLOW_TYPE:
-        return str(exec_aave_operation(*params, operation='supply'))
-    elif command == aave.AaveBorrowContractWorkflow.WORKFLOW_TYPE:
-        return str(exec_aave_operation(*params, operation='borrow'))
-    elif command == aave.AaveRepayContractWorkflow.WORKFLOW_TYPE:
-        return str(exec_aave_operation(*params, operation='repay'))
-    elif command == aave.AaveWithdrawContractWorkflow.WORKFLOW_TYPE:
-        return str(exec_aave_operation(*params, operation='withdraw'))
-    elif command == 'ens-from-address':
-        return str(ens_from_address(*params))
-    elif command == 'address-from-ens':
-        return str(address_from_ens(*params))
-    elif command == ens.ENSRegistrationContractWorkflow.WORKFLOW_TYPE:
-        return str(register_ens_domain(*params))
-    elif command == ens.ENSSetTextWorkflow.WORKFLOW_TYPE:
-        return str(set_ens_text(*params))
-    elif command == ens.ENSSetPrimaryNameWorkflow.WORKFLOW_TYPE:
-        return str(set_ens_primary_name(*params))
-    elif command == ens.ENSSetAvatarNFTWorkflow.WORKFLOW_TYPE:
-        return str(set_ens_avatar_nft(*params))
-    elif command.startswith('display-'):
-        return m.group(0)
-    else:
-        # unrecognized command, just return for now
+    widget_command = get_widget_command(command)
+    if widget_command is None:
+        # display command, or unrecognized command, just return for now
         # assert 0, 'unrecognized command: %s' % m.group(0)
         return m.group(0)
+    return widget_command.run(*params)
+
+
+_coingecko_price_cache = integrations_cache.IntegrationCache('coingecko_price', ttl=30, stale_ttl=120)
+
 
 @error_wrap
 def fetch_price(basetoken: str, quotetoken: str = "usd") -> str:
@@ -284,28 +254,26 @@ def fetch_price(basetoken: str, quotetoken: str = "usd") -> str:
     """
     Failures:
     - quotetoken not mentioned it can assume it to be usd or eth
-    - Cannot identify duplicates in the coin list
-    - Cannot handle major mispells
+    - Duplicates in the coin list are only ranked if coin ranks have been downloaded
     """
-    for c in coin_list:
-        if c['id'].lower() == basetoken.lower() or \
-            c['symbol'].lower() == basetoken.lower() or \
-                c['name'].lower() == basetoken.lower():
-            basetoken_id = c['id'].lower()
-            basetoken_name = c['name']
-            break
-    else:
+    coin_index = get_coin_index()
+    coin = coin_index.resolve(basetoken)
+    if coin is None:
+        suggestions = coin_index.fuzzy(basetoken)
+        if suggestions:
+            return f"Query token {basetoken} not supported, did you mean {' or '.join(c['name'] for c in suggestions)}?"
         return f"Query token {basetoken} not supported"
+    basetoken_id = coin['id'].lower()
+    basetoken_name = coin['name']
 
-    if quotetoken.lower() in currency_list:
+    if quotetoken.lower() in get_currency_list():
         quotetoken_id = quotetoken.lower()
     else:
         return f"Quote currency {quotetoken} not supported"
 
     coingecko_api_url = coingecko_api_url_prefix + f"?ids={basetoken_id}&vs_currencies={quotetoken_id}"
-    response = requests.get(coingecko_api_url)
-    response.raise_for_status()
-    return f"The price of {basetoken_name} is {list(list(response.json().values())[0].values())[0]} {quotetoken}"
+    obj = integrations_cache.get_json(_coingecko_price_cache, coingecko_api_url)
+    return f"The price of {basetoken_name} is {list(list(obj.values())[0].values())[0]} {quotetoken}"
 
 
 @error_wrap
@@ -314,7 +282,10 @@ def fetch_balance(token: str, wallet_address: str) -> str:
         raise FetchError(f"Please specify the wallet address to check the token balance of.")
     web3 = context.get_web3_provider()
     chain_id = context.get_wallet_chain_id()
-    balance = get_token_balance(web3, chain_id, token, wallet_address)
+    # read the balances of all supported tokens in one call, to serve the other balances of this wallet from the cache
+    balance = get_portfolio_balances(web3, chain_id, wallet_address).get(token) if token in MAINNET_TOKEN_TO_PROFILE_MAP else None
+    if balance is None:
+        balance = get_token_balance(web3, chain_id, token, wallet_address)
     return format_token_balance(chain_id, token, balance)
 
 
@@ -326,19 +297,27 @@ def fetch_my_balance(token: str) -> str:
     return fetch_balance(token, wallet_address)
 
 
+def _format_activity_total(activity: etherscan.AddressActivity, value: int) -> str:
+    # the totals of busy addresses only count their first transactions until later refreshes catch up
+    return f'at least {value}' if activity.is_truncated else str(value)
+
+
 @error_wrap
 def fetch_eth_in(wallet_address: str) -> str:
-    return etherscan.get_all_eth_to_address(wallet_address)
+    activity = etherscan.get_address_activity(wallet_address)
+    return _format_activity_total(activity, activity.eth_in)
 
 
 @error_wrap
 def fetch_eth_out(wallet_address: str) -> str:
-    return etherscan.get_all_eth_from_address(wallet_address)
+    activity = etherscan.get_address_activity(wallet_address)
+    return _format_activity_total(activity, activity.eth_out)
 
 
 @error_wrap
 def fetch_gas(wallet_address: str) -> str:
-    return etherscan.get_all_gas_for_address(wallet_address)
+    activity = etherscan.get_address_activity(wallet_address)
+    return _format_activity_total(activity, activity.gas)
 
 
 @error_wrap
@@ -582,8 +561,7 @@ def fetch_yields(token, network, count) -> str:
 def ens_from_address(address) -> str:
     try:
         web3 = context.get_web3_provider()
-        ns = ENS.from_web3(web3)
-        domain = ns.name(address)
+        domain = ens_resolver.resolve_name(web3, address)
         if domain is None:
             return f"No ENS domain for {address}"
         else:
@@ -598,8 +576,7 @@ def ens_from_address(address) -> str:
 def address_from_ens(domain) -> str:
     try:
         web3 = context.get_web3_provider()
-        ns = ENS.from_web3(web3)
-        address = ns.address(domain)
+        address = ens_resolver.resolve_address(web3, domain)
         if address is None:
             return f"No address for {domain}"
         else:
@@ -679,3 +656,41 @@ def set_ens_avatar_nft(domain: str, nftContractAddress: str, nftId: str, collect
 
     result = ens.ENSSetAvatarNFTWorkflow(wallet_chain_id, wallet_address, user_chat_message_id, params).run()
     return TxPayloadForSending.from_workflow_result(result)
+
+
+register_widget_command('fetch-nft-search', fetch_nft_search, streaming=True)
+register_widget_command('fetch-price', fetch_price, timeout=10)
+register_widget_command('fetch-nft-collection-assets-by-trait', functools.partial(fetch_nft_search_collection_by_trait, for_sale_only=False), streaming=True)
+register_widget_command('fetch-nft-collection-assets-for-sale-by-trait', functools.partial(fetch_nft_search_collection_by_trait, for_sale_only=True), streaming=True)
+# register_widget_command('fetch-nft-collection-info', fetch_nft_collection)
+# we also fetch some collection assets as a convenience
+register_widget_command('fetch-nft-collection-info', fetch_nft_collection_assets)
+register_widget_command('fetch-nft-collection-assets-for-sale', fetch_nft_collection_assets_for_sale, streaming=True)
+register_widget_command('fetch-nft-collection-traits', fetch_nft_collection_traits)
+register_widget_command('fetch-nft-collection-trait-values', fetch_nft_collection_trait_values)
+# register_widget_command('fetch-nft-asset-info', fetch_nft_asset)
+register_widget_command('fetch-nft-asset-traits', fetch_nft_asset_traits)
+register_widget_command('fetch-nft-buy-asset', fetch_nft_buy)
+register_widget_command('fetch-nfts-owned-by-address-or-domain', fetch_nfts_owned_by_address_or_domain)
+register_widget_command('fetch-nfts-owned-by-user', fetch_nfts_owned_by_user)
+register_widget_command('fetch-balance', fetch_balance)
+register_widget_command('fetch-my-balance', fetch_my_balance)
+register_widget_command('fetch-eth-in', fetch_eth_in, timeout=60)
+register_widget_command('fetch-eth-out', fetch_eth_out, timeout=60)
+register_widget_command('fetch-gas', fetch_gas, timeout=60)
+register_widget_command('fetch-yields', fetch_yields)
+register_widget_command('fetch-app-info', fetch_app_info, streaming=True)
+# register_widget_command('fetch-scraped-sites', fetch_scraped_sites, streaming=True)
+register_widget_command('fetch-link-suggestion', fetch_link_suggestion, streaming=True)
+register_widget_command('ens-from-address', ens_from_address, timeout=10)
+register_widget_command('address-from-ens', address_from_ens, timeout=10)
+
+# commands that start a workflow for a transaction are evaluated one at a time, in order
+register_widget_command(aave.AaveSupplyContractWorkflow.WORKFLOW_TYPE, functools.partial(exec_aave_operation, operation='supply'), side_effect_free=False)
+register_widget_command(aave.AaveBorrowContractWorkflow.WORKFLOW_TYPE, functools.partial(exec_aave_operation, operation='borrow'), side_effect_free=False)
+register_widget_command(aave.AaveRepayContractWorkflow.WORKFLOW_TYPE, functools.partial(exec_aave_operation, operation='repay'), side_effect_free=False)
+register_widget_command(aave.AaveWithdrawContractWorkflow.WORKFLOW_TYPE, functools.partial(exec_aave_operation, operation='withdraw'), side_effect_free=False)
+register_widget_command(ens.ENSRegistrationContractWorkflow.WORKFLOW_TYPE, register_ens_domain, side_effect_free=False)
+register_widget_command(ens.ENSSetTextWorkflow.WORKFLOW_TYPE, set_ens_text, side_effect_free=False)
+register_widget_command(ens.ENSSetPrimaryNameWorkflow.WORKFLOW_TYPE, set_ens_primary_name, side_effect_free=False)
+register_widget_command(ens.ENSSetAvatarNFTWorkflow.WORKFLOW_TYPE, set_ens_avatar_nft, side_effect_free=False)
@@ -7,7 +7,7 @@ import context
 from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from web3 import Web3
 
-from utils import load_contract_abi
+from utils import get_contract, get_contract_abi
 from ..base import StepProcessingResult, revoke_erc20_approval, set_erc20_allowance, TEST_WALLET_ADDRESS, USDC_ADDRESS, WorkflowValidationError, ContractStepProcessingResult, BaseContractWorkflow
 
 def load_aave_contract_error_codes():
@@ -37,19 +37,19 @@ AAVE_SUPPORTED_TOKENS = [
 
 def get_aave_pool_v3_address_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=AAVE_POOL_V3_PROXY_ADDRESS, abi=load_contract_abi(__file__, "./abis/aave_pool_v3.abi.json"))
+    return get_contract(web3_provider, AAVE_POOL_V3_PROXY_ADDRESS, get_contract_abi(__file__, "./abis/aave_pool_v3.abi.json"))
 
 def get_aave_wrapped_token_gateway_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=AAVE_WRAPPED_TOKEN_GATEWAY, abi=load_contract_abi(__file__, "./abis/aave_wrapped_token_gateway.abi.json"))
+    return get_contract(web3_provider, AAVE_WRAPPED_TOKEN_GATEWAY, get_contract_abi(__file__, "./abis/aave_wrapped_token_gateway.abi.json"))
 
 def get_aave_variable_debt_token_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=AAVE_VARIABLE_DEBT_TOKEN_ADDRESS, abi=load_contract_abi(__file__, "./abis/aave_variable_debt_token.abi.json"))
+    return get_contract(web3_provider, AAVE_VARIABLE_DEBT_TOKEN_ADDRESS, get_contract_abi(__file__, "./abis/aave_variable_debt_token.abi.json"))
 
 def get_aave_atoken_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=AAVE_ATOKEN_ADDRESS, abi=load_contract_abi(__file__, "./abis/aave_atoken.abi.json"))
+    return get_contract(web3_provider, AAVE_ATOKEN_ADDRESS, get_contract_abi(__file__, "./abis/aave_atoken.abi.json"))
 
 def common_aave_validation(token):
     if (token not in AAVE_SUPPORTED_TOKENS):
@@ -1,12 +1,12 @@
 from abc import ABC, abstractmethod
 from typing import Any, Callable, Dict, List, Optional, Union, Literal, TypedDict
 from dataclasses import dataclass
-import requests
 
 from web3 import Web3, exceptions
 
 import context
 import env
+import utils.http_client as http_client
 from utils import TENDERLY_API_KEY, TENDERLY_PROJECT_API_BASE_URL
 from .common import get_latest_simulation_id_on_fork
 
@@ -55,7 +55,7 @@ class BaseContractWorkflow(ABC):
         if not env.is_prod():
             payload["root"] = get_latest_simulation_id_on_fork(context.get_web3_tenderly_fork_url())
 
-        res = requests.post(tenderly_simulate_api_url, json=payload, headers={'X-Access-Key': TENDERLY_API_KEY})
+        res = http_client.post(tenderly_simulate_api_url, json=payload, headers={'X-Access-Key': TENDERLY_API_KEY}, idempotent=True)
 
         if res.status_code == 200:
             simulation_data = res.json()
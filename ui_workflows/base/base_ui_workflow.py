@@ -5,12 +5,12 @@ import json
 from abc import ABC, abstractmethod
 from typing import Any, Callable, Dict, List, Optional, Union, Literal, TypedDict
 
-import requests
 from pywalletconnect.client import WCClient
 from playwright.sync_api import  sync_playwright, Page, BrowserContext
 
 import env
 import context
+import utils.http_client as http_client
 
 
 class BaseUIWorkflow(ABC):
@@ -111,7 +111,7 @@ class BaseUIWorkflow(ABC):
         payload = json.loads(route.request.post_data)
         batch_result = []
         for obj in payload:
-            response = requests.post(context.get_web3_tenderly_fork_url(), json=obj)
+            response = http_client.post(context.get_web3_tenderly_fork_url(), json=obj)
             response.raise_for_status()
             batch_result.append(response.json())
         route.fulfill(body=json.dumps(batch_result), headers={"access-control-allow-origin": "*", "access-control-allow-methods": "*", "access-control-allow-headers": "*"})
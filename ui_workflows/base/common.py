@@ -6,9 +6,9 @@ from typing import Any, Callable, Dict, List, Optional, Union, Literal, TypedDic
 from dataclasses import dataclass
 from web3 import Web3
 
-import requests
 import context
-from utils import TENDERLY_API_KEY, TENDERLY_PROJECT_API_BASE_URL, TENDERLY_DASHBOARD_PROJECT_BASE_URL
+import utils.http_client as http_client
+from utils import TENDERLY_API_KEY, TENDERLY_PROJECT_API_BASE_URL, TENDERLY_DASHBOARD_PROJECT_BASE_URL, web3_provider
 from database.models import db_session, ChatMessage, ChatSession, SystemConfig
 from database.models import (MultiStepWorkflow)
 
@@ -91,12 +91,12 @@ def tenderly_simulate_tx_on_fork(wallet_address: str, tx: Dict) -> str:
     fork_id = context.get_web3_fork_id()
     fork_rpc_url = context.get_web3_tenderly_fork_url()
 
-    res = requests.post(fork_rpc_url, json=payload)
+    res = http_client.post(fork_rpc_url, json=payload)
     res.raise_for_status()
 
     tx_hash = res.json()['result']
 
-    fork_web3 = Web3(Web3.HTTPProvider(fork_rpc_url))
+    fork_web3 = web3_provider.get_web3_from_rpc_url(fork_rpc_url)
     receipt = fork_web3.eth.wait_for_transaction_receipt(tx_hash)
 
     tenderly_simulation_id = get_latest_simulation_id_on_fork(fork_rpc_url)
@@ -108,7 +108,7 @@ def tenderly_simulate_tx_on_fork(wallet_address: str, tx: Dict) -> str:
     # Tx Error handling
     if receipt['status'] == 0:
         tenderly_simulation_api = f"{TENDERLY_PROJECT_API_BASE_URL}/fork/{fork_id}/simulation/{tenderly_simulation_id}"
-        res = requests.get(tenderly_simulation_api, headers={'X-Access-Key': TENDERLY_API_KEY})
+        res = http_client.get(tenderly_simulation_api, headers={'X-Access-Key': TENDERLY_API_KEY})
         error_message = 'n/a'
         if res.status_code == 200:
             simulation_data = res.json()
@@ -124,7 +124,7 @@ def get_latest_simulation_on_fork(fork_rpc_url):
         "params": []
     }
 
-    res = requests.post(fork_rpc_url, json=get_latest_tx_payload)
+    res = http_client.post(fork_rpc_url, json=get_latest_tx_payload, idempotent=True)
     res.raise_for_status()
 
     return res.json()
@@ -143,7 +143,7 @@ def advance_fork_blocks(num_blocks) -> None:
         ]
     }
 
-    res = requests.post(fork_rpc_url, json=payload)
+    res = http_client.post(fork_rpc_url, json=payload)
     res.raise_for_status()
 
 def advance_fork_time_secs(secs) -> None:
@@ -157,7 +157,7 @@ def advance_fork_time_secs(secs) -> None:
         ]
     }
 
-    res = requests.post(fork_rpc_url, json=payload)
+    res = http_client.post(fork_rpc_url, json=payload)
     res.raise_for_status()
 
 def setup_mock_db_objects() -> Dict:
@@ -3,16 +3,14 @@ import json
 import web3
 import os
 from logging import basicConfig, INFO
-import sha3 # 'pip install pysha3'
-from idna import encode, IDNAError
 
 import context
-from utils import load_contract_abi
+from integrations.ens_resolver import ENS_REGISTRY_ADDRESS, keccak_256, to_unicode, get_node_namehash
+from utils import get_contract, get_contract_abi
 
 from ..base import WorkflowValidationError
 
 # ENS contract addresses - https://legacy.ens.domains/name/ens.eth/subdomains
-ENS_REGISTRY_ADDRESS = web3.Web3.to_checksum_address("0x00000000000C2E074eC69A0dFb2997BA6C7d2e1e")
 ENS_PUBLIC_RESOLVER_ADDRESS = web3.Web3.to_checksum_address("0x231b0Ee14048e9dCcD1d247744d114a4EB5E8E63")
 ENS_REVERSE_REGISTRAR_ADDRESS = web3.Web3.to_checksum_address("0xa58E81fe9b61B5c3fE2AFD33CF304c454AbFc7Cb")
 
@@ -21,36 +19,10 @@ ENS_REGISTRAR_CONTROLLER_ADDRESS = web3.Web3.to_checksum_address("0x283af0b28c62
 
 curr_script_dir = os.path.dirname(os.path.abspath(__file__))
 
-with open(os.path.join(curr_script_dir, "./abis/ens_registry.abi.json"), 'r') as f:
-    ens_registry_abi_dict = json.load(f)
-
-def keccak_256(data):
-    k = sha3.keccak_256()
-    k.update(data)
-    return k.hexdigest()
-
-def to_unicode(name):
-    try:
-        return encode(name, uts46=True, transitional=False, std3_rules=True).decode('utf-8')
-    except IDNAError as e:
-        return name
-
-def get_node_namehash(domain):
-    # namehash
-    node = bytes.fromhex("00" * 32)
-    name = to_unicode(domain)
-    if name:
-        labels = name.split(".")
-
-        for label in reversed(labels):
-            label_sha = bytes.fromhex(keccak_256(label.encode()))
-            node_sha = keccak_256(node + label_sha)
-            node = bytes.fromhex(node_sha)
-
-    return "0x" + node.hex()
+ens_registry_abi = get_contract_abi(__file__, "./abis/ens_registry.abi.json")
 
 def instantiate_ens_registry_contract(web3_provider: web3.Web3):
-    return web3_provider.eth.contract(address=web3.Web3.to_checksum_address(ENS_REGISTRY_ADDRESS), abi=ens_registry_abi_dict)
+    return get_contract(web3_provider, ENS_REGISTRY_ADDRESS, ens_registry_abi)
 
 def is_domain_registered(web3_provider: web3.Web3, domain) -> bool:    
     node = get_node_namehash(domain)
@@ -76,12 +48,12 @@ def ens_update_common_pre_workflow_validation(web3_provider, domain, wallet_addr
 
 def get_ens_resolver_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=ENS_PUBLIC_RESOLVER_ADDRESS, abi=load_contract_abi(__file__, "./abis/ens_resolver.abi.json"))
+    return get_contract(web3_provider, ENS_PUBLIC_RESOLVER_ADDRESS, get_contract_abi(__file__, "./abis/ens_resolver.abi.json"))
 
 def get_ens_reverse_registrar_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=ENS_REVERSE_REGISTRAR_ADDRESS, abi=load_contract_abi(__file__, "./abis/ens_reverse_registrar.abi.json"))
+    return get_contract(web3_provider, ENS_REVERSE_REGISTRAR_ADDRESS, get_contract_abi(__file__, "./abis/ens_reverse_registrar.abi.json"))
 
 def get_ens_registrar_controller_contract():
     web3_provider = context.get_web3_provider()
-    return web3_provider.eth.contract(address=ENS_REGISTRAR_CONTROLLER_ADDRESS, abi=load_contract_abi(__file__, "./abis/ens_registrar_controller.abi.json"))
+    return get_contract(web3_provider, ENS_REGISTRAR_CONTROLLER_ADDRESS, get_contract_abi(__file__, "./abis/ens_registrar_controller.abi.json"))
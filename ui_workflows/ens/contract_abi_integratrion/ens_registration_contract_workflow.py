@@ -5,8 +5,9 @@ from dataclasses import dataclass, asdict
 
 from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 
+from integrations import ens_resolver
 from utils import hexify_token_amount
-from ...base import BaseMultiStepContractWorkflow, WorkflowStepClientPayload, ContractStepProcessingResult, RunnableStep, WorkflowValidationError
+from ...base import BaseMultiStepContractWorkflow, WorkflowStepClientPayload, ContractStepProcessingResult, RunnableStep, WorkflowValidationError, MultiStepResult
 from database.models import (
     db_session, MultiStepWorkflow, WorkflowStep, WorkflowStepStatus, WorkflowStepUserActionType, ChatMessage, ChatSession, SystemConfig
 )
@@ -35,6 +36,13 @@ class ENSRegistrationContractWorkflow(BaseMultiStepContractWorkflow):
         
         super().__init__(wallet_chain_id, wallet_address, chat_message_id, self.WORKFLOW_TYPE, multistep_workflow, workflow_params, curr_step_client_payload, steps, final_step_type)
 
+    def run(self) -> MultiStepResult:
+        result = super().run()
+        if result.status == 'terminated' and result.is_final_step and self.curr_step.status == WorkflowStepStatus.success:
+            # the name is registered now, so drop its resolution cached while it was not
+            ens_resolver.invalidate(self.web3_provider, name=self.domain)
+        return result
+
     def _general_workflow_validation(self):
         # Check if domain is registered
         if (is_domain_registered(self.web3_provider, self.domain)):
@@ -33,7 +33,8 @@ class ENSSetPrimaryNameWorkflow(BaseSingleStepContractWorkflow):
             'to': reverse_registrar.address, 
             'data': tx_input,
         }
-        
+
+        # the cached primary name of the wallet is dropped by the server once the tx succeeds
         return Result(
                 status="success", 
                 tx=tx,
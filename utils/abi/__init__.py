@@ -1 +1,2 @@
-from .abi_loader import *
\ No newline at end of file
+from .abi_loader import *
+from .contract_factory import ContractABI, CachedABIContract, get_contract_abi, get_contract
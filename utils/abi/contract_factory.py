@@ -0,0 +1,82 @@
+import functools
+import json
+import os
+import threading
+import weakref
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from eth_utils import combomethod, encode_hex, function_abi_to_4byte_selector
+from web3 import Web3
+from web3._utils.contracts import encode_abi
+from web3.contract import Contract
+
+
+class ContractABI:
+    """ABI of a contract, parsed once with its function selectors precomputed."""
+
+    def __init__(self, abi: List[Dict]) -> None:
+        self.abi = abi
+        # function name -> (function abi, selector), for the names that are not overloaded
+        self.functions: Dict[str, Tuple[Dict, str]] = {}
+        # selector -> function abi
+        self.selectors: Dict[str, Dict] = {}
+        function_abis = [item for item in abi if item.get('type') == 'function']
+        name_counts = Counter(item['name'] for item in function_abis)
+        for item in function_abis:
+            selector = encode_hex(function_abi_to_4byte_selector(item))
+            self.selectors[selector] = item
+            if name_counts[item['name']] == 1:
+                self.functions[item['name']] = (item, selector)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_contract_abi(abi_abs_path: str) -> ContractABI:
+    with open(abi_abs_path, 'r') as f:
+        return ContractABI(json.load(f))
+
+
+def get_contract_abi(module_file_path: str, abi_relative_path: str) -> ContractABI:
+    """Return the parsed ABI at a path relative to a module, read from disk only once."""
+    abi_abs_path = os.path.join(os.path.dirname(os.path.abspath(module_file_path)), abi_relative_path)
+    return _get_contract_abi(os.path.normpath(abi_abs_path))
+
+
+class CachedABIContract(Contract):
+    """Contract encoding calldata with the precomputed function table of its ContractABI.
+
+    The stock encodeABI matches the function name and arguments against the
+    whole ABI and hashes the signature on every call.
+
+    """
+
+    contract_abi: Optional[ContractABI] = None
+
+    @combomethod
+    def encodeABI(cls, fn_name: str, args: Optional[Any] = None, kwargs: Optional[Any] = None, data: Optional[str] = None) -> str:
+        function = cls.contract_abi.functions.get(fn_name) if not kwargs else None
+        if function is None:
+            # overloaded, or called with keyword arguments, so needs the matching of web3
+            return super(CachedABIContract, cls).encodeABI(fn_name, args=args, kwargs=kwargs, data=data)
+        fn_abi, selector = function
+        return encode_abi(cls.w3, fn_abi, args or [], data or selector)
+
+
+_contracts: 'weakref.WeakKeyDictionary[Web3, Dict[Tuple[str, ContractABI], CachedABIContract]]' = weakref.WeakKeyDictionary()
+_contracts_lock = threading.Lock()
+
+
+def get_contract(web3_provider: Web3, address: str, contract_abi: ContractABI) -> CachedABIContract:
+    """Return the contract at an address, shared by all callers of the same Web3 instance."""
+    key = (address, contract_abi)
+    with _contracts_lock:
+        contracts = _contracts.setdefault(web3_provider, {})
+        contract = contracts.get(key)
+        if contract is None:
+            contract = contracts[key] = web3_provider.eth.contract(
+                address=address,
+                abi=contract_abi.abi,
+                ContractFactoryClass=CachedABIContract,
+                contract_abi=contract_abi,
+            )
+    return contract
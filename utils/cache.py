@@ -0,0 +1,61 @@
+"""
+In-process LRU cache with expiry, shared by the caches in this codebase.
+"""
+import collections
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+import utils.metrics as metrics
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds.
+
+    Hits and misses are counted in metrics under the cache name.
+
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl  # None to never expire
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict = collections.OrderedDict()  # key -> (expiry, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expiry, value = entry
+                if expiry is None or expiry > time.time():
+                    self._entries.move_to_end(key)
+                    metrics.incr('cache.hits', cache=self.name)
+                    return value
+                del self._entries[key]
+        metrics.incr('cache.misses', cache=self.name)
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store value, with ttl overriding the default expiry of the cache if set."""
+        ttl = ttl if ttl is not None else self.ttl
+        expiry = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expiry, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1 +1,2 @@
-from .coingecko_coin_currency import *
\ No newline at end of file
+from .coingecko_coin_currency import *
+from .coin_index import CoinIndex, get_coin_index
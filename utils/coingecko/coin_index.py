@@ -0,0 +1,129 @@
+"""
+Lookup index for the CoinGecko coin list.
+
+Coins are matched, case-insensitively, on their id, symbol or name. Many
+symbols and names are shared by several coins (bridged versions, forks,
+copycats), so matches are ranked by market cap rank when known, from
+coin_ranks.json (see scripts/update_coingecko_ranks.py), and by their order
+in the coin list otherwise. There are also prefix and fuzzy lookups, to
+suggest coins for a query that has no exact match, e.g. a typo.
+"""
+from typing import Dict, Iterable, List, Optional
+import bisect
+import difflib
+import json
+import os
+import re
+import threading
+
+from .coingecko_coin_currency import get_coin_list
+
+
+COIN_RANKS_PATH = os.path.join(os.path.dirname(__file__), "coin_ranks.json")
+
+RE_WORD = re.compile(r"[\w.$-]+")
+
+# common words in queries that happen to be the symbol or name of some coin
+STOP_WORDS = frozenset([
+    'a', 'all', 'and', 'at', 'for', 'get', 'in', 'is', 'it', 'me', 'my', 'now', 'of', 'on',
+    'price', 'the', 'to', 'today', 'what', 'worth',
+])
+
+
+class CoinIndex:
+    """Exact, prefix and fuzzy lookups of coins by id, symbol or name."""
+
+    def __init__(self, coins: List[Dict], ranks: Optional[Dict[str, int]] = None) -> None:
+        ranks = ranks or {}
+        # coins with a market cap rank first, then the others in their order in the list
+        order = sorted(range(len(coins)), key=lambda i: (ranks.get(coins[i]['id'], len(coins)), i))
+        self.coins = [coins[i] for i in order]
+        self._rank = {id(coin): rank for rank, coin in enumerate(self.coins)}
+
+        self.by_id: Dict[str, Dict] = {}
+        self.by_symbol: Dict[str, List[Dict]] = {}
+        self.by_name: Dict[str, List[Dict]] = {}
+        self._by_key: Dict[str, List[Dict]] = {}  # matches on any of id, symbol or name
+        for coin in self.coins:
+            id_key = coin['id'].lower()
+            symbol_key = coin['symbol'].lower()
+            name_key = coin['name'].lower()
+            self.by_id.setdefault(id_key, coin)
+            self.by_symbol.setdefault(symbol_key, []).append(coin)
+            self.by_name.setdefault(name_key, []).append(coin)
+            for key in {id_key, symbol_key, name_key}:
+                self._by_key.setdefault(key, []).append(coin)
+        self._sorted_keys = sorted(self._by_key)
+
+    def lookup(self, query: str) -> List[Dict]:
+        """Return the coins with an id, symbol or name equal to the query, best ranked first."""
+        return self._by_key.get(query.strip().lower(), [])
+
+    def resolve(self, query: str) -> Optional[Dict]:
+        """Return the best ranked coin with an id, symbol or name equal to the query."""
+        coins = self.lookup(query)
+        return coins[0] if coins else None
+
+    def prefix(self, query: str, limit: int = 10) -> List[Dict]:
+        """Return coins with an id, symbol or name starting with the query, best ranked first."""
+        query = query.strip().lower()
+        if not query:
+            return []
+        keys = []
+        i = bisect.bisect_left(self._sorted_keys, query)
+        while i < len(self._sorted_keys) and self._sorted_keys[i].startswith(query):
+            keys.append(self._sorted_keys[i])
+            i += 1
+        return self._ranked(keys, limit)
+
+    def fuzzy(self, query: str, limit: int = 3, cutoff: float = 0.8) -> List[Dict]:
+        """Return coins with an id, symbol or name close to the query, e.g. for a misspelling."""
+        query = query.strip().lower()
+        if not query:
+            return []
+        keys = difflib.get_close_matches(query, self._sorted_keys, n=limit, cutoff=cutoff)
+        return self._ranked(keys, limit)
+
+    def find_in_text(self, text: str, limit: int = 3) -> List[Dict]:
+        """Return coins mentioned in a text by id, symbol or name, of up to three words."""
+        words = RE_WORD.findall(text.lower())
+        keys = []
+        matched = [False] * len(words)  # words that are part of a longer mention
+        for n in (3, 2, 1):
+            for i in range(len(words) - n + 1):
+                key = ' '.join(words[i:i + n])
+                if key in self._by_key and key not in STOP_WORDS and not any(matched[i:i + n]):
+                    keys.append(key)
+                    matched[i:i + n] = [True] * n
+        coins = []
+        for key in keys:
+            # take the best match for each mention, before any ambiguous alternatives
+            coin = self._by_key[key][0]
+            if coin not in coins:
+                coins.append(coin)
+        return coins[:limit]
+
+    def _ranked(self, keys: Iterable[str], limit: int) -> List[Dict]:
+        coins = {id(coin): coin for key in keys for coin in self._by_key[key]}
+        return sorted(coins.values(), key=lambda coin: self._rank[id(coin)])[:limit]
+
+
+def load_ranks(path: str = COIN_RANKS_PATH) -> Dict[str, int]:
+    """Load the market cap rank of coins by id, if they have been downloaded."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding="utf8") as f:
+        return json.load(f)
+
+
+_coin_index: Optional[CoinIndex] = None
+_coin_index_lock = threading.Lock()
+
+
+def get_coin_index() -> CoinIndex:
+    """Return the index of the CoinGecko coin list, built on first use."""
+    global _coin_index
+    with _coin_index_lock:
+        if _coin_index is None:
+            _coin_index = CoinIndex(get_coin_list(), load_ranks())
+        return _coin_index
@@ -1,10 +1,24 @@
 import os
 import json 
 
+from ..reference_data import ReferenceData
+
 coingecko_api_url_prefix = "https://api.coingecko.com/api/v3/simple/price"
 
-with open(os.path.join(os.path.dirname(__file__), "./coin_list.json"), 'r', encoding="utf8") as f:
-  coin_list = json.load(f)
 
-with open(os.path.join(os.path.dirname(__file__), "./currency_list.json"), 'r', encoding="utf8") as f:
-  currency_list = json.load(f)
\ No newline at end of file
+def _load_json(path):
+  with open(path, 'r', encoding="utf8") as f:
+    return json.load(f)
+
+
+# plain JSON, as fast to parse as any cache of it
+_coin_list = ReferenceData('coin_list', [os.path.join(os.path.dirname(__file__), "./coin_list.json")], _load_json, cache=False)
+_currency_list = ReferenceData('currency_list', [os.path.join(os.path.dirname(__file__), "./currency_list.json")], _load_json, cache=False)
+
+
+def get_coin_list():
+  return _coin_list.get()
+
+
+def get_currency_list():
+  return _currency_list.get()
@@ -2,17 +2,19 @@ import inspect
 import os
 import json
 import yaml
+from typing import Dict, List, Optional
 
 from web3 import Web3
 import tiktoken
 from langchain.llms import OpenAI
-from ens import ENS
 import functools
+import threading
 import traceback
 import context
 
-from .constants import OPENAI_API_KEY, TENDERLY_FORK_URL, CHAIN_ID_TO_NETWORK_NAME, USE_CLIENT_TO_ESTIMATE_GAS
+from .constants import OPENAI_API_KEY, TENDERLY_FORK_URL, CHAIN_ID_TO_NETWORK_NAME, USE_CLIENT_TO_ESTIMATE_GAS, USER_INFO_CACHE_TTL, USER_INFO_CACHE_STALE_TTL
 from .evaluation import get_dummy_user_info
+from .reference_data import ReferenceData
 
 DEFAULT_USER_INFO = {
     "Wallet Address": None,
@@ -107,12 +109,22 @@ def widgets_yaml2formats(file_path):
 
 
 yaml_file_path = f"{os.getcwd()}/knowledge_base/widgets.yaml"
-WIDGETS, FUNCTIONS = widgets_yaml2formats(yaml_file_path)
+_widgets = ReferenceData('widgets', [yaml_file_path], widgets_yaml2formats)
+
+
+def get_widgets() -> str:
+    """Widget docs, separated by '---'."""
+    return _widgets.get()[0]
+
+
+def get_functions() -> List[Dict]:
+    """Widget function definitions, for function calling."""
+    return _widgets.get()[1]
 
 
 def widget_subset(widget_names):
     filtered_widgets = []
-    for widget_doc in WIDGETS.split('---\n'):
+    for widget_doc in get_widgets().split('---\n'):
         widget_name = widget_doc.split('(')[0].split('<|')[1].replace('-', '_').strip()
         if widget_name in widget_names:
             filtered_widgets.append(widget_doc)
@@ -124,7 +136,10 @@ def set_api_key():
     OpenAI.api_key = OPENAI_API_KEY
 
 
-tokenizer = tiktoken.encoding_for_model("text-davinci-003")
+@functools.lru_cache(maxsize=1)
+def get_tokenizer() -> tiktoken.Encoding:
+    # loading the encoding may download it, so it is done on first use
+    return tiktoken.encoding_for_model("text-davinci-003")
 
 def estimate_gas(tx):
     if USE_CLIENT_TO_ESTIMATE_GAS:
@@ -133,7 +148,7 @@ def estimate_gas(tx):
     return hex(context.get_web3_provider().eth.estimate_gas(tx))
 
 def get_token_len(s: str) -> int:
-    return len(tokenizer.encode(s))
+    return len(get_tokenizer().encode(s))
 
 # Error handling
 class ConnectedWalletRequired(Exception):
@@ -194,27 +209,68 @@ def ensure_wallet_connected(fn):
     return wrapped_fn
 
 
-def get_real_user_info(user_info: dict) -> dict:
-    try:
-        user_info["Wallet Address"] = context.get_wallet_address()
+_user_info_cache = None
+_user_info_cache_lock = threading.Lock()
 
-        web3 = context.get_web3_provider()
-        ns = ENS.from_web3(web3)
-        user_info["ENS Domain"] = ns.name(user_info["Wallet Address"])
 
+def _get_user_info_cache():
+    global _user_info_cache
+    with _user_info_cache_lock:
+        if _user_info_cache is None:
+            # imported here, as it imports from utils in turn
+            from integrations.cache import IntegrationCache
+            _user_info_cache = IntegrationCache('user_info', ttl=USER_INFO_CACHE_TTL, stale_ttl=USER_INFO_CACHE_STALE_TTL)
+        return _user_info_cache
+
+
+def _fetch_user_info(web3: Web3, wallet_address: str, chain_id: Optional[int]) -> dict:
+    # runs in the background on refreshes, so takes everything it needs from the request context as arguments
+    user_info = dict(DEFAULT_USER_INFO)
+    user_info["Wallet Address"] = wallet_address
+    # imported here, as it imports from utils in turn
+    import integrations.ens_resolver as ens_resolver
+    user_info["ENS Domain"] = ens_resolver.resolve_name(web3, wallet_address)
+    if chain_id in CHAIN_ID_TO_NETWORK_NAME: user_info["Network"] = CHAIN_ID_TO_NETWORK_NAME[chain_id]
+    return user_info
+
+
+def get_real_user_info(user_info: dict) -> dict:
+    try:
+        wallet_address = context.get_wallet_address()
+        if not wallet_address:
+            return dict(user_info)
         chain_id = context.get_wallet_chain_id()
-        if chain_id in CHAIN_ID_TO_NETWORK_NAME: user_info["Network"] = CHAIN_ID_TO_NETWORK_NAME[chain_id]
-        return user_info
+        web3 = context.get_web3_provider()
+        key = _get_user_info_key(web3, wallet_address, chain_id)
+        return _get_user_info_cache().get(key, lambda: _fetch_user_info(web3, wallet_address, chain_id))
     except Exception as e:
         traceback.print_exc()
         return DEFAULT_USER_INFO
 
+
+def _get_user_info_key(web3: Web3, wallet_address: str, chain_id: Optional[int]) -> str:
+    return f'{wallet_address.lower()}:{chain_id}:{web3.provider.endpoint_uri}'
+
+
+def invalidate_user_info() -> None:
+    """Drop the cached user info of the wallet of the request context, e.g. after a transaction changed its ENS name."""
+    wallet_address = context.get_wallet_address()
+    if wallet_address:
+        key = _get_user_info_key(context.get_web3_provider(), wallet_address, context.get_wallet_chain_id())
+        _get_user_info_cache().invalidate(key)
+
+
+def prefetch_user_info(wallet_address: str, wallet_chain_id: Optional[int], fork_id: Optional[str]) -> None:
+    """Resolve the user info of a wallet into the cache, ahead of its chat turns on that chain or fork."""
+    with context.with_request_context(wallet_address, None, wallet_chain_id=wallet_chain_id, fork_id=fork_id):
+        get_real_user_info(DEFAULT_USER_INFO)
+
 DUMMY_WALLET_ADDRESS = "0x4eD15A17A9CDF3hc7D6E829428267CaD67d95F8F"
 DUMMY_ENS_DOMAIN = "cacti1729.eth"
 DUMMY_NETWORK = "ethereum-mainnet"
 
 def get_user_info(eval : bool = False) -> str:
-    user_info = DEFAULT_USER_INFO
+    user_info = dict(DEFAULT_USER_INFO)
     user_info_str = ""
     if eval:
         user_info = get_dummy_user_info(user_info)
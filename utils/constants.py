@@ -11,16 +11,62 @@ SERVER_SECRET_KEY=os.environ['SERVER_SECRET_KEY']
 # Let FE/Wallet handle gas estimation as it would be more up-to-date, default is true
 USE_CLIENT_TO_ESTIMATE_GAS = os.environ.get('USE_FRONTEND_TO_ESTIMATE_GAS', 'true').lower() == 'true'
 
+# Process chat turns on the event loop (async db + async llm client), set to false
+# to fall back to running every message in a worker thread
+ASYNC_CHAT_PIPELINE = os.environ.get('ASYNC_CHAT_PIPELINE', 'true').lower() == 'true'
+
+# Admission control for chat turns per worker process, turns over the concurrency
+# limit are queued (round-robin across users), and rejected once the queue is full
+CHAT_MAX_CONCURRENT_TURNS = int(os.environ.get('CHAT_MAX_CONCURRENT_TURNS', '32'))
+CHAT_MAX_QUEUED_TURNS = int(os.environ.get('CHAT_MAX_QUEUED_TURNS', '64'))
+
+# Bearer token required to read /metrics, which is not served when unset
+METRICS_API_KEY = os.environ.get('METRICS_API_KEY', None)
+
+# Coalesce streamed tokens into one websocket frame per time window (ms) or size
+# limit (bytes), whichever comes first, disabled when the window is 0
+STREAM_COALESCE_MS = float(os.environ.get('STREAM_COALESCE_MS', '0'))
+STREAM_COALESCE_BYTES = int(os.environ.get('STREAM_COALESCE_BYTES', '1024'))
+
+# Max number of widget fetch commands evaluated concurrently per worker process
+WIDGET_COMMAND_CONCURRENCY = int(os.environ.get('WIDGET_COMMAND_CONCURRENCY', '8'))
+
 ### Storage ###
 
 WEAVIATE_URL = os.environ['WEAVIATE_URL']
 WEAVIATE_API_KEY = os.environ['WEAVIATE_API_KEY']
 
+# Query embeddings shared by the retrieval indexes, cached in memory and
+# optionally on disk in a directory to survive restarts (disabled when unset)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '10000'))
+QUERY_EMBEDDING_CACHE_TTL = float(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', '86400'))
+QUERY_EMBEDDING_CACHE_DIR = os.environ.get('QUERY_EMBEDDING_CACHE_DIR', None)
+
+# Parsed reference data bundled with the repo (widget definitions), saved as
+# JSON to this directory to skip parsing on startup (disabled when unset).
+# The directory must be private to the user running the server (mode 0700)
+REFERENCE_DATA_CACHE_DIR = os.environ.get('REFERENCE_DATA_CACHE_DIR', None)
+
 CHATDB_URL = os.environ['CHATDB_URL']
 
 # Scrape DB is optional
 SCRAPEDB_URL = os.environ.get('SCRAPEDB_URL', None)
 
+# Optional second tier for the integration response caches, shared across
+# workers: a redis:// url (needs the redis package), or a directory for a local disk tier
+INTEGRATION_CACHE_URL = os.environ.get('INTEGRATION_CACHE_URL', None)
+
+# User info block (wallet address, ENS name, network) of the system prompt, cached per
+# wallet: fresh for the TTL, then refreshed in the background until the stale TTL
+USER_INFO_CACHE_TTL = float(os.environ.get('USER_INFO_CACHE_TTL', '300'))
+USER_INFO_CACHE_STALE_TTL = float(os.environ.get('USER_INFO_CACHE_STALE_TTL', '3600'))
+
+# ENS resolutions, in both directions: fresh for the TTL, then refreshed in the background
+# until the stale TTL; names and addresses that do not resolve are kept for the negative TTL
+ENS_CACHE_TTL = float(os.environ.get('ENS_CACHE_TTL', '300'))
+ENS_CACHE_STALE_TTL = float(os.environ.get('ENS_CACHE_STALE_TTL', '3600'))
+ENS_NEGATIVE_CACHE_TTL = float(os.environ.get('ENS_NEGATIVE_CACHE_TTL', '60'))
+
 ### Tenderly ###
 
 TENDERLY_FORK_BASE_URL = "https://rpc.tenderly.co/fork"
@@ -47,6 +93,24 @@ CENTER_API_KEY = os.getenv('CENTER_API_KEY', None)
 ETHERSCAN_API_KEY = os.getenv('ETHERSCAN_API_KEY', None)
 ALCHEMY_API_KEY =  os.getenv('ALCHEMY_API_KEY', None)
 
+# Threads fetching pages of the NFT APIs ahead of the results being streamed
+PAGINATOR_CONCURRENCY = int(os.environ.get('PAGINATOR_CONCURRENCY', '16'))
+
+# Shared HTTP client for the external services: timeouts in seconds, retries of
+# idempotent requests, and keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '32'))
+# Requests in flight per service, to stay within its rate limits
+HTTP_MAX_CONCURRENCY_PER_UPSTREAM = int(os.environ.get('HTTP_MAX_CONCURRENCY_PER_UPSTREAM', '8'))
+# Requests in flight per JSON-RPC node, which every chain widget and the ENS
+# lookups go through, so it gets a higher bound of its own
+RPC_MAX_CONCURRENCY = int(os.environ.get('RPC_MAX_CONCURRENCY', '32'))
+# Consecutive failures after which requests to a service fail fast, for a cooldown in seconds
+HTTP_CIRCUIT_FAILURES = int(os.environ.get('HTTP_CIRCUIT_FAILURES', '5'))
+HTTP_CIRCUIT_COOLDOWN = float(os.environ.get('HTTP_CIRCUIT_COOLDOWN', '30'))
+
 ### Widget Vector Index/Store ###
 
 # max num tokens for widgets info in model's input
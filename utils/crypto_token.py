@@ -1,8 +1,9 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from web3 import Web3
 
-from .abi import ERC20_ABI
+from .abi import ERC20_ABI, MULTICALL3_ABI
+from .cache import LRUCache
 
 # Always ensure decimals is set correctly for any token by checking the contract
 MAINNET_TOKEN_TO_PROFILE_MAP = {
@@ -48,6 +49,12 @@ MAINNET_TOKEN_TO_PROFILE_MAP = {
     },
 }
 
+# Multicall3 has the same address on mainnet and its forks, see https://www.multicall3.com
+MULTICALL3_ADDRESS = Web3.to_checksum_address("0xcA11bde05977b3631167028862bE2a173976CA11")
+
+# cached for about a block, rather than keyed by block, which would take a round trip for the block number first
+_portfolio_balances_cache = LRUCache('portfolio_balances', maxsize=1000, ttl=12)
+
 def parse_token_amount(chain_id: int, token: str, amount: str) -> int:
     if chain_id == 1:
         return _mainnet_parse_token_amount(token, amount)
@@ -63,6 +70,30 @@ def get_token_balance(web3_provider: Web3, chain_id: int, token: str, wallet_add
     else:
         raise Exception(f"Chain ID {chain_id} not supported by system")
     
+def get_portfolio_balances(web3_provider: Web3, chain_id: int, wallet_address: str, tokens: Optional[List[str]] = None) -> Dict[str, Optional[int]]:
+    """Return the balances of a wallet for tokens, all supported ones by default, at the latest block.
+
+    The balances of all supported tokens are read with a single Multicall3
+    aggregate3 call, and cached for about a block, or until
+    invalidate_portfolio_balances. The balance of a token whose call failed
+    is None.
+
+    """
+    if chain_id == 1:
+        return _mainnet_portfolio_balances(web3_provider, wallet_address, tokens)
+    else:
+        raise Exception(f"Chain ID {chain_id} not supported by system")
+
+def invalidate_portfolio_balances(web3_provider: Web3, wallet_address: str) -> None:
+    """Drop the cached balances of a wallet, e.g. after a transaction changed them."""
+    _portfolio_balances_cache.invalidate(_get_portfolio_balances_key(web3_provider, Web3.to_checksum_address(wallet_address)))
+
+def _get_portfolio_balances_key(web3_provider: Web3, wallet_address: str) -> Tuple[str, str]:
+    return (web3_provider.provider.endpoint_uri, wallet_address)
+
+def format_portfolio_balances(chain_id: int, balances: Dict[str, Optional[int]]) -> Dict[str, str]:
+    return {token: format_token_balance(chain_id, token, amount) for token, amount in balances.items() if amount is not None}
+
 def format_token_balance(chain_id: int, token: str, amount: int) -> str:
     if chain_id == 1:
         decimals = _mainnet_get_token_profile(token)["decimals"]
@@ -103,6 +134,40 @@ def _mainnet_token_balance(web3_provider: Web3, token: str, wallet_address: str)
         erc20_contract = web3_provider.eth.contract(address=_mainnet_get_token_address(token), abi=ERC20_ABI)
         return erc20_contract.functions.balanceOf(wallet_address).call()
 
+def _mainnet_portfolio_balances(web3_provider: Web3, wallet_address: str, tokens: Optional[List[str]]) -> Dict[str, Optional[int]]:
+    tokens = list(tokens) if tokens is not None else list(MAINNET_TOKEN_TO_PROFILE_MAP)
+    if Web3.is_address(wallet_address):
+        wallet_address = Web3.to_checksum_address(wallet_address)
+    else:
+        import integrations.ens_resolver as ens_resolver  # imports from utils in turn
+        resolved_address = ens_resolver.resolve_address(web3_provider, wallet_address)
+        if resolved_address is None:
+            raise Exception(f"Could not resolve {wallet_address}")
+        wallet_address = resolved_address
+
+    for token in tokens:
+        _mainnet_get_token_profile(token)  # raises for unsupported tokens
+
+    # the balances of all supported tokens cost the same round trip, and serve any tokens asked for later
+    key = _get_portfolio_balances_key(web3_provider, wallet_address)
+    balances = _portfolio_balances_cache.get(key)
+    if balances is None:
+        all_tokens = list(MAINNET_TOKEN_TO_PROFILE_MAP)
+        multicall_contract = web3_provider.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+        balance_of_data = web3_provider.eth.contract(abi=ERC20_ABI).encodeABI(fn_name="balanceOf", args=[wallet_address])
+        calls = []
+        for token in all_tokens:
+            if token == "ETH":
+                calls.append((MULTICALL3_ADDRESS, True, multicall_contract.encodeABI(fn_name="getEthBalance", args=[wallet_address])))
+            else:
+                calls.append((_mainnet_get_token_address(token), True, balance_of_data))
+        results = multicall_contract.functions.aggregate3(calls).call()
+        balances = {}
+        for token, (success, return_data) in zip(all_tokens, results):
+            balances[token] = web3_provider.codec.decode(["uint256"], return_data)[0] if success and len(return_data) == 32 else None
+        _portfolio_balances_cache.set(key, balances)
+    return {token: balances[token] for token in tokens}
+
 def _mainnet_get_token_profile(token: str) -> Dict:
     if token not in MAINNET_TOKEN_TO_PROFILE_MAP:
         raise Exception(f"Token {token} not supported by system")
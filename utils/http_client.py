@@ -0,0 +1,168 @@
+"""
+Shared HTTP client for the external services used by the integrations.
+
+Requests go through one session per process, which keeps a pool of
+keep-alive connections per host, with default connect and read timeouts.
+Idempotent requests are retried with exponential backoff on connection
+errors, timeouts and retryable statuses (429 and 5xx), honoring Retry-After.
+
+Each upstream (the host, by default) has a bound on the requests in flight
+to it, to stay within its rate limits, and a circuit breaker: after
+consecutive failed calls (once retries are exhausted), requests to it fail
+fast with CircuitOpenError for a cooldown, after which a single request is
+let through to probe it. Latency, errors, retries and rejected requests
+are recorded in metrics per upstream.
+"""
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import utils.metrics as metrics
+from .constants import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_POOL_SIZE,
+    HTTP_MAX_CONCURRENCY_PER_UPSTREAM, HTTP_CIRCUIT_FAILURES, HTTP_CIRCUIT_COOLDOWN,
+)
+
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+class _Upstream:
+    """Circuit breaker and bound on the requests in flight for an upstream."""
+
+    def __init__(self, upstream: str, max_concurrency: int) -> None:
+        self.upstream = upstream
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    def before_request(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < HTTP_CIRCUIT_COOLDOWN:
+                metrics.incr('http_client.rejected', upstream=self.upstream)
+                raise CircuitOpenError(f'{self.upstream} is unavailable, please try again later.')
+            # half-open, let this request through to probe the upstream, and keep
+            # rejecting the others until it succeeds, or for another cooldown
+            self._opened_at = time.time()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= HTTP_CIRCUIT_FAILURES:
+                if self._opened_at is None:
+                    metrics.incr('http_client.circuit_opened', upstream=self.upstream)
+                self._opened_at = time.time()
+
+
+_upstreams: Dict[str, _Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+_session.mount('http://', _adapter)
+_session.mount('https://', _adapter)
+
+
+def _get_upstream(upstream: str, max_concurrency: Optional[int] = None) -> _Upstream:
+    with _upstreams_lock:
+        upstream_state = _upstreams.get(upstream)
+        if upstream_state is None:
+            upstream_state = _upstreams[upstream] = _Upstream(upstream, max_concurrency or HTTP_MAX_CONCURRENCY_PER_UPSTREAM)
+        return upstream_state
+
+
+def _get_retry_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    # exponential backoff with jitter, so that concurrent callers don't retry in lockstep
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+def request(
+        method: str,
+        url: str,
+        upstream: Optional[str] = None,
+        idempotent: Optional[bool] = None,
+        retries: int = HTTP_MAX_RETRIES,
+        max_concurrency: Optional[int] = None,
+        **kwargs: Any,
+) -> requests.Response:
+    """Send a request through the shared session.
+
+    Takes the arguments of requests.request. Requests are only retried if
+    idempotent, which defaults to whether the method is, so pass
+    idempotent=True for POST requests that are only queries. The response
+    of the last attempt is returned as is, so the caller still checks its
+    status. max_concurrency overrides HTTP_MAX_CONCURRENCY_PER_UPSTREAM for
+    the upstream, so pass the same value for all the requests to it.
+
+    """
+    upstream = upstream or urlparse(url).netloc
+    upstream_state = _get_upstream(upstream, max_concurrency)
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    max_attempts = retries + 1 if idempotent else 1
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+    upstream_state.before_request()
+    for attempt in range(max_attempts):
+        is_last_attempt = attempt == max_attempts - 1
+        try:
+            with upstream_state.semaphore:
+                # time the request only, not the wait for a free slot
+                start = time.time()
+                response = _session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics.observe('http_client.latency', time.time() - start, upstream=upstream)
+            metrics.incr('http_client.errors', upstream=upstream, error=type(e).__name__)
+            if is_last_attempt:
+                upstream_state.record_failure()
+                raise
+            delay = _get_retry_delay(attempt)
+        else:
+            metrics.observe('http_client.latency', time.time() - start, upstream=upstream)
+            if response.status_code >= 400:
+                metrics.incr('http_client.errors', upstream=upstream, error=str(response.status_code))
+            if is_last_attempt or response.status_code not in RETRY_STATUSES:
+                if response.status_code >= 500:
+                    upstream_state.record_failure()
+                else:
+                    upstream_state.record_success()
+                return response
+            delay = _get_retry_delay(attempt, response)
+        metrics.incr('http_client.retries', upstream=upstream)
+        time.sleep(delay)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def delete(url: str, **kwargs: Any) -> requests.Response:
+    return request('DELETE', url, **kwargs)
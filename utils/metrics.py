@@ -0,0 +1,87 @@
+"""
+In-process metrics, for counters, gauges and latency summaries.
+
+These are kept per worker process and exposed through the /metrics endpoint.
+"""
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+# number of recent samples kept per summary for percentiles
+SUMMARY_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_summaries: Dict[str, "_Summary"] = {}
+
+
+class _Summary:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=SUMMARY_WINDOW)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def to_dict(self) -> Dict:
+        recent = sorted(self.recent)
+        ret = dict(
+            count=self.count,
+            mean=self.total / self.count if self.count else 0.0,
+            max=self.max,
+        )
+        for p in (50, 90, 99):
+            ret[f'p{p}'] = recent[min(len(recent) - 1, len(recent) * p // 100)] if recent else 0.0
+        return ret
+
+
+def _key(name: str, labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}={v}' for k, v in sorted(labels.items())) + '}'
+
+
+def incr(name: str, value: float = 1, **labels: str) -> None:
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = _Summary()
+        summary.observe(value)
+
+
+def get_counter(name: str, **labels: str) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def snapshot() -> Dict:
+    with _lock:
+        return dict(
+            counters=dict(_counters),
+            gauges=dict(_gauges),
+            summaries={key: summary.to_dict() for key, summary in _summaries.items()},
+        )
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _summaries.clear()
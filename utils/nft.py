@@ -3,6 +3,7 @@ import context
 from typing import List, Dict
 from web3.exceptions import ContractLogicError
 from utils import web3_provider, ETH_MAINNET_CHAIN_ID
+import integrations.ens_resolver as ens_resolver
 
 SNEAKY_CHEETAH_CLUB_CONTRACT_ADDRESS = "0x4C3A2F61a4449667b7085734f24095c5f932b875"
 PUDGY_PENGUINS_CONTRACT_ADDRESS = "0xbd3531da5cf5857e7cfaa92426877b022e612cf8"
@@ -39,7 +40,7 @@ def dev_fetch_nfts_from_contract_by_owner(address_or_domain: str, chain_id: int)
 
     normalized_address = None
     if ".eth" in address_or_domain:
-        normalized_address = web3.ens.address(address_or_domain)
+        normalized_address = ens_resolver.resolve_address(web3, address_or_domain)
     else:
         normalized_address = address_or_domain
 
@@ -0,0 +1,105 @@
+"""
+Lazy loading of the reference data bundled with the repo.
+
+Reference data, like the coin list or the widget definitions, is parsed on
+first use instead of at import. If REFERENCE_DATA_CACHE_DIR is set, the
+parsed value is also saved there as JSON, keyed on a hash of the source files
+and of the module with the loading code, so that later processes load the JSON
+instead of parsing the sources again, until either of them changes. The cache
+is only used if the directory is private to the user running the process, so
+that other users can't plant the data we load.
+"""
+from typing import Callable, Generic, List, Optional, TypeVar
+import glob
+import hashlib
+import inspect
+import json
+import os
+import stat
+import threading
+import traceback
+
+from .constants import REFERENCE_DATA_CACHE_DIR
+
+
+T = TypeVar('T')
+
+_NOT_LOADED = object()
+
+
+class ReferenceData(Generic[T]):
+    """Value parsed from source files by load(*paths), on first use of get().
+
+    The value must be JSON serializable to be cached (tuples come back as
+    lists). Pass cache=False for sources that are as fast to parse as the
+    cache, e.g. plain JSON files.
+    """
+
+    def __init__(self, name: str, paths: List[str], load: Callable[..., T], cache: bool = True) -> None:
+        self.name = name
+        self.paths = paths
+        self.load = load
+        self.cache = cache
+        self._value = _NOT_LOADED
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        if self._value is _NOT_LOADED:
+            with self._lock:
+                if self._value is _NOT_LOADED:
+                    self._value = self._load()
+        return self._value
+
+    def _load(self) -> T:
+        cache_path = self._get_cache_path()
+        if cache_path is not None:
+            try:
+                with open(cache_path, 'r', encoding='utf8') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                # corrupt cache file, parse the sources again
+                traceback.print_exc()
+        value = self.load(*self.paths)
+        if cache_path is not None:
+            self._save(cache_path, value)
+        return value
+
+    def _get_cache_path(self) -> Optional[str]:
+        if not self.cache or not REFERENCE_DATA_CACHE_DIR or not _ensure_private_dir(REFERENCE_DATA_CACHE_DIR):
+            return None
+        h = hashlib.sha256()
+        for path in self.paths + [inspect.getfile(self.load)]:
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        return os.path.join(REFERENCE_DATA_CACHE_DIR, f'{self.name}-{h.hexdigest()[:16]}.json')
+
+    def _save(self, cache_path: str, value: T) -> None:
+        try:
+            tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, cache_path)
+            # remove the files of previous versions of the sources
+            for stale_path in glob.glob(os.path.join(os.path.dirname(cache_path), f'{self.name}-*.json')):
+                if stale_path != cache_path:
+                    os.remove(stale_path)
+        except (OSError, TypeError, ValueError):
+            # the cache is an optimization, e.g. the directory may be read-only
+            # or the value may not be JSON serializable
+            traceback.print_exc()
+
+
+def _ensure_private_dir(path: str) -> bool:
+    """Create the directory if missing, and check only the current user can write to it."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        traceback.print_exc()
+        return False
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        print(f'Not using reference data cache {path}, it must be a directory private to the current user (mode 0700)')
+        return False
+    return True
@@ -1,7 +1,18 @@
+import itertools
+import json
+import threading
+from typing import Any, List, Tuple
+from urllib.parse import urlparse
+
 from web3 import Web3
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.contract.contract import ContractFunction
 import env
 
-from .constants import TENDERLY_FORK_BASE_URL, TENDERLY_FORK_URL, TENDERLY_DEFAULT_MAINNET_FORK_ID, ETH_MAINNET_RPC_URL, ETH_MAINNET_CHAIN_ID
+import utils.http_client as http_client
+from .cache import LRUCache
+from .constants import TENDERLY_FORK_BASE_URL, TENDERLY_FORK_URL, TENDERLY_DEFAULT_MAINNET_FORK_ID, ETH_MAINNET_RPC_URL, ETH_MAINNET_CHAIN_ID, RPC_MAX_CONCURRENCY
 
 CHAIN_ID_TO_PROD_RPC_URL = {
     ETH_MAINNET_CHAIN_ID: ETH_MAINNET_RPC_URL
@@ -15,6 +26,126 @@ CHAIN_ID_TO_TEST_DEFAULT_FORK_ID = {
     ETH_MAINNET_CHAIN_ID: TENDERLY_DEFAULT_MAINNET_FORK_ID
 }
 
+# JSON-RPC methods that only read state, and so can be retried
+READ_METHODS = frozenset([
+    'eth_blockNumber', 'eth_call', 'eth_chainId', 'eth_estimateGas', 'eth_feeHistory', 'eth_gasPrice',
+    'eth_getBalance', 'eth_getBlockByHash', 'eth_getBlockByNumber', 'eth_getCode', 'eth_getLogs',
+    'eth_getStorageAt', 'eth_getTransactionByHash', 'eth_getTransactionCount', 'eth_getTransactionReceipt',
+    'eth_maxPriorityFeePerGas', 'net_version', 'web3_clientVersion',
+])
+
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """HTTPProvider sending requests through the shared HTTP client.
+
+    The connections to the node are pooled across threads, instead of a
+    session per thread, and requests get the timeouts, retries and circuit
+    breaker of the client, so the retry middleware of web3 is not needed.
+
+    """
+
+    def __init__(self, endpoint_uri: str) -> None:
+        super().__init__(endpoint_uri)
+        self.middlewares = ()
+        # bounded apart from the other APIs on the same host
+        self._upstream = f'rpc:{urlparse(endpoint_uri).netloc}'
+        self._batch_counter = itertools.count()
+        self._batch_counter_lock = threading.Lock()
+        self._chain_id_response = None
+
+    def make_request(self, method: str, params: Any) -> Any:
+        if method == 'eth_chainId' and self._chain_id_response is not None:
+            # web3 validates every eth_call against the chain id, which doesn't change for a node
+            return self._chain_id_response
+        request_data = self.encode_rpc_request(method, params)
+        response = http_client.post(
+            self.endpoint_uri,
+            data=request_data,
+            headers=self.get_request_headers(),
+            upstream=self._upstream,
+            idempotent=method in READ_METHODS,
+            max_concurrency=RPC_MAX_CONCURRENCY,
+        )
+        response.raise_for_status()
+        rpc_response = self.decode_rpc_response(response.content)
+        if method == 'eth_chainId' and 'result' in rpc_response:
+            self._chain_id_response = rpc_response
+        return rpc_response
+
+    def make_batch_request(self, requests: List[Tuple[str, List[Any]]]) -> List[Any]:
+        """Send several JSON-RPC requests in one round trip, returning their results in order."""
+        if not requests:
+            return []
+        with self._batch_counter_lock:
+            ids = [next(self._batch_counter) for _ in requests]
+        payload = [
+            dict(jsonrpc='2.0', method=method, params=params, id=request_id)
+            for request_id, (method, params) in zip(ids, requests)
+        ]
+        response = http_client.post(
+            self.endpoint_uri,
+            data=json.dumps(payload),
+            headers=self.get_request_headers(),
+            upstream=self._upstream,
+            idempotent=all(method in READ_METHODS for method, _ in requests),
+            max_concurrency=RPC_MAX_CONCURRENCY,
+        )
+        response.raise_for_status()
+        obj = response.json()
+        if not isinstance(obj, list):
+            # nodes answer a single error when rejecting the whole batch
+            raise ValueError(obj.get('error', obj))
+        # responses can come in any order
+        by_id = {item.get('id'): item for item in obj}
+        results = []
+        for request_id in ids:
+            item = by_id.get(request_id)
+            if item is None:
+                raise ValueError(f'No response for batched request {request_id}')
+            if 'error' in item:
+                raise ValueError(item['error'])
+            results.append(item['result'])
+        return results
+
+
+# bounded, as there is an RPC url per fork
+_web3_by_rpc_url = LRUCache('web3_by_rpc_url', maxsize=100)
+_web3_by_rpc_url_lock = threading.Lock()
+
+
+def get_web3_from_rpc_url(rpc_url: str) -> Web3:
+    """Return the Web3 instance for an RPC url, shared by all threads of the process."""
+    web3 = _web3_by_rpc_url.get(rpc_url)
+    if web3 is None:
+        with _web3_by_rpc_url_lock:
+            web3 = _web3_by_rpc_url.get(rpc_url)
+            if web3 is None:
+                web3 = Web3(PooledHTTPProvider(rpc_url))
+                _web3_by_rpc_url.set(rpc_url, web3)
+    return web3
+
+
+def batch_call(web3: Web3, calls: List[ContractFunction], block_identifier: str = 'latest') -> List[Any]:
+    """Make several contract function calls in one round trip, returning their decoded results in order.
+
+    Each call is a contract function with its arguments, e.g.
+    contract.functions.balanceOf(address), as it would be passed to .call().
+
+    """
+    requests = [
+        ('eth_call', [{'to': call.address, 'data': call._encode_transaction_data()}, block_identifier])
+        for call in calls
+    ]
+    results = web3.provider.make_batch_request(requests)
+    ret = []
+    for call, result in zip(calls, results):
+        output_types = get_abi_output_types(call.abi)
+        # normalized as by .call(), e.g. with checksum addresses
+        output = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, web3.codec.decode(output_types, Web3.to_bytes(hexstr=result)))
+        ret.append(output[0] if len(output) == 1 else output)
+    return ret
+
+
 def get_web3_from_chain_id(chain_id: str) -> Web3:
     if CHAIN_ID_TO_PROD_RPC_URL.get(chain_id) is None:
         raise Exception(f"Chain ID {chain_id} not supported")
@@ -23,11 +154,11 @@ def get_web3_from_chain_id(chain_id: str) -> Web3:
         rpc_url = CHAIN_ID_TO_PROD_RPC_URL[chain_id]
     else:
         rpc_url = CHAIN_ID_TO_TEST_RPC_URL[chain_id]
-    return Web3(Web3.HTTPProvider(rpc_url))
+    return get_web3_from_rpc_url(rpc_url)
 
 def get_web3_provider_from_fork_id(fork_id: str) -> Web3:
     rpc_url = get_fork_url(fork_id)
-    return Web3(Web3.HTTPProvider(rpc_url))
+    return get_web3_from_rpc_url(rpc_url)
 
 def get_fork_id_from_chain_id(chain_id: str) -> str:
     if env.is_prod():
@@ -43,4 +174,4 @@ def get_fork_url(fork_id: str) -> str:
 
 def get_fork_url_from_chain_id(chain_id: str) -> str:
     fork_id = get_fork_id_from_chain_id(chain_id)
-    return get_fork_url(fork_id)
\ No newline at end of file
+    return get_fork_url(fork_id)
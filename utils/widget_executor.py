@@ -0,0 +1,133 @@
+"""
+Registry and executor for widget magic commands.
+
+Commands are registered by name, with metadata on how they can be evaluated.
+Side-effect free commands can be evaluated concurrently on a bounded thread
+pool shared by the process, with the request context of the caller. The
+latency of every command evaluation is recorded in metrics.
+
+The timeout of a command runs from when it starts on the pool, not while it
+is queued for a worker. A command that times out is flagged as cancelled, so
+that it can stop early (see is_cancelled) and free its worker.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generator, Optional, Union
+import contextvars
+import functools
+import threading
+import time
+
+import context
+import utils.metrics as metrics
+from utils.constants import WIDGET_COMMAND_CONCURRENCY
+
+
+DEFAULT_TIMEOUT = 30.0
+
+# seconds a command can wait for a worker before it is given up, on top of its timeout
+QUEUE_TIMEOUT = 30.0
+
+
+@dataclass
+class WidgetCommand:
+    name: str
+    fn: Callable
+    streaming: bool = False  # returns a generator or a callable that streams the response, instead of a str
+    side_effect_free: bool = True  # can be evaluated concurrently with other commands
+    timeout: Optional[float] = DEFAULT_TIMEOUT  # seconds to wait for the result when evaluated concurrently
+
+    def run(self, *params: Any) -> Union[str, Generator, Callable]:
+        start = time.time()
+        ret = self.fn(*params)
+        if isinstance(ret, Generator):
+            return self._timed_generator(ret, start)
+        elif isinstance(ret, Callable):
+            return self._timed_callable(ret, start)
+        self._record_latency(start)
+        return ret if self.streaming else str(ret)
+
+    def _timed_generator(self, ret: Generator, start: float) -> Generator:
+        try:
+            yield from ret
+        finally:
+            self._record_latency(start)
+
+    def _timed_callable(self, ret: Callable, start: float) -> Callable:
+        @functools.wraps(ret)
+        def wrapped_fn(*args, **kwargs):
+            try:
+                return ret(*args, **kwargs)
+            finally:
+                self._record_latency(start)
+        return wrapped_fn
+
+    def _record_latency(self, start: float) -> None:
+        metrics.observe('widget_command.latency', time.time() - start, command=self.name)
+
+
+class CommandTask:
+    """A command submitted to the pool, with when it started running and whether it was abandoned."""
+
+    def __init__(self) -> None:
+        self.future: Optional[Future] = None
+        self.started_at: Optional[float] = None
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+
+
+_commands: Dict[str, WidgetCommand] = {}
+
+_current_task: contextvars.ContextVar[Optional[CommandTask]] = contextvars.ContextVar('widget_command_task', default=None)
+
+_executor = ThreadPoolExecutor(max_workers=WIDGET_COMMAND_CONCURRENCY, thread_name_prefix='widget-command')
+
+
+def register_widget_command(name: str, fn: Callable, **kwargs: Any) -> WidgetCommand:
+    assert name not in _commands, f'duplicate widget command: {name}'
+    widget_command = WidgetCommand(name=name, fn=fn, **kwargs)
+    _commands[name] = widget_command
+    return widget_command
+
+
+def get_widget_command(name: str) -> Optional[WidgetCommand]:
+    return _commands.get(name)
+
+
+def submit(fn: Callable, *args: Any) -> CommandTask:
+    """Run fn on the widget command pool, with the request context and context variables of the caller."""
+    task = CommandTask()
+
+    def run(*args: Any) -> Any:
+        task.started_at = time.time()
+        task.started.set()
+        _current_task.set(task)
+        return fn(*args)
+
+    task.future = _executor.submit(contextvars.copy_context().run, context.run_with_request_context, context.get_request_context(), run, *args)
+    return task
+
+
+def is_cancelled() -> bool:
+    """Whether the command running in this thread timed out, and its result will not be used."""
+    task = _current_task.get()
+    return task is not None and task.cancelled.is_set()
+
+
+def wait(widget_command: WidgetCommand, task: CommandTask) -> Any:
+    """Wait for the result of a command submitted to the pool, up to its timeout once it started."""
+    if not task.started.wait(timeout=QUEUE_TIMEOUT):
+        if task.future.cancel():
+            metrics.incr('widget_command.queue_timeouts', command=widget_command.name)
+            return f'Too busy to evaluate {widget_command.name}, please try again.'
+        # it got a worker just now
+        task.started.wait()
+    timeout = None
+    if widget_command.timeout is not None:
+        timeout = max(0.0, task.started_at + widget_command.timeout - time.time())
+    try:
+        return task.future.result(timeout=timeout)
+    except TimeoutError:
+        task.cancelled.set()
+        metrics.incr('widget_command.timeouts', command=widget_command.name)
+        return f'Timed out evaluating {widget_command.name}, please try again.'
@@ -0,0 +1,112 @@
+"""
+Incremental parser for widget magic commands in streamed responses.
+
+Magic commands have the syntax <|command(param1, param2, ...)|> and can be
+nested, e.g. a display command taking the output of a fetch command as a
+parameter. The parser consumes the response one token at a time, scanning
+each character once, and splits it into text and complete top-level commands
+(with any nested commands) that are ready to be evaluated.
+"""
+from dataclasses import dataclass
+from typing import List, Union
+import re
+
+
+WIDGET_START = '<|'
+WIDGET_END = '|>'
+
+RE_COMMAND = re.compile(r"\<\|(?P<command>[^(]+)\((?P<params>[^)<{}]*)\)\|\>")
+
+
+@dataclass
+class TextEvent:
+    text: str
+
+
+@dataclass
+class CommandEvent:
+    text: str  # the complete command, from its WIDGET_START to the matching WIDGET_END
+
+
+ParserEvent = Union[TextEvent, CommandEvent]
+
+
+class WidgetParser:
+    """Splits a stream of tokens into text and widget commands.
+
+    Text is returned as soon as it is known not to be part of a command. A
+    WIDGET_START or WIDGET_END split across tokens is held back until the
+    next token, and a command is returned once its nesting depth is back to
+    zero. A WIDGET_END outside of a command is just text.
+
+    """
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self._pending = ''  # tail of the last token that could be the start of a marker
+        self._command: List[str] = []  # parts of the command being received
+
+    def feed(self, token: str) -> List[ParserEvent]:
+        if self.depth == 0 and not self._pending and WIDGET_START[0] not in token:
+            # fast path for plain text
+            return [TextEvent(token)] if token else []
+        s = self._pending + token
+        self._pending = ''
+        events: List[ParserEvent] = []
+        pos = 0
+        while pos < len(s):
+            start = s.find(WIDGET_START, pos)
+            if self.depth == 0:
+                if start == -1:
+                    end_of_text = len(s) - self._get_partial_marker_len(s, pos)
+                    if end_of_text > pos:
+                        events.append(TextEvent(s[pos:end_of_text]))
+                    self._pending = s[end_of_text:]
+                    break
+                if start > pos:
+                    events.append(TextEvent(s[pos:start]))
+                pos = start + len(WIDGET_START)
+                self._command.append(WIDGET_START)
+                self.depth = 1
+                continue
+
+            end = s.find(WIDGET_END, pos)
+            if start == -1 and end == -1:
+                end_of_command = len(s) - self._get_partial_marker_len(s, pos)
+                self._command.append(s[pos:end_of_command])
+                self._pending = s[end_of_command:]
+                break
+            if start != -1 and (end == -1 or start < end):
+                self._command.append(s[pos:start + len(WIDGET_START)])
+                pos = start + len(WIDGET_START)
+                self.depth += 1
+            else:
+                self._command.append(s[pos:end + len(WIDGET_END)])
+                pos = end + len(WIDGET_END)
+                self.depth -= 1
+                if self.depth == 0:
+                    events.append(CommandEvent(''.join(self._command)))
+                    self._command = []
+        return events
+
+    def flush(self) -> List[ParserEvent]:
+        """Return any text held back at the end of the stream.
+
+        An incomplete command is dropped, as it cannot be evaluated.
+
+        """
+        events: List[ParserEvent] = []
+        if self.depth == 0 and self._pending:
+            events.append(TextEvent(self._pending))
+        self.depth = 0
+        self._pending = ''
+        self._command = []
+        return events
+
+    def _get_partial_marker_len(self, s: str, pos: int) -> int:
+        # markers are two chars, so at most the last char can be the start of one
+        if len(s) <= pos:
+            return 0
+        if s[-1] == WIDGET_START[0] or (self.depth > 0 and s[-1] == WIDGET_END[0]):
+            return 1
+        return 0